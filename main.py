@@ -3,6 +3,10 @@ from PyQt6.QtWidgets import QApplication
 from src.ui.main_window import MainWindow
 
 if __name__ == "__main__":
+    # Routing worker processes (spawn) must not start the GUI when frozen
+    import multiprocessing
+    multiprocessing.freeze_support()
+
     app = QApplication(sys.argv)
     
     
@@ -0,0 +1,232 @@
+import time
+import numpy as np
+
+from src.core.search import astar_compact, select_trays, commit_trays, release_trays, share_room, pick_tray, dijkstra_tree, tree_path
+from src.core.engine import RouteResult, route_one
+
+
+def set_reduce(graph, values, empty, op=np.maximum):
+    """
+    Reduces a per-tray-slot array (aligned with seg_trays) to one value per tray set.
+    Empty sets (generic segments) get the value empty.
+    """
+    ptr = graph.seg_tray_ptr
+    n_sets = len(ptr) - 1
+    out = np.full(n_sets, empty, dtype=np.float64)
+    starts = ptr[:-1]
+    filled = ptr[1:] > starts
+    if len(values) and filled.any():
+        out[filled] = op.reduceat(values, starts[filled])
+    return out
+
+
+def loose_trays(graph, edges, service, cable_size, load):
+    """
+    Tray choice that never fails: like select_trays, but when no admissible tray has
+    room the one with the most room left takes the cable (and overflows).
+    """
+    v = graph.views()
+    edge_seg = v["edge_seg"]; seg_tray_ptr = v["seg_tray_ptr"]; seg_trays = v["seg_trays"]
+    tray_cap = v["tray_cap"]; tray_adm = v["tray_adm"]; sub_ptr = v["tray_sub_ptr"]; tray_lane = v["tray_lane"]
+    S = graph.n_services; T = graph.n_trays
+
+    chosen = []
+    used = set()
+    lane = -1
+    for e in edges:
+        s = edge_seg[e]
+        a = seg_tray_ptr[s]; b = seg_tray_ptr[s + 1]
+        pick = -1
+        if a != b:
+            pick, _ = pick_tray(v, S, T, a, b, service, cable_size, load, used, lane)
+            if pick < 0:
+                best_room = None
+                for j in range(a, b):
+                    t = seg_trays[j]
+                    if not tray_adm[t * S + service]: continue
+                    room = tray_cap[t] - load[t]
+                    if sub_ptr[t] != sub_ptr[t + 1]: room = min(room, share_room(v, T, t, service, load))
+                    if best_room is None or room > best_room:
+                        best_room = room; pick = t
+            if pick >= 0:
+                used.add(pick)
+                lane = tray_lane[pick]
+        chosen.append(pick)
+    return chosen
+
+
+class AnytimeRouter:
+    """
+    Routing under a time budget (seconds), always holding a complete result.
+    1. cheap: every cable follows the shortest-path tree of its (source, service),
+       trees are cached and capacity is loose (trays may overflow).
+    2. negotiate: cables on overflowed trays are ripped up and re-routed with costs
+       that grow with present overflow and overflow history, until no tray overflows
+       (or no progress is made for `patience` rounds).
+    3. legalize: if overflow is left, cables on overflowed trays are re-routed
+       strictly; those that no longer fit are left unrouted.
+    4. improve: cables are re-routed one by one against the real loads and keep
+       the new path if shorter.
+    The best result of every stage is published through publish(stage, metrics).
+    """
+    def __init__(self, budget=60.0, log=None, publish=None, history_factor=0.5, present_factor=1.0, patience=50):
+        self.budget = budget
+        self.patience = patience  # negotiation rounds without improvement before giving up
+        self.log = log or (lambda msg: None)
+        self.publish = publish or (lambda stage, metrics: None)
+        self.history_factor = history_factor
+        self.present_factor = present_factor
+        self.stats = {}
+
+    def route(self, graph, tasks, load):
+        """Returns: { task.index: RouteResult or None }. load is updated in place."""
+        t0 = time.perf_counter()
+        self.deadline = t0 + self.budget
+        self.graph = graph
+        self.stages = []
+        load_view = memoryview(load)
+        S = graph.n_services
+        self.admissible = [graph.edge_admissible(s) for s in range(S)]
+        admissible_views = [memoryview(m.astype(np.uint8)) for m in self.admissible]
+
+        # 1. Cheap: cached shortest-path trees, loose capacity
+        trees = {}
+        results = {}
+        for task in tasks:
+            key = (task.source, task.service)
+            if key not in trees:
+                trees[key] = dijkstra_tree(graph, task.source, admissible_views[task.service])[1]
+            found = tree_path(graph, trees[key], task.source, task.target)
+            results[task.index] = self._commit_loose(task, found, load_view)
+        best = self._record("cheap", results, load, t0)
+
+        # 2. Negotiate overflow away
+        by_index = {task.index: task for task in tasks}
+        history = np.zeros(graph.n_edges, dtype=np.float64)
+        present = self.present_factor
+        iterations = 0
+        stale = 0
+        while best[2]["overflow"] and stale < self.patience and not self._expired():
+            over_tray = graph.overflowed_trays(load)
+            victims = [t for t in tasks if results[t.index] and over_tray[[x for x in results[t.index].trays if x >= 0]].any()]
+            groups = {}
+            for task in victims:
+                groups.setdefault((task.source, task.service), []).append(task)
+            for (source, service), members in groups.items():
+                if self._expired(): break
+                for task in members:
+                    release_trays(graph, results[task.index].trays, task.service, task.size, load_view)
+                size = max(sum(t.size for t in members) / len(members), 1e-9)
+                cost = memoryview(self._negotiated_cost(service, size, load, history, present))
+                pred = dijkstra_tree(graph, source, admissible_views[service], cost)[1]
+                for task in members:
+                    results[task.index] = self._commit_loose(task, tree_path(graph, pred, source, task.target), load_view)
+            iterations += 1
+            history += self.history_factor * self._overflowed_edges(load)
+            present = min(present * 1.5, 1e6)
+            metrics = self._metrics(results, load)
+            if (metrics["excess"], metrics["length"]) < (best[2]["excess"], best[2]["length"]):
+                best = self._record("negotiate", results, load, t0, metrics)
+                stale = 0
+            else:
+                stale += 1
+
+        results = dict(best[0]); load[:] = best[1]
+
+        # 3. Legalize what is still overflowed
+        if best[2]["overflow"]:
+            over_tray = graph.overflowed_trays(load)
+            ripped = []
+            for task in reversed(tasks):  # lowest priority gives way first
+                res = results.get(task.index)
+                if res is None: continue
+                used = [x for x in set(res.trays) if x >= 0]
+                if not over_tray[used].any(): continue
+                release_trays(graph, res.trays, task.service, task.size, load_view)
+                results[task.index] = None
+                ripped.append(task)
+                over_tray = graph.overflowed_trays(load)
+                if not over_tray.any(): break
+            for task in reversed(ripped):
+                results[task.index] = route_one(graph, by_index[task.index], load_view)
+            self._record("legalize", results, load, t0)
+
+        # 4. Improve lengths against the real loads
+        improved = True
+        while improved and not self._expired():
+            improved = False
+            for task in tasks:
+                if self._expired(): break
+                old = results.get(task.index)
+                if old is None: continue
+                release_trays(graph, old.trays, task.service, task.size, load_view)
+                found = astar_compact(graph, task.source, task.target, task.service, task.size, load_view)
+                trays = None
+                if found and self._length(found[1]) < self._length(old.edges) - 1e-6:
+                    trays = select_trays(graph, found[1], task.service, task.size, load_view)
+                if trays is None:
+                    commit_trays(graph, old.trays, task.service, task.size, load_view)
+                    continue
+                commit_trays(graph, trays, task.service, task.size, load_view)
+                results[task.index] = RouteResult(found[0], found[1], trays)
+                improved = True
+            if improved:
+                self._record("improve", results, load, t0)
+
+        final = self.stages[-1]
+        self.stats = {"mode": "anytime", "tasks": len(tasks), "budget": self.budget, "iterations": iterations,
+                      "stages": self.stages, "length": final["length"], "overflow": final["overflow"],
+                      "unrouted": final["unrouted"], "time": time.perf_counter() - t0}
+        self.log("M: " + self.summary())
+        return results
+
+    def _expired(self):
+        return time.perf_counter() >= self.deadline
+
+    def _length(self, edges):
+        return float(np.sum(self.graph.edge_len[edges])) if len(edges) else 0.0
+
+    def _commit_loose(self, task, found, load_view):
+        if found is None: return None
+        nodes, edges = found
+        trays = loose_trays(self.graph, edges, task.service, task.size, load_view)
+        commit_trays(self.graph, trays, task.service, task.size, load_view)
+        return RouteResult(nodes, edges, trays)
+
+    def _overflowed_edges(self, load):
+        """1.0 for edges whose tray set holds an overflowed tray, else 0.0."""
+        graph = self.graph
+        over = graph.overflowed_trays(load).astype(np.float64)
+        return set_reduce(graph, over[graph.seg_trays], 0.0)[graph.edge_seg]
+
+    def _negotiated_cost(self, service, cable_size, load, history, present):
+        """Edge length scaled by overflow history and by the share of the cable that would not fit."""
+        graph = self.graph
+        room = graph.tray_room(service, load)[graph.seg_trays]
+        edge_room = set_reduce(graph, room, np.inf)[graph.edge_seg]
+        over = np.clip((cable_size - edge_room) / cable_size, 0.0, 1.0)
+        return graph.edge_len * (1.0 + history) * (1.0 + present * over)
+
+    def _metrics(self, results, load):
+        routed = [r for r in results.values() if r is not None]
+        edges = np.concatenate([np.asarray(r.edges, dtype=np.int64) for r in routed]) if routed else np.zeros(0, dtype=np.int64)
+        return {"length": float(np.sum(self.graph.edge_len[edges])),
+                "excess": self.graph.excess(load),
+                "overflow": int(np.count_nonzero(self._overflowed_edges(load))),
+                "unrouted": len(results) - len(routed)}
+
+    def _record(self, stage, results, load, t0, metrics=None):
+        metrics = dict(metrics or self._metrics(results, load))
+        metrics.update(stage=stage, time=time.perf_counter() - t0)
+        self.stages.append(metrics)
+        self.log(f"M: Anytime {stage}: length {metrics['length']:.1f}, overflowed segments {metrics['overflow']}, "
+                 f"unrouted {metrics['unrouted']}, {metrics['time']:.2f}s")
+        self.publish(stage, metrics)
+        return (dict(results), load.copy(), metrics)
+
+    def summary(self):
+        st = self.stats
+        return (f"Routing anytime: {st.get('tasks', 0)} tasks, budget {st.get('budget', 0):.0f}s, "
+                f"{len(st.get('stages', []))} stages, {st.get('iterations', 0)} negotiation rounds, "
+                f"length {st.get('length', 0):.1f}, overflowed segments {st.get('overflow', 0)}, "
+                f"unrouted {st.get('unrouted', 0)}, {st.get('time', 0):.2f}s")
@@ -0,0 +1,61 @@
+import numpy as np
+
+
+class UnionFind:
+    """Disjoint sets over integer ids (path halving + union by size)."""
+    def __init__(self, n):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, a):
+        parent = self.parent
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    def union(self, a, b):
+        ra = self.find(a); rb = self.find(b)
+        if ra == rb: return
+        if self.size[ra] < self.size[rb]: ra, rb = rb, ra
+        self.parent[rb] = ra
+        self.size[ra] += self.size[rb]
+
+    def labels(self):
+        """Compact component label per id (0..k-1, in order of first appearance)."""
+        roots = [self.find(a) for a in range(len(self.parent))]
+        _, labels = np.unique(np.asarray(roots, dtype=np.int64), return_inverse=True)
+        return labels.astype(np.int32)
+
+
+class ServiceComponents:
+    """
+    Connected components of the routing graph per service id, built once per run.
+    Only edges that may carry the service are used (generic edges or an admissible
+    tray, capacity ignored), so two nodes in different components can never be
+    joined by a cable of that service.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        u, v = graph.edge_endpoints()
+        self.labels = np.zeros((graph.n_services, graph.n_nodes), dtype=np.int32)
+        self.counts = []
+        for s in range(graph.n_services):
+            mask = graph.edge_admissible(s)
+            uf = UnionFind(graph.n_nodes)
+            for a, b in zip(u[mask].tolist(), v[mask].tolist()):
+                uf.union(a, b)
+            self.labels[s] = uf.labels()
+            self.counts.append(int(self.labels[s].max()) + 1 if graph.n_nodes else 0)
+
+    def connected(self, service, a, b):
+        """O(1) check: True if nodes a and b can be joined by the service."""
+        if service < 0: return True
+        return self.labels[service, a] == self.labels[service, b]
+
+    def edge_components(self, service):
+        """Component label per edge for the service (-1 for edges the service can't use)."""
+        u, _ = self.graph.edge_endpoints()
+        labels = self.labels[service][u].copy()
+        labels[~self.graph.edge_admissible(service)] = -1
+        return labels
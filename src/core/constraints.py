@@ -0,0 +1,62 @@
+import re
+import numpy as np
+
+from src.core.graph import normalize_service, tray_fields, tray_name
+
+_COORD = re.compile(r"^\(?\s*(-?\d+(?:\.\d*)?)\s*[, ]\s*(-?\d+(?:\.\d*)?)\s*\)?$")
+
+
+def parse_tokens(value):
+    """Splits a Via/Avoid cell ("QG1; 120,45; Riser B") into stripped tokens."""
+    if value is None: return []
+    return [t.strip() for t in str(value).replace("|", ";").split(";") if t.strip()]
+
+
+def resolve_point(graph, token, named_nodes):
+    """
+    Node id for a token: a switchboard name (named_nodes) or "x,y" drawing
+    coordinates, snapped to the nearest graph node. Returns None if unknown.
+    """
+    if token in named_nodes: return named_nodes[token]
+    m = _COORD.match(token)
+    if m is None or not graph.n_nodes: return None
+    x, y = float(m.group(1)), float(m.group(2))
+    return int(np.argmin((graph.x - x) ** 2 + (graph.y - y) ** 2))
+
+
+def resolve_via(graph, value, named_nodes):
+    """Returns: (waypoint node ids in order, unknown tokens)"""
+    nodes = []; unknown = []
+    for token in parse_tokens(value):
+        n = resolve_point(graph, token, named_nodes)
+        if n is None: unknown.append(token)
+        else: nodes.append(n)
+    return nodes, unknown
+
+
+def resolve_avoid(graph, value, named_nodes):
+    """
+    Edge bitset for an Avoid cell. A token selects the segments carrying a tray of
+    that service or type name (e.g. "Mixed ATEX", "100x60 mm"), or all segments
+    touching a point (switchboard name or "x,y").
+    Returns: (bytes bitset or None, unknown tokens)
+    """
+    tokens = parse_tokens(value)
+    if not tokens: return None, []
+    mask = np.zeros(graph.n_edges, dtype=bool)
+    u, v = graph.edge_endpoints()
+    services = [normalize_service(tray_fields(t)[0]) for t in graph.trays]
+    names = [normalize_service(tray_name(t)) for t in graph.trays]
+    unknown = []
+    for token in tokens:
+        key = normalize_service(token)
+        trays = np.array([s == key or n == key for s, n in zip(services, names)], dtype=bool)
+        if trays.any():
+            mask |= graph.edges_with_trays(trays)
+            continue
+        n = resolve_point(graph, token, named_nodes)
+        if n is None:
+            unknown.append(token)
+            continue
+        mask |= (u == n) | (v == n)
+    return np.packbits(mask, bitorder='little').tobytes(), unknown
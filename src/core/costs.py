@@ -0,0 +1,91 @@
+import math
+import numpy as np
+
+from src.core.graph import normalize_service, tray_fields
+
+
+class CostModel:
+    """
+    Multi-criteria edge cost for routing on a CompactGraph:
+        length * (w_length + w_preference * pref[service] + w_fill * fill²) + w_bend per bend
+    pref is 0 on segments with a tray dedicated to the service, 0.5 on segments with
+    only shared (Mixed) trays and 1 on segments without trays. fill is the fill ratio
+    the cable would leave in the tray it takes. A bend is a change of heading larger
+    than bend_angle degrees between consecutive edges.
+    The static part (length and preference) and the edge headings are precomputed as
+    arrays, so a search only adds the fill term and the bend check per expansion.
+    """
+    WEIGHTS = {"length": 1.0, "bend": 0.0, "fill": 0.0, "preference": 0.0, "bend_angle": 20.0}
+    ARRAYS = ("cost_static", "cost_heading", "cost_weights")
+
+    def __init__(self, weights, static, heading):
+        self.weights = dict(self.WEIGHTS)
+        self.weights.update({k: float(v) for k, v in (weights or {}).items() if k in self.WEIGHTS})
+        self.static = static      # (n_services, n_edges) length + preference cost
+        self.heading = heading    # per adjacency entry, radians
+        self._views = None
+
+    @classmethod
+    def from_graph(cls, graph, weights=None):
+        w = dict(cls.WEIGHTS); w.update(weights or {})
+        static = np.float64(w["length"]) * graph.edge_len[None, :] + \
+            np.float64(w["preference"]) * graph.edge_len[None, :] * cls.preference_table(graph)
+        return cls(w, np.ascontiguousarray(static), cls.headings(graph))
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuilds a model published with arrays() (e.g. in a worker process)."""
+        w = arrays["cost_weights"]
+        weights = dict(zip(("length", "bend", "fill", "preference", "bend_angle"), w.tolist()))
+        return cls(weights, arrays["cost_static"], arrays["cost_heading"])
+
+    def arrays(self):
+        w = self.weights
+        return {"cost_static": self.static, "cost_heading": self.heading,
+                "cost_weights": np.array([w["length"], w["bend"], w["fill"], w["preference"], w["bend_angle"]], dtype=np.float64)}
+
+    def with_weights(self, weights):
+        """
+        Copy with some weights replaced, sharing the precomputed arrays. Only the
+        terms applied during the search (bend, fill, bend_angle) may change.
+        """
+        return CostModel({**self.weights, **weights}, self.static, self.heading)
+
+    def is_plain(self):
+        """True if the model is pure length (the plain A* gives the same paths)."""
+        w = self.weights
+        return w["length"] == 1.0 and not w["bend"] and not w["fill"] and not w["preference"]
+
+    def views(self):
+        if self._views is None:
+            self._views = {"static": [memoryview(row) for row in self.static], "heading": memoryview(self.heading)}
+        return self._views
+
+    @staticmethod
+    def headings(graph):
+        """Heading of every adjacency entry (from its node towards the neighbour)."""
+        owner = np.repeat(np.arange(graph.n_nodes), np.diff(graph.indptr))
+        nb = graph.indices
+        return np.ascontiguousarray(np.arctan2(graph.y[nb] - graph.y[owner], graph.x[nb] - graph.x[owner]))
+
+    @staticmethod
+    def preference_table(graph):
+        """(n_services, n_edges): 0 dedicated tray, 0.5 shared trays only, 1 no trays."""
+        S = graph.n_services
+        ptr = graph.seg_tray_ptr
+        n_sets = len(ptr) - 1
+        dedicated_of = np.full(graph.n_trays, -1, dtype=np.int64)
+        for t, tray in enumerate(graph.trays):
+            name = normalize_service(tray_fields(tray)[0])
+            if name in graph.services: dedicated_of[t] = graph.services.index(name)
+
+        table = np.full((S, n_sets), 0.5, dtype=np.float64)
+        table[:, np.diff(ptr) == 0] = 1.0
+        slot_set = np.repeat(np.arange(n_sets), np.diff(ptr))
+        slot_service = dedicated_of[graph.seg_trays] if len(graph.seg_trays) else np.zeros(0, dtype=np.int64)
+        mask = slot_service >= 0
+        table[slot_service[mask], slot_set[mask]] = 0.0
+        return table[:, graph.edge_seg]
+
+    def bend_tolerance(self):
+        return math.radians(self.weights["bend_angle"])
@@ -0,0 +1,115 @@
+import numpy as np
+
+from src.core.search import astar_compact, astar_cost, select_trays, commit_trays, dijkstra_tree, tree_path
+
+
+class RouteTask:
+    """
+    One cable to route on a CompactGraph: node ids, service id and cable area (mm²).
+    Optional constraints: via (waypoint node ids, in order) and avoid (edge bitset bytes).
+    """
+    __slots__ = ("index", "source", "target", "service", "size", "via", "avoid")
+
+    def __init__(self, index, source, target, service, size, via=(), avoid=None):
+        self.index = index      # position in the connection list
+        self.source = source
+        self.target = target
+        self.service = service
+        self.size = size
+        self.via = tuple(via)
+        self.avoid = avoid
+
+    def as_tuple(self):
+        return (self.index, self.source, self.target, self.service, self.size, self.via, self.avoid)
+
+    def constrained(self):
+        return bool(self.via) or self.avoid is not None
+
+
+class RouteResult:
+    """Routed cable: node ids, edge ids and the tray carrying it on each edge (-1 = generic)."""
+    __slots__ = ("nodes", "edges", "trays")
+
+    def __init__(self, nodes, edges, trays):
+        self.nodes = nodes
+        self.edges = edges
+        self.trays = trays
+
+
+def find_path(graph, task, load, model=None):
+    """
+    Path search for a task: plain A* on lengths, or A* on the CostModel if one is given.
+    Waypoints split the search into legs (see via_path); avoid edges are never used.
+    """
+    if task.via: return via_path(graph, task, load, model)
+    return _search(graph, task.source, task.target, task, load, model)
+
+
+def _search(graph, start, goal, task, load, model):
+    if model is None or model.is_plain():
+        return astar_compact(graph, start, goal, task.service, task.size, load, task.avoid)
+    return astar_cost(graph, start, goal, task.service, task.size, load, model, task.avoid)
+
+
+def cached_tree(graph, source, service, avoid=None):
+    """
+    Shortest-path tree (capacity ignored) from source for a service and avoid bitset,
+    cached on the graph: cables through the same waypoint share it.
+    Returns: pred_edge list.
+    """
+    key = (source, service, avoid)
+    tree = graph.trees.get(key)
+    if tree is None:
+        admissible = graph.edge_admissible(service)
+        if avoid is not None:
+            admissible &= ~np.unpackbits(np.frombuffer(avoid, dtype=np.uint8), count=graph.n_edges, bitorder='little').astype(bool)
+        tree = graph.trees[key] = dijkstra_tree(graph, source, memoryview(admissible.astype(np.uint8)))[1]
+    return tree
+
+
+def via_path(graph, task, load, model=None):
+    """
+    Path source -> via[0] -> ... -> target. Each leg follows the cached shortest-path
+    tree of its start point when its trays have room, otherwise it is searched against
+    the loads. Legs sharing trays load them once (select_trays reuses them).
+    Returns: (nodes, edges) or None.
+    """
+    stops = [task.source] + list(task.via) + [task.target]
+    nodes = [task.source]; edges = []
+    plain = model is None or model.is_plain()
+    for a, b in zip(stops, stops[1:]):
+        if a == b: continue
+        leg = None
+        if plain:
+            leg = tree_path(graph, cached_tree(graph, a, task.service, task.avoid), a, b)
+            if leg is None: return None  # unreachable even with empty trays
+            if select_trays(graph, edges + leg[1], task.service, task.size, load) is None:
+                leg = None
+        if leg is None:
+            leg = _search(graph, a, b, task, load, model)
+            if leg is None: return None
+        nodes += leg[0][1:]; edges += leg[1]
+    return nodes, edges
+
+
+def route_one(graph, task, load, model=None):
+    """Routes and commits a single task against the current loads. Returns RouteResult or None."""
+    found = find_path(graph, task, load, model)
+    if found is None: return None
+    nodes, edges = found
+    trays = select_trays(graph, edges, task.service, task.size, load)
+    if trays is None: return None
+    commit_trays(graph, trays, task.service, task.size, load)
+    return RouteResult(nodes, edges, trays)
+
+
+def route_serial(graph, tasks, load, model=None):
+    """
+    Sequential routing in task order; each cable sees the load left by the previous ones.
+    Returns: { task.index: RouteResult or None }
+    """
+    load_view = memoryview(load)
+    results = {}
+    for task in tasks:
+        results[task.index] = route_one(graph, task, load_view, model)
+    return results
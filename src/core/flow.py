@@ -0,0 +1,238 @@
+import time
+import itertools
+import numpy as np
+
+from src.core.search import shortest_path_cost, shortest_path_set_cost, select_trays, commit_trays
+from src.core.engine import RouteResult, route_one
+
+try:
+    from scipy import sparse
+    from scipy.optimize import linprog
+except ImportError:  # optional solver, the mode falls back to greedy routing
+    sparse = None
+    linprog = None
+
+
+def solver_available():
+    return linprog is not None
+
+
+class FlowRouter:
+    """
+    Global routing as a min-cost multicommodity flow.
+    Every (source, target, service) bundle is a commodity whose demand is its number
+    of cables; tray effective capacity (mm²) bounds the flow through each tray set.
+    The path-based LP is solved with HiGHS by column generation: new paths are priced
+    with the capacity duals, each tray set's rows charged once per path as in the LP,
+    until no path with negative reduced cost is left. The LP is then rounded cable by
+    cable to integral paths committed against the real tray loads, so the result never
+    overflows; cables left without a fitting LP path are routed greedily (stats
+    "lp_routed" and "fallback").
+    """
+    def __init__(self, max_iterations=50, max_columns=16, log=None):
+        self.max_iterations = max_iterations
+        self.max_columns = max_columns  # per commodity
+        self.log = log or (lambda msg: None)
+        self.stats = {}
+
+    def route(self, graph, tasks, load):
+        """Returns: { task.index: RouteResult or None }. load is updated in place."""
+        if not tasks:
+            # Every cable was routed or rejected before the global pass
+            self.stats = {}
+            return {}
+        t0 = time.perf_counter()
+        load_view = memoryview(load)
+        if not solver_available():
+            self.log("M: SciPy not available, global flow mode falls back to greedy routing.")
+            results = {task.index: route_one(graph, task, load_view) for task in tasks}
+            self.stats = {"mode": "serial", "tasks": len(tasks), "time": time.perf_counter() - t0}
+            return results
+
+        # Commodities
+        commodities = {}
+        for task in tasks:
+            commodities.setdefault((task.source, task.target, task.service), []).append(task)
+        keys = list(commodities.keys())
+        key_index = {key: k for k, key in enumerate(keys)}
+        demand = np.array([len(commodities[k]) for k in keys], dtype=np.float64)
+        area = np.array([np.mean([t.size for t in commodities[k]]) for k in keys], dtype=np.float64)
+
+        self._prepare(graph, load)
+        admissible = [memoryview(graph.edge_admissible(s).astype(np.uint8)) for s in range(graph.n_services)]
+        length_view = graph.views()["edge_len"]
+        penalty = float(np.sum(graph.edge_len)) + 1.0  # cost of an unrouted cable
+
+        # Initial columns: shortest admissible path per commodity
+        columns = []  # (commodity, nodes, edges, length, rows)
+        col_keys = set()
+        col_count = [0] * len(keys)
+        for k, (src, dst, svc) in enumerate(keys):
+            found = shortest_path_cost(graph, src, dst, admissible[svc], length_view)
+            if found: col_count[k] += self._add_column(columns, col_keys, k, found, svc)
+
+        res = None
+        iterations = 0
+        converged = False
+        for iterations in range(1, self.max_iterations + 1):
+            res = self._solve(columns, keys, demand, area, penalty)
+            if res is None: break
+            pi = res.eqlin.marginals
+            dual = -res.ineqlin.marginals if len(self.row_cap) else np.zeros(0)  # >= 0, per mm²
+            prices = self._set_prices(graph, dual)
+
+            priced_services = prices.any(axis=1).tolist()
+            added = 0; priced = 0
+            for k, (src, dst, svc) in enumerate(keys):
+                if priced_services[svc]:
+                    found = shortest_path_set_cost(graph, src, dst, admissible[svc], memoryview(area[k] * prices[svc]))
+                else:  # no binding capacity for the service: plain shortest path
+                    found = shortest_path_cost(graph, src, dst, admissible[svc], length_view)
+                if not found or found[2] >= pi[k] - 1e-6: continue
+                # Exact reduced cost: every capacity row of the path counted once
+                rows = self._column_rows(found[1], svc)
+                if self._length(found[1]) + area[k] * float(np.sum(dual[rows])) >= pi[k] - 1e-6: continue
+                priced += 1
+                if col_count[k] >= self.max_columns: continue
+                new = self._add_column(columns, col_keys, k, found, svc)
+                col_count[k] += new
+                added += new
+            if not priced: converged = True
+            if not added: break
+
+        # Fractional allocation (cables per column)
+        alloc = {}
+        if res is not None:
+            for j, col in enumerate(columns):
+                if res.x[j] > 1e-6:
+                    alloc.setdefault(col[0], []).append([res.x[j], j])
+
+        # Rounding in task (priority) order: each cable takes the column with most remaining allocation that still fits
+        results = {}
+        fallback = 0
+        fallback_routed = 0
+        for task in tasks:
+            k = key_index[(task.source, task.target, task.service)]
+            placed = False
+            for entry in sorted(alloc.get(k, []), key=lambda a: (-a[0], columns[a[1]][3])):
+                _, nodes, edges, _, _ = columns[entry[1]]
+                trays = select_trays(graph, edges, task.service, task.size, load_view)
+                if trays is None: continue
+                commit_trays(graph, trays, task.service, task.size, load_view)
+                results[task.index] = RouteResult(list(nodes), list(edges), trays)
+                entry[0] -= 1.0
+                placed = True
+                break
+            if not placed:
+                fallback += 1
+                results[task.index] = route_one(graph, task, load_view)
+                if results[task.index] is not None: fallback_routed += 1
+
+        self.stats = {
+            "mode": "flow",
+            "tasks": len(tasks),
+            "commodities": len(keys),
+            "columns": len(columns),
+            "iterations": iterations,
+            "converged": converged,
+            "lp_objective": float(res.fun) if res is not None else None,
+            "lp_routed": len(tasks) - fallback,
+            "fallback": fallback,
+            "fallback_routed": fallback_routed,
+            "time": time.perf_counter() - t0,
+        }
+        self.log("M: " + self.summary())
+        return results
+
+    def _prepare(self, graph, load):
+        """Capacity rows per (tray set, service subset). Exact (Hall) for up to 6 services per set."""
+        S = graph.n_services
+        self.edge_len = graph.edge_len
+        self.edge_seg = graph.edge_seg
+        adm = graph.tray_adm.reshape(-1, S).astype(bool) if S else np.zeros((0, 0), dtype=bool)
+        self.set_rows = {}   # set id -> [(row, services frozenset)]
+        self.row_cap = []
+        n_sets = len(graph.seg_tray_ptr) - 1
+        room = [graph.tray_room(s, load) for s in range(S)]
+        for sid in range(n_sets):
+            a, b = graph.seg_tray_ptr[sid], graph.seg_tray_ptr[sid + 1]
+            if a == b: continue
+            trays = graph.seg_trays[a:b]
+            present = [s for s in range(S) if adm[trays, s].any()]
+            if len(present) <= 6:
+                subsets = [c for r in range(1, len(present) + 1) for c in itertools.combinations(present, r)]
+            else:
+                subsets = [(s,) for s in present] + [tuple(present)]
+            rows = []
+            for q in subsets:
+                mask = adm[trays][:, list(q)].any(axis=1)
+                if len(q) == 1:  # single service: Mixed tray shares apply
+                    cap = float(np.sum(np.maximum(room[q[0]][trays][mask], 0.0)))
+                else:
+                    cap = float(np.sum(graph.tray_cap[trays][mask]) - np.sum(load[trays][mask]))
+                rows.append((len(self.row_cap), frozenset(q)))
+                self.row_cap.append(max(cap, 0.0))
+            self.set_rows[sid] = rows
+        self.row_cap = np.asarray(self.row_cap, dtype=np.float64)
+        self.n_sets = n_sets
+
+    def _length(self, edges):
+        return float(np.sum(self.edge_len[edges]))
+
+    def _column_rows(self, edges, svc):
+        """Capacity rows used by a path of the service, each once."""
+        rows = []
+        for sid in set(self.edge_seg[edges].tolist()):
+            for row, q in self.set_rows.get(sid, []):
+                if svc in q: rows.append(row)
+        return rows
+
+    def _add_column(self, columns, col_keys, k, found, svc):
+        nodes, edges, _ = found
+        key = (k, tuple(edges))
+        if key in col_keys: return 0
+        col_keys.add(key)
+        columns.append((k, nodes, edges, self._length(edges), self._column_rows(edges, svc)))
+        return 1
+
+    def _solve(self, columns, keys, demand, area, penalty):
+        n_cols = len(columns); K = len(keys)
+        if K == 0: return None
+        c = np.concatenate([np.array([col[3] for col in columns], dtype=np.float64), np.full(K, penalty)])
+
+        eq_rows = [col[0] for col in columns] + list(range(K))
+        eq_cols = list(range(n_cols + K))
+        A_eq = sparse.csr_matrix((np.ones(len(eq_rows)), (eq_rows, eq_cols)), shape=(K, n_cols + K))
+
+        ub_rows, ub_cols, ub_vals = [], [], []
+        for j, col in enumerate(columns):
+            for row in col[4]:
+                ub_rows.append(row); ub_cols.append(j); ub_vals.append(area[col[0]])
+        n_rows = len(self.row_cap)
+        kwargs = {}
+        if n_rows:
+            kwargs["A_ub"] = sparse.csr_matrix((ub_vals, (ub_rows, ub_cols)), shape=(n_rows, n_cols + K))
+            kwargs["b_ub"] = self.row_cap
+        res = linprog(c, A_eq=A_eq, b_eq=demand, bounds=(0, None), method="highs", **kwargs)
+        if res.status != 0:
+            self.log(f"M: Flow LP not solved: {res.message}")
+            return None
+        return res
+
+    def _set_prices(self, graph, dual):
+        """(n_services, n_sets) dual price per mm² of a tray set: sum of its rows covering the service."""
+        prices = np.zeros((graph.n_services, self.n_sets), dtype=np.float64)
+        for sid, rows in self.set_rows.items():
+            for row, q in rows:
+                if dual[row] <= 1e-12: continue
+                for svc in q: prices[svc, sid] += dual[row]
+        return prices
+
+    def summary(self):
+        st = self.stats
+        if st.get("mode") != "flow":
+            return f"Routing {st.get('mode')}: {st.get('tasks', 0)} tasks, {st.get('time', 0):.2f}s"
+        return (f"Routing flow: {st['tasks']} tasks, {st['commodities']} commodities, {st['columns']} paths, "
+                f"{st['iterations']} LP iterations{'' if st['converged'] else ' (not converged)'}, "
+                f"{st['lp_routed']} cables on LP paths, {st['fallback']} by greedy fallback ({st['fallback_routed']} routed), "
+                f"{st['time']:.2f}s")
@@ -0,0 +1,354 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+
+def normalize_service(name):
+    return str(name).strip().lower()
+
+
+def tray_fields(tray):
+    """
+    Normalized access to tray data (TrayInstance object or dict).
+    Returns: (service, capacity, current_load, included_services, max_fill_percent)
+    """
+    if hasattr(tray, 'service'):
+        return (tray.service, tray.capacity, tray.current_load,
+                getattr(tray, 'included_services', []), getattr(tray, 'max_fill_percent', 80.0))
+    if isinstance(tray, dict):
+        return (tray.get('service', 'Unassigned'), tray.get('capacity', 0), tray.get('current_load', 0),
+                tray.get('included_services', []), tray.get('max_fill_percent', 80.0))
+    return ("Unassigned", 0, 0, [], 80.0)
+
+
+def tray_name(tray):
+    """Tray type name (e.g. "100x60 mm") of a TrayInstance or dict."""
+    if isinstance(tray, dict): return tray.get('name', '')
+    return getattr(tray, 'name', '')
+
+
+def tray_admits(tray_service, included_services, cable_type):
+    """
+    Segregation rule: a Mixed tray accepts the services listed in
+    included_services (all of them if the list is empty), other trays only their own service.
+    """
+    ts = normalize_service(tray_service)
+    ct = normalize_service(cable_type)
+    if ts.startswith("mixed"):
+        allowed = []
+        for x in included_services or []:
+            if isinstance(x, dict): allowed.append(str(x.get('name', '')).lower())
+            elif isinstance(x, str): allowed.append(x.lower())
+        return not allowed or ct in allowed
+    return ts == ct
+
+
+class CompactGraph:
+    """
+    Array form of the routing graph.
+    Nodes and edges get integer ids; adjacency is stored in CSR form (indptr/indices,
+    half_edge maps each adjacency entry to its undirected edge). Trays are flattened:
+    every edge points to a tray set (edge_seg), every tray set to a slice of seg_trays.
+    Tray admissibility per service is a flat uint8 table tray_adm[tray * n_services + service].
+    Edges whose tray set is empty are generic (any service, unlimited capacity).
+    Mixed trays with a percentage per included service get sub-capacity slots
+    (tray_sub_ptr per tray into sub_service/sub_cap). A run load array holds the
+    per-tray totals first, then the per-slot service loads: load[n_trays + slot].
+    tray_lane groups the trays that continue each other along a run (same service,
+    type and position within their segment), so a cable can stay in its lane.
+    """
+    ARRAYS = ("x", "y", "indptr", "indices", "half_edge", "edge_len", "edge_seg",
+              "seg_tray_ptr", "seg_trays", "tray_cap", "tray_adm", "tray_sub_ptr", "sub_service", "sub_cap", "tray_lane")
+
+    def __init__(self, arrays, n_services, services=None, node_keys=None, edge_keys=None, trays=None):
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.n_services = n_services
+        self.services = services or []
+        self.node_keys = node_keys or []
+        self.node_index = {k: i for i, k in enumerate(self.node_keys)}
+        self.edge_keys = edge_keys or []
+        self.trays = trays or []
+        self._views = None
+        self._endpoints = None
+        self.trees = {}  # shortest-path tree cache (engine.cached_tree)
+
+    @property
+    def n_nodes(self): return len(self.x)
+
+    @property
+    def n_edges(self): return len(self.edge_len)
+
+    @property
+    def n_trays(self): return len(self.tray_cap)
+
+    @property
+    def n_sub(self): return len(self.sub_cap)
+
+    def service_id(self, cable_type):
+        try: return self.services.index(normalize_service(cable_type))
+        except ValueError: return -1
+
+    def views(self):
+        """Memoryviews of the arrays: zero-copy and fast scalar indexing from Python."""
+        if self._views is None:
+            self._views = {name: memoryview(getattr(self, name)) for name in self.ARRAYS}
+        return self._views
+
+    def edge_admissible(self, service):
+        """Boolean array over edges: True where the service may run (generic edge or admissible tray), capacity ignored."""
+        return self.edge_fits_mask(service)
+
+    def edge_fits_mask(self, service, cable_size=0.0, load=None):
+        """
+        Boolean array over edges: True where a cable of the service and size fits
+        (generic edge, or an admissible tray with room under load). load None ignores capacity.
+        """
+        n_seg = len(self.seg_tray_ptr) - 1
+        counts = np.diff(self.seg_tray_ptr)
+        seg_ok = counts == 0
+        if len(self.seg_trays) and self.n_services:
+            if load is None:
+                tray_ok = self.tray_adm.reshape(-1, self.n_services)[:, service].astype(bool)
+            else:
+                tray_ok = self.tray_room(service, load) >= cable_size
+            owner = np.repeat(np.arange(n_seg), counts)
+            np.logical_or.at(seg_ok, owner, tray_ok[self.seg_trays])
+        return seg_ok[self.edge_seg]
+
+    def edges_with_trays(self, tray_mask):
+        """Boolean array over edges: True where the segment carries a tray selected by tray_mask."""
+        counts = np.diff(self.seg_tray_ptr)
+        seg_hit = np.zeros(len(counts), dtype=bool)
+        if len(self.seg_trays):
+            owner = np.repeat(np.arange(len(counts)), counts)
+            np.logical_or.at(seg_hit, owner, np.asarray(tray_mask, dtype=bool)[self.seg_trays])
+        return seg_hit[self.edge_seg]
+
+    def tray_room(self, service, load):
+        """
+        Room left per tray for a cable of the service: effective capacity minus the
+        total load, limited by the service share on Mixed trays (-inf where not admissible).
+        """
+        load = np.asarray(load)
+        T = self.n_trays
+        room = self.tray_cap - load[:T]
+        if self.n_sub:
+            mine = self.sub_service == service
+            owner = np.repeat(np.arange(T), np.diff(self.tray_sub_ptr))[mine]
+            room[owner] = np.minimum(room[owner], self.sub_cap[mine] - load[T:][mine])
+        if self.n_services:
+            room[~self.tray_adm.reshape(-1, self.n_services)[:, service].astype(bool)] = -np.inf
+        return room
+
+    def overflowed_trays(self, load, eps=1e-9):
+        """Boolean per tray: total load or some service share over capacity."""
+        load = np.asarray(load)
+        T = self.n_trays
+        over = load[:T] > self.tray_cap + eps
+        if self.n_sub:
+            owner = np.repeat(np.arange(T), np.diff(self.tray_sub_ptr))
+            over[owner[load[T:] > self.sub_cap + eps]] = True
+        return over
+
+    def excess(self, load):
+        """Total area (mm²) over capacity, service shares included."""
+        load = np.asarray(load)
+        T = self.n_trays
+        return float(np.sum(np.maximum(load[:T] - self.tray_cap, 0.0)) +
+                     np.sum(np.maximum(load[T:] - self.sub_cap, 0.0)))
+
+    def edge_endpoints(self):
+        """Returns (u, v) node id arrays per edge, recovered from the CSR arrays."""
+        src = np.repeat(np.arange(self.n_nodes, dtype=np.int32), np.diff(self.indptr))
+        # The first half-edge of every edge gives (u, v); the second one is (v, u)
+        order = np.argsort(self.half_edge, kind='stable')
+        first_pos = order[::2] if self.n_edges else order
+        return src[first_pos], np.asarray(self.indices)[first_pos]
+
+    def edge_endpoints_lists(self):
+        """edge_endpoints as Python lists (cached), for per-edge lookups inside searches."""
+        if self._endpoints is None:
+            u, v = self.edge_endpoints()
+            self._endpoints = (u.tolist(), v.tolist())
+        return self._endpoints
+
+    def new_load(self):
+        """Load array for a routing run: per-tray totals, then service share slots (all empty)."""
+        return np.zeros(self.n_trays + self.n_sub, dtype=np.float64)
+
+    def store_load(self, load):
+        """Writes the per-tray loads back into the tray objects."""
+        for t, tray in enumerate(self.trays):
+            if hasattr(tray, 'current_load'): tray.current_load = float(load[t])
+            elif isinstance(tray, dict): tray['current_load'] = float(load[t])
+
+    @classmethod
+    def from_graph(cls, graph, cable_types):
+        """
+        Builds the compact graph from the dict graph of routing.build_routing_graph
+        (after add_virtual_nodes). cable_types are the services requested by the run.
+        """
+        services = []
+        for ct in cable_types:
+            n = normalize_service(ct)
+            if n not in services: services.append(n)
+
+        node_keys = list(graph.keys())
+        index = {k: i for i, k in enumerate(node_keys)}
+        for adj in graph.values():
+            for _, nb, _ in adj:
+                if nb not in index:
+                    index[nb] = len(node_keys)
+                    node_keys.append(nb)
+
+        # Unique trays (by object) and unique tray sets
+        tray_index = {}
+        trays = []
+        set_index = {(): 0}
+        sets = [()]
+
+        eu, ev, elen, eseg = [], [], [], []
+        for k, adj in graph.items():
+            u = index[k]
+            for dist, nb, props in adj:
+                v = index[nb]
+                if v <= u: continue  # each undirected edge once (self loops dropped)
+                ids = []
+                for t in (props.get("trays", []) if props else []):
+                    tid = tray_index.get(id(t))
+                    if tid is None:
+                        tid = tray_index[id(t)] = len(trays)
+                        trays.append(t)
+                    ids.append(tid)
+                ids = tuple(ids)
+                sid = set_index.get(ids)
+                if sid is None:
+                    sid = set_index[ids] = len(sets)
+                    sets.append(ids)
+                eu.append(u); ev.append(v); elen.append(float(dist)); eseg.append(sid)
+
+        n = len(node_keys)
+        m = len(eu)
+        eu = np.asarray(eu, dtype=np.int32); ev = np.asarray(ev, dtype=np.int32)
+
+        src = np.concatenate([eu, ev])
+        dst = np.concatenate([ev, eu])
+        he = np.concatenate([np.arange(m, dtype=np.int32), np.arange(m, dtype=np.int32)])
+        order = np.argsort(src, kind='stable')
+        indptr = np.zeros(n + 1, dtype=np.int32)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+
+        seg_tray_ptr = np.zeros(len(sets) + 1, dtype=np.int32)
+        np.cumsum([len(s) for s in sets], out=seg_tray_ptr[1:])
+        seg_trays = np.fromiter((t for s in sets for t in s), dtype=np.int32)
+
+        S = len(services)
+        # Lanes: (service, tray type, n-th tray of that kind in its segment)
+        tray_lane = np.full(len(trays), -1, dtype=np.int32)
+        lanes = {}
+        for ids in sets:
+            seen = {}
+            for tid in ids:
+                kind = (normalize_service(tray_fields(trays[tid])[0]), tray_name(trays[tid]))
+                nth = seen.get(kind, 0); seen[kind] = nth + 1
+                if tray_lane[tid] < 0:
+                    tray_lane[tid] = lanes.setdefault(kind + (nth,), len(lanes))
+
+        tray_cap = np.zeros(len(trays), dtype=np.float64)
+        tray_adm = np.zeros(len(trays) * S, dtype=np.uint8)
+        tray_sub_ptr = np.zeros(len(trays) + 1, dtype=np.int32)
+        sub_service, sub_cap = [], []
+        for t, tray in enumerate(trays):
+            service, capacity, _, included, max_fill = tray_fields(tray)
+            tray_cap[t] = float(capacity or 0) * (float(max_fill) / 100.0)
+            for s, name in enumerate(services):
+                tray_adm[t * S + s] = tray_admits(service, included, name)
+            # Service shares of Mixed trays: 'percent' of the nominal capacity, as shown in the
+            # segment properties ("Cap. <service>"); 0 = no share limit, the total still applies
+            if normalize_service(service).startswith("mixed"):
+                for x in included or []:
+                    if not isinstance(x, dict): continue
+                    name = normalize_service(x.get('name', ''))
+                    try: pct = float(x.get('percent', 0) or 0)
+                    except (TypeError, ValueError): pct = 0.0
+                    if pct > 0 and name in services:
+                        sub_service.append(services.index(name))
+                        sub_cap.append(float(capacity or 0) * pct / 100.0)
+            tray_sub_ptr[t + 1] = len(sub_service)
+
+        arrays = {
+            "x": np.fromiter((k[0] for k in node_keys), dtype=np.float64, count=n),
+            "y": np.fromiter((k[1] for k in node_keys), dtype=np.float64, count=n),
+            "indptr": indptr,
+            "indices": np.ascontiguousarray(dst[order]),
+            "half_edge": np.ascontiguousarray(he[order]),
+            "edge_len": np.asarray(elen, dtype=np.float64),
+            "edge_seg": np.asarray(eseg, dtype=np.int32),
+            "seg_tray_ptr": seg_tray_ptr,
+            "seg_trays": seg_trays,
+            "tray_cap": tray_cap,
+            "tray_adm": tray_adm,
+            "tray_sub_ptr": tray_sub_ptr,
+            "sub_service": np.asarray(sub_service, dtype=np.int32),
+            "sub_cap": np.asarray(sub_cap, dtype=np.float64),
+            "tray_lane": tray_lane,
+        }
+        edge_keys = [tuple(sorted((node_keys[a], node_keys[b]))) for a, b in zip(eu.tolist(), ev.tolist())]
+        return cls(arrays, S, services, node_keys, edge_keys, trays)
+
+
+class SharedGraph:
+    """
+    Publishes the arrays of a CompactGraph (plus optional extra arrays, e.g. a load
+    snapshot) in a single shared memory block. Worker processes attach with the
+    picklable descriptor and get zero-copy numpy views.
+    """
+    def __init__(self, graph, extra=None):
+        arrays = {name: np.ascontiguousarray(getattr(graph, name)) for name in CompactGraph.ARRAYS}
+        for name, arr in (extra or {}).items():
+            arrays[name] = np.ascontiguousarray(arr)
+
+        layout = []
+        offset = 0
+        for name, arr in arrays.items():
+            layout.append((name, arr.dtype.str, arr.shape, offset))
+            offset += -(-arr.nbytes // 8) * 8  # keep 8-byte alignment
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 8))
+        for (name, dtype, shape, off), arr in zip(layout, arrays.values()):
+            view = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=off)
+            view[...] = arr
+            del view
+
+        self.descriptor = {"name": self.shm.name, "layout": layout, "n_services": graph.n_services}
+        self._arrays = {}
+
+    def array(self, name):
+        """Writable numpy view of a published array (e.g. to refresh the load snapshot between rounds)."""
+        if name not in self._arrays:
+            for n, dtype, shape, off in self.descriptor["layout"]:
+                if n == name:
+                    self._arrays[name] = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=off)
+        return self._arrays[name]
+
+    def close(self):
+        self._arrays.clear() # views must be released before the block is closed
+        try:
+            self.shm.close()
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def attach_shared_graph(descriptor):
+    """
+    Attaches to a SharedGraph block.
+    Returns: (shm, CompactGraph, extra_arrays). Keep shm alive while the arrays are used.
+    """
+    shm = shared_memory.SharedMemory(name=descriptor["name"])
+    arrays = {}
+    for name, dtype, shape, off in descriptor["layout"]:
+        arrays[name] = np.ndarray(tuple(shape), dtype=dtype, buffer=shm.buf, offset=off)
+    graph = CompactGraph(arrays, descriptor["n_services"])
+    extra = {k: v for k, v in arrays.items() if k not in CompactGraph.ARRAYS}
+    return shm, graph, extra
@@ -0,0 +1,107 @@
+import numpy as np
+
+from src.core.graph import normalize_service
+
+DEFAULT_CAPACITY = 5000.0 # mm², segments without trays
+DEFAULT_TRAY_NAME = "Default (100x50)"
+
+
+def segment_capacities(keys, segment_trays, segs, default=DEFAULT_CAPACITY):
+    """
+    Total nominal tray capacity of the segments `segs` (ids into keys), `default`
+    where a segment has no trays. Other entries are left at `default`.
+    Returns: (n_segments,) float array, always > 0.
+    """
+    cap = np.full(len(keys), float(default))
+    for s in np.asarray(segs).tolist():
+        trays = segment_trays.get(keys[s])
+        if trays: cap[s] = sum(t.capacity for t in trays)
+    cap[cap <= 0] = 1.0
+    return cap
+
+
+def aggregate_fill(incidence, capacity):
+    """
+    Heatmap aggregation of a routing run in one pass over the incidence entries:
+    every cable area is looked up once per segment it crosses and summed with
+    bincount, overall and per service.
+    Returns dict of arrays over segment ids:
+        area, count, ratio (area / capacity),
+        service_area, service_count: (n_services, n_segments)
+    """
+    n = incidence.n_segments
+    counts = incidence.counts()
+    owner = np.repeat(np.arange(n), counts)
+    cables = incidence.seg_cables
+    weights = incidence.area[cables]
+    area = np.bincount(owner, weights=weights, minlength=n)
+
+    S = max(len(incidence.services), 1)
+    slot = incidence.service[cables] * n + owner
+    service_area = np.bincount(slot, weights=weights, minlength=S * n).reshape(S, n)
+    service_count = np.bincount(slot, minlength=S * n).reshape(S, n)
+    return {"area": area, "count": counts, "ratio": area / capacity,
+            "service_area": service_area, "service_count": service_count}
+
+
+def service_capacities(trays):
+    """Nominal capacity per service name of a segment's trays (Mixed trays by their share)."""
+    sums = {}
+    for t in trays:
+        if getattr(t, 'included_services', None):
+            for item in t.included_services:
+                if isinstance(item, dict):
+                    name = item.get('name')
+                    sums[name] = sums.get(name, 0) + t.capacity * (item.get('percent', 0) / 100.0)
+                elif isinstance(item, str):
+                    sums[item] = sums.get(item, 0) + t.capacity
+        else:
+            sums[t.service] = sums.get(t.service, 0) + t.capacity
+    return sums
+
+
+class HeatmapLayers:
+    """
+    Heatmap layers of a routing run, computed once from the incidence index and the
+    tray loads, then kept until the next run. Every layer is a fill ratio and a mask
+    over the used segments (ids in `used`):
+        "all"              every cable against the total capacity
+        ("service", name)  the cables of a service against the capacity for that
+                           service (dedicated trays plus Mixed shares, total capacity
+                           where the segment has none)
+        ("tray", label)    the load of the trays of one type and service, "100x50 mm (Power)"
+    """
+
+    def __init__(self, incidence, segment_trays):
+        self.incidence = incidence
+        self.used = used = incidence.used_segments()
+        self.capacity = segment_capacities(incidence.keys, segment_trays, used)
+        self.fill = fill = aggregate_fill(incidence, self.capacity)
+        self.trays = [segment_trays.get(incidence.keys[s]) or [] for s in used.tolist()]
+
+        n = len(used)
+        self.layers = {"all": ("Tutti i servizi", fill["ratio"][used], np.ones(n, dtype=bool))}
+        caps = [{normalize_service(k): v for k, v in service_capacities(trays).items()} for trays in self.trays]
+        total = self.capacity[used]
+        for s_id, name in enumerate(incidence.services):
+            key = normalize_service(name)
+            cap = np.fromiter((c.get(key, 0.0) for c in caps), dtype=np.float64, count=n)
+            cap = np.where(cap > 0, cap, total)
+            self.layers[("service", name)] = (f"Servizio: {name}", fill["service_area"][s_id, used] / cap,
+                                              fill["service_count"][s_id, used] > 0)
+
+        loads = {}
+        for i, trays in enumerate(self.trays):
+            for t in trays:
+                eff_cap = t.capacity * (t.max_fill_percent / 100.0)
+                if eff_cap <= 0: continue
+                load, cap = loads.setdefault(f"{t.name} ({t.service})", (np.zeros(n), np.zeros(n)))
+                load[i] += t.current_load; cap[i] += eff_cap
+        for label in sorted(loads):
+            load, cap = loads[label]
+            self.layers[("tray", label)] = (f"Passerella: {label}", load / np.where(cap > 0, cap, 1.0), load > 0)
+
+    def ends(self):
+        """(n_used, 4) segment end points."""
+        keys = self.incidence.keys
+        return np.array([(*keys[s][0], *keys[s][1]) for s in self.used.tolist()], dtype=np.float64).reshape(-1, 4)
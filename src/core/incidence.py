@@ -0,0 +1,90 @@
+import numpy as np
+
+
+class CableIncidence:
+    """
+    Sparse cable/segment incidence of a routing run, in CSR form both ways:
+        segment s carries cables seg_cables[seg_ptr[s]:seg_ptr[s + 1]]
+        cable c runs on segments cable_segs[cable_ptr[c]:cable_ptr[c + 1]]
+    Cable ids are connection indexes (position in all_connections), segment ids
+    are CompactGraph edge ids; keys maps a segment id to its sorted coordinate key.
+    Duplicate or overlapping DXF lines give parallel edges with the same key, so a
+    key can map to several segment ids.
+    Per cable the cross-section area and a service id (into services) are kept.
+    A cable is listed once per segment even if its route passes the segment twice.
+    """
+
+    def __init__(self, keys, area, service, services, seg_ptr, seg_cables, cable_ptr, cable_segs):
+        self.keys = keys
+        self.area = area              # (n_cables,) cable cross-section, mm²
+        self.service = service        # (n_cables,) service id
+        self.services = services      # service names by id
+        self.seg_ptr = seg_ptr
+        self.seg_cables = seg_cables
+        self.cable_ptr = cable_ptr
+        self.cable_segs = cable_segs
+        self.index = {} # key -> [segment ids]
+        for s, k in enumerate(keys): self.index.setdefault(k, []).append(s)
+
+    @classmethod
+    def build(cls, keys, area, routes, service=None, services=()):
+        """
+        keys: segment keys by segment id. area: per-cable cross-section array.
+        routes: [(cable id, segment ids), ...]
+        service: per-cable service id array (default all 0), services: their names.
+        """
+        n_segs = len(keys); n_cables = len(area)
+        if routes:
+            cab = np.concatenate([np.full(len(s), c, dtype=np.int64) for c, s in routes])
+            seg = np.concatenate([np.asarray(s, dtype=np.int64) for c, s in routes])
+        else:
+            cab = np.zeros(0, dtype=np.int64); seg = np.zeros(0, dtype=np.int64)
+        # Unique (cable, segment) pairs, sorted by cable then segment
+        pairs = np.unique(cab * max(n_segs, 1) + seg)
+        cab = pairs // max(n_segs, 1); seg = pairs % max(n_segs, 1)
+
+        cable_ptr = np.zeros(n_cables + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cab, minlength=n_cables), out=cable_ptr[1:])
+        order = np.argsort(seg, kind='stable') # keeps cables in list order per segment
+        seg_ptr = np.zeros(n_segs + 1, dtype=np.int64)
+        np.cumsum(np.bincount(seg, minlength=n_segs), out=seg_ptr[1:])
+        service = np.zeros(n_cables, dtype=np.int64) if service is None else np.asarray(service, dtype=np.int64)
+        return cls(keys, np.asarray(area, dtype=np.float64), service, list(services), seg_ptr, cab[order], cable_ptr, seg)
+
+    @property
+    def n_segments(self):
+        return len(self.seg_ptr) - 1
+
+    @property
+    def n_cables(self):
+        return len(self.cable_ptr) - 1
+
+    def segment_ids(self, key):
+        """Segment ids of a coordinate key, empty if the segment is not in the graph."""
+        return self.index.get(key, [])
+
+    def cables_on(self, seg):
+        return self.seg_cables[self.seg_ptr[seg]:self.seg_ptr[seg + 1]]
+
+    def cables_on_key(self, key):
+        """Cables on the segment(s) of a coordinate key, each once, by cable id."""
+        segs = self.segment_ids(key)
+        if not segs: return self.seg_cables[:0]
+        if len(segs) == 1: return self.cables_on(segs[0])
+        return np.unique(np.concatenate([self.cables_on(s) for s in segs]))
+
+    def segments_of(self, cable):
+        return self.cable_segs[self.cable_ptr[cable]:self.cable_ptr[cable + 1]]
+
+    def counts(self):
+        """(n_segments,) number of cables on each segment."""
+        return np.diff(self.seg_ptr)
+
+    def area_sums(self):
+        """(n_segments,) total cable cross-section on each segment."""
+        owner = np.repeat(np.arange(self.n_segments), self.counts())
+        return np.bincount(owner, weights=self.area[self.seg_cables], minlength=self.n_segments)
+
+    def used_segments(self):
+        """Ids of the segments carrying at least one cable."""
+        return np.nonzero(self.counts())[0]
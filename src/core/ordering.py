@@ -0,0 +1,50 @@
+import math
+import random
+
+# Cable processing order for capacity routing: earlier cables get the short trunks
+STRATEGIES = {
+    "list": "Ordine lista CSV",
+    "area": "Sezione maggiore prima",
+    "distance": "Distanza maggiore prima",
+    "priority": "Colonna priorità",
+    "random": "Multi-start casuale (parallelo)",
+    "recorded": "Ultimo ordine vincente",
+}
+
+
+def order_tasks(graph, tasks, strategy, priorities=None, recorded=None):
+    """
+    Sorts routing tasks by strategy (stable: ties keep the list order).
+    priorities: { task.index: number }, lower first, missing last.
+    recorded: task indexes in a previously winning order, unknown tasks last.
+    Returns: new list of tasks.
+    """
+    if strategy == "area":
+        return sorted(tasks, key=lambda t: -t.size)
+    if strategy == "distance":
+        x = graph.x; y = graph.y
+        return sorted(tasks, key=lambda t: -math.hypot(x[t.source] - x[t.target], y[t.source] - y[t.target]))
+    if strategy == "priority":
+        priorities = priorities or {}
+        return sorted(tasks, key=lambda t: priorities.get(t.index, math.inf))
+    if strategy == "recorded" and recorded:
+        rank = {index: i for i, index in enumerate(recorded)}
+        return sorted(tasks, key=lambda t: rank.get(t.index, len(rank)))
+    return list(tasks)
+
+
+def start_orderings(graph, tasks, starts, seed=None):
+    """
+    Orderings for a multi-start run: the deterministic strategies first,
+    then random permutations up to `starts` in total.
+    Returns: [(label, tasks), ...]
+    """
+    orderings = [(name, order_tasks(graph, tasks, name)) for name in ("list", "area", "distance")]
+    rng = random.Random(seed)
+    k = 0
+    while len(orderings) < starts:
+        shuffled = list(tasks)
+        rng.shuffle(shuffled)
+        orderings.append((f"random {k}", shuffled))
+        k += 1
+    return orderings[:max(1, starts)]
@@ -0,0 +1,309 @@
+import os
+import time
+import multiprocessing
+import numpy as np
+
+from src.core.graph import SharedGraph, attach_shared_graph
+from src.core.search import select_trays, commit_trays
+from src.core.engine import RouteTask, RouteResult, find_path, route_one, route_serial
+from src.core.costs import CostModel
+from src.core.ordering import start_orderings
+
+# Worker-side state (set once per process by _init_worker)
+_worker = {}
+
+
+def _init_worker(descriptor):
+    shm, graph, extra = attach_shared_graph(descriptor)
+    _worker["shm"] = shm  # keep the block mapped for the life of the worker
+    _worker["graph"] = graph
+    _worker["load"] = memoryview(extra["load"])
+    _worker["model"] = CostModel.from_arrays(extra) if "cost_static" in extra else None
+
+
+def _route_batch(batch):
+    """
+    Routes a batch of task tuples against the published load snapshot (read only).
+    Returns: ([(index, (nodes, edges) or None), ...], search seconds)
+    """
+    t0 = time.perf_counter()
+    graph = _worker["graph"]; load = _worker["load"]; model = _worker["model"]
+    out = []
+    for t in batch:
+        out.append((t[0], find_path(graph, RouteTask(*t), load, model)))
+    return out, time.perf_counter() - t0
+
+
+def _route_ordering(start):
+    """
+    Routes a whole ordering serially on a private copy of the published load.
+    Returns: (label, routed count, total length, [(index, nodes, edges, trays) or (index, None)], seconds)
+    """
+    t0 = time.perf_counter()
+    label, batch = start
+    graph = _worker["graph"]
+    load = np.array(_worker["load"], dtype=np.float64)
+    results = route_serial(graph, [RouteTask(*t) for t in batch], load, _worker["model"])
+    return _score(graph, label, batch, results) + (time.perf_counter() - t0,)
+
+
+def _score(graph, label, batch, results):
+    routed = 0; length = 0.0; out = []
+    for t in batch:
+        res = results.get(t[0])
+        if res is None:
+            out.append((t[0], None))
+            continue
+        routed += 1
+        length += float(np.sum(graph.edge_len[res.edges])) if res.edges else 0.0
+        out.append((t[0], (res.nodes, res.edges, res.trays)))
+    return (label, routed, length, out)
+
+
+def group_by_source(tasks, n_batches):
+    """
+    Groups tasks by source node (first-appearance order) and packs the groups into
+    at most n_batches batches of similar size. Groups are never split.
+    """
+    groups = {}
+    for task in tasks:
+        groups.setdefault(task.source, []).append(task.as_tuple())
+
+    batches = [[] for _ in range(max(1, n_batches))]
+    # Largest groups first, each into the currently smallest batch
+    for group in sorted(groups.values(), key=len, reverse=True):
+        min(batches, key=len).extend(group)
+    return [b for b in batches if b]
+
+
+class ParallelRouter:
+    """
+    Routes tasks on a process pool.
+    The compact graph and a load snapshot are published once in shared memory; workers
+    search against the snapshot and the coordinator validates the proposed paths in task
+    (priority) order against the live loads.
+
+    mode "ordered": a proposal that no longer fits is re-routed serially by the
+    coordinator, so the result matches sequential routing.
+    mode "optimistic": conflicting tasks are re-queued and routed again by the workers
+    in the next round against a fresh snapshot; later tasks that still fit are committed
+    in the meantime. Conflict rate and speedup are reported in stats.
+    """
+    MODES = ("ordered", "optimistic")
+
+    def __init__(self, workers=0, mode="ordered", min_tasks=200, max_rounds=8, log=None, model=None):
+        self.workers = workers or (os.cpu_count() or 1)
+        self.model = model  # CostModel, None = shortest length
+        self.mode = mode if mode in self.MODES else "ordered"
+        self.min_tasks = min_tasks
+        self.max_rounds = max_rounds
+        self.log = log or (lambda msg: None)
+        self.stats = {}
+
+    def route(self, graph, tasks, load):
+        """Returns: { task.index: RouteResult or None }. load is updated in place."""
+        t0 = time.perf_counter()
+        if self.workers <= 1 or len(tasks) < self.min_tasks:
+            results = route_serial(graph, tasks, load, self.model)
+            elapsed = time.perf_counter() - t0
+            self.stats = {"mode": "serial", "tasks": len(tasks), "time": elapsed,
+                          "search_time": elapsed, "conflicts": 0, "proposed": len(tasks), "rounds": 1}
+            self.log("M: " + self.summary())
+            return results
+
+        shared = SharedGraph(graph, extra=self._extra(load))
+        try:
+            ctx = multiprocessing.get_context("spawn")
+            with ctx.Pool(self.workers, initializer=_init_worker, initargs=(shared.descriptor,)) as pool:
+                if self.mode == "optimistic":
+                    results = self._route_optimistic(pool, shared, graph, tasks, load)
+                else:
+                    results = self._route_ordered(pool, graph, tasks, load)
+        finally:
+            shared.close()
+
+        self.stats["time"] = time.perf_counter() - t0
+        self.log("M: " + self.summary())
+        return results
+
+    def _extra(self, load):
+        extra = {"load": load}
+        if self.model is not None: extra.update(self.model.arrays())
+        return extra
+
+    def _propose(self, pool, tasks):
+        """Routes tasks on the pool. Returns: ({ index: (nodes, edges) or None }, batches, worker seconds)"""
+        batches = group_by_source(tasks, self.workers * 4)
+        proposals = {}
+        search_time = 0.0
+        for part, elapsed in pool.imap_unordered(_route_batch, batches):
+            search_time += elapsed
+            for index, found in part:
+                proposals[index] = found
+        return proposals, len(batches), search_time
+
+    def _route_ordered(self, pool, graph, tasks, load):
+        proposals, n_batches, search_time = self._propose(pool, tasks)
+
+        # Deterministic merge: commit in task order against the live loads
+        load_view = memoryview(load)
+        results = {}
+        conflicts = 0
+        t0 = time.perf_counter()
+        for task in tasks:
+            found = proposals.get(task.index)
+            if found is None:
+                # No path even on the snapshot: loads only grow, so none now either
+                results[task.index] = None
+                continue
+            nodes, edges = found
+            trays = select_trays(graph, edges, task.service, task.size, load_view)
+            if trays is None:
+                conflicts += 1
+                results[task.index] = route_one(graph, task, load_view, self.model)
+                continue
+            commit_trays(graph, trays, task.service, task.size, load_view)
+            results[task.index] = RouteResult(nodes, edges, trays)
+
+        self.stats = {"mode": "ordered", "tasks": len(tasks), "workers": self.workers, "batches": n_batches,
+                      "rounds": 1, "proposed": len(tasks), "conflicts": conflicts,
+                      "search_time": search_time + (time.perf_counter() - t0)}
+        return results
+
+    def _route_optimistic(self, pool, shared, graph, tasks, load):
+        snapshot = shared.array("load")
+        load_view = memoryview(load)
+        results = {}
+        pending = list(tasks)
+        rounds = 0; proposed = 0; conflicts = 0; n_batches = 0
+        search_time = 0.0
+        per_round = []
+
+        while pending:
+            if rounds >= self.max_rounds or len(pending) < self.workers * 2:
+                # Tail: too few tasks left to pay for a round trip to the pool
+                t0 = time.perf_counter()
+                for task in pending:
+                    results[task.index] = route_one(graph, task, load_view, self.model)
+                search_time += time.perf_counter() - t0
+                break
+
+            snapshot[:] = load
+            proposals, batches, elapsed = self._propose(pool, pending)
+            n_batches += batches
+            search_time += elapsed
+
+            requeue = []
+            for task in pending:  # priority order
+                found = proposals.get(task.index)
+                proposed += 1
+                if found is None:
+                    results[task.index] = None
+                    continue
+                nodes, edges = found
+                trays = select_trays(graph, edges, task.service, task.size, load_view)
+                if trays is None:
+                    requeue.append(task)
+                    continue
+                commit_trays(graph, trays, task.service, task.size, load_view)
+                results[task.index] = RouteResult(nodes, edges, trays)
+
+            rounds += 1
+            conflicts += len(requeue)
+            per_round.append((len(pending), len(requeue)))
+            pending = requeue
+
+        self.stats = {"mode": "optimistic", "tasks": len(tasks), "workers": self.workers, "batches": n_batches,
+                      "rounds": rounds, "proposed": proposed, "conflicts": conflicts,
+                      "per_round": per_round, "search_time": search_time}
+        return results
+
+    def conflict_rate(self):
+        proposed = self.stats.get("proposed", 0)
+        return self.stats.get("conflicts", 0) / proposed if proposed else 0.0
+
+    def speedup(self):
+        """Search time summed over all processes / wall time (estimate of the gain over one core)."""
+        wall = self.stats.get("time", 0)
+        return self.stats.get("search_time", 0) / wall if wall else 1.0
+
+    def summary(self):
+        st = self.stats
+        return (f"Routing {st.get('mode')}: {st.get('tasks', 0)} tasks, {st.get('workers', 1)} workers, "
+                f"{st.get('rounds', 1)} rounds, conflicts {st.get('conflicts', 0)}/{st.get('proposed', 0)} "
+                f"({self.conflict_rate() * 100:.1f}%), speedup x{self.speedup():.2f}, {st.get('time', 0):.2f}s")
+
+
+class MultiStartRouter:
+    """
+    Randomized multi-start routing: the same tasks are routed serially under several
+    orderings (list, area, distance and random permutations), one ordering per worker
+    process, each against its own copy of the load. The result routing most cables
+    (then shortest total length) is kept and its ordering is exposed as best_order.
+    """
+    def __init__(self, starts=8, workers=0, seed=None, log=None, model=None):
+        self.starts = starts
+        self.model = model
+        self.workers = workers or (os.cpu_count() or 1)
+        self.seed = seed
+        self.log = log or (lambda msg: None)
+        self.best_order = []
+        self.stats = {}
+
+    def route(self, graph, tasks, load):
+        """Returns: { task.index: RouteResult or None }. load is updated in place."""
+        t0 = time.perf_counter()
+        starts = [(label, [t.as_tuple() for t in order])
+                  for label, order in start_orderings(graph, tasks, self.starts, self.seed)]
+        search_time = 0.0
+        if self.workers <= 1 or len(starts) <= 1:
+            scored = []
+            for label, batch in starts:
+                t1 = time.perf_counter()
+                results = route_serial(graph, [RouteTask(*t) for t in batch], load.copy(), self.model)
+                scored.append(_score(graph, label, batch, results))
+                search_time += time.perf_counter() - t1
+        else:
+            extra = {"load": load}
+            if self.model is not None: extra.update(self.model.arrays())
+            shared = SharedGraph(graph, extra=extra)
+            try:
+                ctx = multiprocessing.get_context("spawn")
+                with ctx.Pool(min(self.workers, len(starts)), initializer=_init_worker, initargs=(shared.descriptor,)) as pool:
+                    scored = []
+                    for *score, elapsed in pool.imap(_route_ordering, starts):
+                        scored.append(tuple(score))
+                        search_time += elapsed
+            finally:
+                shared.close()
+
+        best = max(range(len(scored)), key=lambda i: (scored[i][1], -scored[i][2], -i))
+        label, routed, length, out = scored[best]
+        by_index = {t.index: t for t in tasks}
+        load_view = memoryview(load)
+        results = {}
+        for index, found in out:
+            if found is None:
+                results[index] = None
+                continue
+            nodes, edges, trays = found
+            commit_trays(graph, trays, by_index[index].service, by_index[index].size, load_view)
+            results[index] = RouteResult(nodes, edges, trays)
+        self.best_order = [index for index, _ in out]
+
+        self.stats = {"mode": "multistart", "tasks": len(tasks), "workers": self.workers, "starts": len(starts),
+                      "best": label, "routed": routed, "length": length,
+                      "scores": [(s[0], s[1], s[2]) for s in scored], "search_time": search_time,
+                      "time": time.perf_counter() - t0}
+        self.log("M: " + self.summary())
+        return results
+
+    def speedup(self):
+        wall = self.stats.get("time", 0)
+        return self.stats.get("search_time", 0) / wall if wall else 1.0
+
+    def summary(self):
+        st = self.stats
+        return (f"Routing multistart: {st.get('tasks', 0)} tasks, {st.get('starts', 0)} orderings, "
+                f"best '{st.get('best')}' routed {st.get('routed', 0)} (length {st.get('length', 0):.1f}), "
+                f"speedup x{self.speedup():.2f}, {st.get('time', 0):.2f}s")
@@ -0,0 +1,161 @@
+import math
+import heapq
+import numpy as np
+
+from src.core.search import dijkstra_tree, tree_path, select_trays, commit_trays, release_trays
+from src.core.engine import RouteResult
+
+
+def suurballe(graph, source, target, admissible, node_disjoint=False):
+    """
+    Suurballe's algorithm: the pair of edge-disjoint (or node-disjoint) paths
+    from source to target with minimum total length, over admissible edges.
+    Returns: ((nodes, edges), (nodes, edges)) or None if no such pair exists.
+    """
+    if source == target: return None
+    v = graph.views()
+    indptr = v["indptr"]; indices = v["indices"]; half_edge = v["half_edge"]; edge_len = v["edge_len"]
+
+    # 1. Shortest path tree and first path
+    dist, pred_edge = dijkstra_tree(graph, source, admissible)
+    first = tree_path(graph, pred_edge, source, target)
+    if first is None: return None
+    p1_nodes, p1_edges = first
+
+    # P1 arcs: edge -> (from, to)
+    p1_arc = {e: (p1_nodes[i], p1_nodes[i + 1]) for i, e in enumerate(p1_edges)}
+    p1_prev = {p1_nodes[i + 1]: (p1_nodes[i], e) for i, e in enumerate(p1_edges)}
+    internal = set(p1_nodes[1:-1]) if node_disjoint else set()
+
+    # 2. Second search on the residual graph with reduced costs w + d(a) - d(b).
+    # Internal nodes of P1 are split (side 0 = in, side 1 = out) in node-disjoint mode:
+    # P1 arcs are replaced by their reversed arcs (cost 0), the split arc too.
+    start = (source, 0)
+    best = {start: 0.0}
+    came_from = {}
+    closed = set()
+    heap = [(0.0, source, 0)]
+    goal = None
+    while heap:
+        d, a, side = heapq.heappop(heap)
+        state = (a, side)
+        if state in closed: continue
+        closed.add(state)
+        if a == target:
+            goal = state
+            break
+
+        moves = []  # (next node, next side, edge or -1, cost)
+        if a in internal and side == 0:
+            prev, e = p1_prev[a]
+            moves.append((prev, 1 if prev in internal else 0, e, 0.0))
+        else:
+            if a in internal:
+                moves.append((a, 0, -1, 0.0))  # reversed split arc out -> in
+            for i in range(indptr[a], indptr[a + 1]):
+                e = half_edge[i]
+                if not admissible[e]: continue
+                nb = indices[i]
+                if e in p1_arc:
+                    if a in internal: continue  # reversed P1 arcs start from "in" states only
+                    frm, to = p1_arc[e]
+                    if not (frm == nb and to == a): continue
+                    moves.append((nb, 1 if nb in internal else 0, e, 0.0))
+                else:
+                    if dist[nb] == math.inf: continue
+                    moves.append((nb, 0, e, max(0.0, edge_len[e] + dist[a] - dist[nb])))
+
+        for nb, nside, e, c in moves:
+            nstate = (nb, nside)
+            if nstate in closed: continue
+            nd = d + c
+            if nd < best.get(nstate, math.inf):
+                best[nstate] = nd
+                came_from[nstate] = (state, e)
+                heapq.heappush(heap, (nd, nb, nside))
+
+    if goal is None: return None
+
+    # 3. Union of both paths, cancelling P1 edges traversed backwards by P2
+    arcs = dict(p1_arc)
+    state = goal
+    while state in came_from:
+        prev_state, e = came_from[state]
+        if e >= 0:
+            if e in arcs and arcs[e] == (state[0], prev_state[0]):
+                del arcs[e]
+            else:
+                arcs[e] = (prev_state[0], state[0])
+        state = prev_state
+
+    out_arcs = {}
+    for e, (frm, to) in arcs.items():
+        out_arcs.setdefault(frm, []).append((e, to))
+
+    # 4. Decompose into two paths
+    paths = []
+    for _ in range(2):
+        nodes = [source]; edges = []
+        current = source
+        while current != target:
+            if not out_arcs.get(current): return None
+            e, to = out_arcs[current].pop()
+            nodes.append(to); edges.append(e)
+            current = to
+        paths.append((nodes, edges))
+    return paths[0], paths[1]
+
+
+def route_redundant(graph, groups, load, node_disjoint=False):
+    """
+    Routes redundancy groups (lists of RouteTask between the same pair of nodes)
+    on a disjoint path pair. Members alternate between the two paths (1st primary,
+    2nd redundant, ...); all members are committed together or not at all.
+    Returns: (results { index: RouteResult }, errors { index: message })
+    """
+    load_view = memoryview(load)
+    results = {}
+    errors = {}
+    kind = "node" if node_disjoint else "edge"
+
+    for name, members in groups:
+        ends = {tuple(sorted((m.source, m.target))) for m in members}
+        if len(ends) > 1:
+            for m in members: errors[m.index] = f"Redundancy group {name}: members have different endpoints"
+            continue
+
+        source, target = members[0].source, members[0].target
+        sides = (members[0::2], members[1::2])
+        side_size = max(sum(m.size for m in sides[0]), sum(m.size for m in sides[1]))
+        mask = np.ones(graph.n_edges, dtype=bool)
+        for service in {m.service for m in members}:
+            mask &= graph.edge_fits_mask(service, side_size, load)
+
+        pair = suurballe(graph, source, target, memoryview(mask.astype(np.uint8)), node_disjoint)
+        if pair is None:
+            for m in members: errors[m.index] = f"Redundancy group {name}: no {kind}-disjoint path pair"
+            continue
+
+        committed = []
+        ok = True
+        for side, (nodes, edges) in zip(sides, pair):
+            for m in side:
+                m_nodes, m_edges = (nodes, edges) if m.source == source else (nodes[::-1], edges[::-1])
+                trays = select_trays(graph, m_edges, m.service, m.size, load_view)
+                if trays is None:
+                    ok = False
+                    break
+                commit_trays(graph, trays, m.service, m.size, load_view)
+                committed.append((m, RouteResult(list(m_nodes), list(m_edges), trays)))
+            if not ok: break
+
+        if not ok:
+            # Roll back: both paths are committed together or not at all
+            for m, res in committed:
+                release_trays(graph, res.trays, m.service, m.size, load_view)
+            for m in members: errors[m.index] = f"Redundancy group {name}: not enough tray space for the path pair"
+            continue
+
+        for m, res in committed:
+            results[m.index] = res
+    return results, errors
@@ -0,0 +1,72 @@
+import numpy as np
+
+
+class RouteStore:
+    """
+    Routed cables of one routing run, stored compactly: the node ids of all routes
+    in a single int32 buffer with offsets, the switchboard end points (the drawn
+    route runs switchboard -> graph nodes -> switchboard) and the lengths, which
+    are computed once, vectorized, when the store is built.
+    Routes are looked up by connection index (position in all_connections).
+    """
+
+    def __init__(self, x, y, conn, nodes, offsets, ends, lengths):
+        self.x = x                # node coordinates of the CompactGraph
+        self.y = y
+        self.conn = conn          # (n_routes,) connection index of each route
+        self.nodes = nodes        # int32 node ids of all routes
+        self.offsets = offsets    # (n_routes + 1,) route r is nodes[offsets[r]:offsets[r + 1]]
+        self.ends = ends          # (n_routes, 4) start x, y and end x, y
+        self.lengths = lengths    # (n_routes,) drawn length, switchboard stubs included
+        self.index = {c: r for r, c in enumerate(conn.tolist())}
+
+    @classmethod
+    def build(cls, graph, entries):
+        """entries: [(conn_idx, s_pos, e_pos, node ids), ...] with at least one node each."""
+        n = len(entries)
+        counts = np.fromiter((len(e[3]) for e in entries), dtype=np.int64, count=n)
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        nodes = np.concatenate([np.asarray(e[3], dtype=np.int32) for e in entries]) if n else np.zeros(0, dtype=np.int32)
+        conn = np.fromiter((e[0] for e in entries), dtype=np.int64, count=n)
+        ends = np.array([(*e[1], *e[2]) for e in entries], dtype=np.float64).reshape(n, 4)
+
+        px = graph.x[nodes]; py = graph.y[nodes]
+        step = np.hypot(np.diff(px), np.diff(py))
+        route_of_step = np.repeat(np.arange(n), counts)[1:]
+        same = route_of_step == np.repeat(np.arange(n), counts)[:-1]
+        lengths = np.bincount(route_of_step[same], weights=step[same], minlength=n).astype(np.float64)
+        if n:
+            first = offsets[:-1]; last = offsets[1:] - 1
+            lengths += np.hypot(ends[:, 0] - px[first], ends[:, 1] - py[first])
+            lengths += np.hypot(ends[:, 2] - px[last], ends[:, 3] - py[last])
+        return cls(graph.x, graph.y, conn, nodes, offsets, ends, lengths)
+
+    def __len__(self):
+        return len(self.conn)
+
+    def __contains__(self, conn_idx):
+        return conn_idx in self.index
+
+    def length(self, conn_idx):
+        return float(self.lengths[self.index[conn_idx]])
+
+    def segments(self, conn_indices):
+        """
+        Drawn segments of several routes at once.
+        Returns (segs, owner, routed): segs (m, 4) x1, y1, x2, y2 in route order,
+        owner (m,) position in routed of the route of each segment, routed the
+        connection indexes of conn_indices that have a route.
+        """
+        routed = [c for c in conn_indices if c in self.index]
+        parts = []; owner = []
+        for k, c in enumerate(routed):
+            r = self.index[c]
+            ids = self.nodes[self.offsets[r]:self.offsets[r + 1]]
+            sx, sy, ex, ey = self.ends[r].tolist()
+            px = np.concatenate([[sx], self.x[ids], [ex]]); py = np.concatenate([[sy], self.y[ids], [ey]])
+            parts.append(np.column_stack([px[:-1], py[:-1], px[1:], py[1:]]))
+            owner.append(np.full(len(px) - 1, k, dtype=np.int64))
+        if not parts:
+            return np.zeros((0, 4)), np.zeros(0, dtype=np.int64), routed
+        return np.vstack(parts), np.concatenate(owner), routed
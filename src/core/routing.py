@@ -1,5 +1,4 @@
 import math
-import heapq
 from PyQt6.QtWidgets import QGraphicsLineItem
 from PyQt6.QtCore import QPointF, Qt
 
@@ -47,13 +46,24 @@ def check_segregation(tray_service, cable_type):
     # print(f"DEBUG: Check Segregation: Tray='{ts}' Cable='{ct}' -> {allowed}")
     return allowed
 
-def check_capacity(tray_capacity, current_load, cable_size):
+def line_trays(line_item, segment_trays=None):
     """
-    Returns True if there is enough space.
+    Returns the list of trays of a line: item data first, then the project
+    segment_trays map ({ sorted segment key: [TrayInstance, ...] }).
     """
-    return (current_load + cable_size) <= tray_capacity
+    tray_data = line_item.data(Qt.ItemDataRole.UserRole)
+    if isinstance(tray_data, list):
+        return tray_data # List of TrayInstance objects (or dicts)
+    if tray_data:
+        return [tray_data] # Single object
+    if segment_trays:
+        line = line_item.line()
+        p1 = get_node_key(line.x1(), line.y1())
+        p2 = get_node_key(line.x2(), line.y2())
+        return segment_trays.get(tuple(sorted((p1, p2))), [])
+    return []
 
-def build_routing_graph(items):
+def build_routing_graph(items, segment_trays=None):
     """
     Builds a graph from QGraphicsLineItems.
     Returns: { (x,y): [ (cost, neighbor_key, properties), ... ] }
@@ -70,17 +80,11 @@ def build_routing_graph(items):
         dist = line.length()
         
         # Extract properties - SUPPORT LIST OF TRAYS
-        tray_data = line_item.data(Qt.ItemDataRole.UserRole)
-        
-        trays_list = []
-        if isinstance(tray_data, list):
-             trays_list = tray_data # List of TrayInstance objects (or dicts)
-        elif tray_data:
-             trays_list = [tray_data] # Single object
+        trays_list = line_trays(line_item, segment_trays)
         
         # We store the list of trays in props
         props = {
-            "trays": trays_list # This will be used by astar
+            "trays": trays_list # Read by CompactGraph.from_graph
         }
         
         if p1 not in graph: graph[p1] = []
@@ -103,7 +107,7 @@ def project_point_on_segment(px, py, x1, y1, x2, y2):
     
     return x1 + t * dx, y1 + t * dy
 
-def add_virtual_nodes(graph, points, lines):
+def add_virtual_nodes(graph, points, lines, segment_trays=None):
     """
     Integrates points into the graph.
     NOTE: When splitting a segment, we must preserve its properties!
@@ -141,16 +145,8 @@ def add_virtual_nodes(graph, points, lines):
                 node_mapping[(px, py)] = v
                 continue
                 
-            # Get properties from the original line
-            tray_data = best_line.data(Qt.ItemDataRole.UserRole)
             # Get properties from the original line - UPDATED FOR MULTI-TRAY
-            tray_data = best_line.data(Qt.ItemDataRole.UserRole)
-            
-            trays_list = []
-            if isinstance(tray_data, list):
-                 trays_list = tray_data 
-            elif tray_data:
-                 trays_list = [tray_data]
+            trays_list = line_trays(best_line, segment_trays)
             
             props = {
                 "trays": trays_list
@@ -171,123 +167,3 @@ def add_virtual_nodes(graph, points, lines):
             node_mapping[(px, py)] = p
             
     return node_mapping
-
-def astar(graph, start, goal, cable_type="Power", cable_size=0):
-    """
-    A* Pathfinding with segregation and capacity checks.
-    """
-    if start not in graph or goal not in graph:
-        return None
-
-    open_set = []
-    heapq.heappush(open_set, (0, start))
-    
-    came_from = {}
-    g_score = {node: float('inf') for node in graph}
-    g_score[start] = 0
-    
-    f_score = {node: float('inf') for node in graph}
-    f_score[start] = math.hypot(start[0] - goal[0], start[1] - goal[1])
-    
-    while open_set:
-        current = heapq.heappop(open_set)[1]
-        
-        if current == goal:
-            path = []
-            while current in came_from:
-                path.append(current)
-                current = came_from[current]
-            path.append(start)
-            return path[::-1]
-            
-        # Iterate neighbors. Structure: (dist, neighbor, properties)
-        for dist, neighbor, props in graph.get(current, []):
-            
-            # --- CHECKS ---
-            # Now we have a list of trays. We need to find AT LEAST ONE that fits.
-            # props["trays"] is a list of TrayInstance objects (or dicts).
-            
-            trays = props.get("trays", [])
-            valid_tray_found = False
-            
-            if not trays:
-                # If no trays assigned, treat as generic cable tray with infinite capacity and universal compatibility
-                # This allows routing to work on "raw" DXF imports without detailed config
-                valid_tray_found = True
-            else:
-                for tray in trays:
-                    # Normalize tray data access (obj vs dict)
-                    t_service = "Unassigned"
-                    t_capacity = 0
-                    t_load = 0
-                    
-                    if hasattr(tray, 'service'):
-                         t_service = tray.service
-                         t_capacity = tray.capacity
-                         t_load = tray.current_load
-                         # Handle included services for Mixed trays
-                         t_included = getattr(tray, 'included_services', [])
-                         t_max_fill = getattr(tray, 'max_fill_percent', 80.0)
-                    elif isinstance(tray, dict):
-                         t_service = tray.get('service', 'Unassigned')
-                         t_capacity = tray.get('capacity', 0)
-                         t_load = tray.get('current_load', 0)
-                         t_included = tray.get('included_services', [])
-                         t_max_fill = tray.get('max_fill_percent', 80.0)
-                    
-                    # Apply Max Fill Limit
-                    t_effective_capacity = t_capacity * (t_max_fill / 100.0)
-                    
-                    # Check Segregation
-                    seg_ok = False
-                    ts_norm = str(t_service).strip().lower()
-                    ct_norm = str(cable_type).strip().lower()
-                    
-                    if ts_norm.startswith("mixed"):
-                        # If mixed, check if cable type is in included_services
-                        # If included_services is empty, traditionally Mixed allows all?
-                        # User said: "dovranno essere rispettate le percentuali", meaning only defined types allowed.
-                        # But also said: "nel caso esista una passerella Mixed...".
-                        # Let's assume: if involved types are defined, check them.
-                        if t_included:
-                             # included_services might be list of dicts [{'name':'Power',...}] or strings
-                             allowed_sub = []
-                             for x in t_included:
-                                 if isinstance(x, dict): allowed_sub.append(str(x.get('name','')).lower())
-                                 elif isinstance(x, str): allowed_sub.append(str(x).lower())
-                             
-                             if ct_norm in allowed_sub:
-                                 seg_ok = True
-                             # Fallback: if user didn't define strict mixed list, but called it mixed?
-                             # Let's be strict: if list exists, must match.
-                             # If list empty, maybe allow all?
-                             elif not allowed_sub:
-                                 seg_ok = True 
-                        else:
-                             # No definition -> Allow all (Legacy Mixed behavior)
-                             seg_ok = True
-                    else:
-                        # Direct match
-                        if ts_norm == ct_norm:
-                            seg_ok = True
-                            
-                    if not seg_ok: continue
-                    
-                    # Check Capacity (Effective)
-                    if check_capacity(t_effective_capacity, t_load, cable_size):
-                        valid_tray_found = True
-                        break # Found one valid tray, edge is traversable
-            
-            if not valid_tray_found:
-                continue
-            # --------------
-            
-            tentative_g_score = g_score[current] + dist
-            if tentative_g_score < g_score.get(neighbor, float('inf')):
-                came_from[neighbor] = current
-                g_score[neighbor] = tentative_g_score
-                f = tentative_g_score + math.hypot(neighbor[0] - goal[0], neighbor[1] - goal[1])
-                f_score[neighbor] = f
-                heapq.heappush(open_set, (f, neighbor))
-                
-    return None # No path
@@ -0,0 +1,371 @@
+import math
+import heapq
+
+
+def share_room(v, T, t, service, load):
+    """
+    Room left in the service share of Mixed tray t (inf if the service has no share).
+    v are the memoryviews of a CompactGraph, T its number of trays.
+    """
+    sub_service = v["sub_service"]
+    for j in range(v["tray_sub_ptr"][t], v["tray_sub_ptr"][t + 1]):
+        if sub_service[j] == service:
+            return v["sub_cap"][j] - load[T + j]
+    return math.inf
+
+
+def astar_compact(graph, start, goal, service, cable_size, load, blocked=None):
+    """
+    A* on a CompactGraph (integer node ids): an edge is usable if its segment has
+    no trays or an admissible tray with room (tray_adm, tray_cap and the Mixed shares).
+    load is the per-tray load sequence of the current run; blocked is an optional
+    edge bitset (bytes, bit e set = edge e forbidden).
+    Returns: (nodes, edges) or None if no path.
+    """
+    v = graph.views()
+    indptr = v["indptr"]; indices = v["indices"]; half_edge = v["half_edge"]
+    edge_len = v["edge_len"]; edge_seg = v["edge_seg"]
+    seg_tray_ptr = v["seg_tray_ptr"]; seg_trays = v["seg_trays"]
+    tray_cap = v["tray_cap"]; tray_adm = v["tray_adm"]; sub_ptr = v["tray_sub_ptr"]
+    xs = v["x"]; ys = v["y"]
+    S = graph.n_services; T = graph.n_trays
+    gx = xs[goal]; gy = ys[goal]
+    hypot = math.hypot
+
+    g_score = {start: 0.0}
+    came_from = {}
+    closed = set()
+    open_set = [(hypot(xs[start] - gx, ys[start] - gy), start)]
+
+    while open_set:
+        _, current = heapq.heappop(open_set)
+        if current == goal:
+            nodes = [current]; edges = []
+            while current in came_from:
+                current, e = came_from[current]
+                nodes.append(current); edges.append(e)
+            return nodes[::-1], edges[::-1]
+        if current in closed: continue
+        closed.add(current)
+
+        g_cur = g_score[current]
+        for i in range(indptr[current], indptr[current + 1]):
+            nb = indices[i]
+            if nb in closed: continue
+            e = half_edge[i]
+            if blocked is not None and blocked[e >> 3] >> (e & 7) & 1: continue
+            tentative = g_cur + edge_len[e]
+            if tentative >= g_score.get(nb, math.inf): continue
+
+            s = edge_seg[e]
+            a = seg_tray_ptr[s]; b = seg_tray_ptr[s + 1]
+            if a != b:
+                ok = False
+                for j in range(a, b):
+                    t = seg_trays[j]
+                    if tray_adm[t * S + service] and load[t] + cable_size <= tray_cap[t] and \
+                            (sub_ptr[t] == sub_ptr[t + 1] or cable_size <= share_room(v, T, t, service, load)):
+                        ok = True
+                        break
+                if not ok: continue
+
+            g_score[nb] = tentative
+            came_from[nb] = (current, e)
+            heapq.heappush(open_set, (tentative + hypot(xs[nb] - gx, ys[nb] - gy), nb))
+
+    return None  # No path
+
+
+def astar_cost(graph, start, goal, service, cable_size, load, model, blocked=None):
+    """
+    A* with the multi-criteria costs of a CostModel. The search state is the
+    adjacency entry used to reach a node, so bends can be charged on the next edge.
+    Capacity rules and the blocked bitset are the same as astar_compact.
+    Returns: (nodes, edges) or None if no path.
+    """
+    v = graph.views(); m = model.views()
+    indptr = v["indptr"]; indices = v["indices"]; half_edge = v["half_edge"]
+    edge_len = v["edge_len"]; edge_seg = v["edge_seg"]
+    seg_tray_ptr = v["seg_tray_ptr"]; seg_trays = v["seg_trays"]
+    tray_cap = v["tray_cap"]; tray_adm = v["tray_adm"]; sub_ptr = v["tray_sub_ptr"]
+    xs = v["x"]; ys = v["y"]
+    static = m["static"][service]; heading = m["heading"]
+    w = model.weights
+    w_len = w["length"]; w_bend = w["bend"]; w_fill = w["fill"]
+    tol = model.bend_tolerance()
+    S = graph.n_services; T = graph.n_trays
+    gx = xs[goal]; gy = ys[goal]
+    hypot = math.hypot; pi = math.pi; two_pi = 2.0 * math.pi
+
+    # state -1 = at start with no heading; state i = reached indices[i] through entry i
+    g_score = {-1: 0.0}
+    came_from = {}
+    closed = set()
+    open_set = [(w_len * hypot(xs[start] - gx, ys[start] - gy), -1, start)]
+
+    while open_set:
+        _, state, current = heapq.heappop(open_set)
+        if current == goal:
+            nodes = [current]; edges = []
+            while state >= 0:
+                edges.append(half_edge[state])
+                state = came_from[state]
+                nodes.append(indices[state] if state >= 0 else start)
+            return nodes[::-1], edges[::-1]
+        if state in closed: continue
+        closed.add(state)
+
+        g_cur = g_score[state]
+        h_in = heading[state] if state >= 0 else None
+        for i in range(indptr[current], indptr[current + 1]):
+            if i in closed: continue
+            e = half_edge[i]
+            if blocked is not None and blocked[e >> 3] >> (e & 7) & 1: continue
+            s = edge_seg[e]
+            a = seg_tray_ptr[s]; b = seg_tray_ptr[s + 1]
+            step = static[e]
+            if a != b:
+                fill = -1.0
+                for j in range(a, b):
+                    t = seg_trays[j]
+                    if tray_adm[t * S + service] and load[t] + cable_size <= tray_cap[t] and \
+                            (sub_ptr[t] == sub_ptr[t + 1] or cable_size <= share_room(v, T, t, service, load)):
+                        fill = (load[t] + cable_size) / tray_cap[t] if tray_cap[t] > 0 else 1.0
+                        break
+                if fill < 0: continue
+                step += w_fill * edge_len[e] * fill * fill
+            if h_in is not None and w_bend:
+                d = abs(heading[i] - h_in) % two_pi
+                if d > pi: d = two_pi - d
+                if d > tol: step += w_bend
+            tentative = g_cur + step
+            if tentative >= g_score.get(i, math.inf): continue
+
+            nb = indices[i]
+            g_score[i] = tentative
+            came_from[i] = state
+            heapq.heappush(open_set, (tentative + w_len * hypot(xs[nb] - gx, ys[nb] - gy), i, nb))
+
+    return None  # No path
+
+
+def pick_tray(v, S, T, a, b, service, cable_size, load, used, lane):
+    """
+    Bin choice for one edge among the trays seg_trays[a:b]:
+    1. a tray the cable already occupies (a cable loads each tray once),
+    2. the tray continuing the lane of the previous edge, if it has room,
+    3. best fit: the admissible tray with the least room that still fits.
+    Returns: (tray id, room) or (-1, None) if no admissible tray has room.
+    """
+    seg_trays = v["seg_trays"]; tray_adm = v["tray_adm"]; tray_cap = v["tray_cap"]
+    sub_ptr = v["tray_sub_ptr"]; tray_lane = v["tray_lane"]
+    best = -1; best_room = None
+    for j in range(a, b):
+        t = seg_trays[j]
+        if not tray_adm[t * S + service]: continue
+        if t in used: return t, None
+        room = tray_cap[t] - load[t]
+        if sub_ptr[t] != sub_ptr[t + 1]: room = min(room, share_room(v, T, t, service, load))
+        if room < cable_size: continue
+        if lane >= 0 and tray_lane[t] == lane: return t, room
+        if best_room is None or room < best_room:
+            best = t; best_room = room
+    return best, best_room
+
+
+def select_trays(graph, edges, service, cable_size, load):
+    """
+    Chooses the tray that carries the cable on every edge of a path (-1 for generic edges),
+    see pick_tray: the cable stays in its tray lane along a run, otherwise best fit.
+    Returns: list of tray ids, or None if some edge has no admissible tray with room.
+    """
+    v = graph.views()
+    edge_seg = v["edge_seg"]; seg_tray_ptr = v["seg_tray_ptr"]; tray_lane = v["tray_lane"]
+    S = graph.n_services; T = graph.n_trays
+
+    chosen = []
+    used = set()
+    lane = -1
+    for e in edges:
+        s = edge_seg[e]
+        a = seg_tray_ptr[s]; b = seg_tray_ptr[s + 1]
+        if a == b:
+            chosen.append(-1)
+            continue
+        pick, _ = pick_tray(v, S, T, a, b, service, cable_size, load, used, lane)
+        if pick < 0: return None
+        used.add(pick)
+        lane = tray_lane[pick]
+        chosen.append(pick)
+    return chosen
+
+
+def commit_trays(graph, trays, service, cable_size, load, sign=1.0):
+    """Adds the cable area to each distinct tray of a path (and to its service share on Mixed trays)."""
+    v = graph.views()
+    sub_ptr = v["tray_sub_ptr"]; sub_service = v["sub_service"]
+    T = graph.n_trays
+    area = sign * cable_size
+    for t in set(trays):
+        if t < 0: continue
+        load[t] += area
+        for j in range(sub_ptr[t], sub_ptr[t + 1]):
+            if sub_service[j] == service:
+                load[T + j] += area
+                break
+
+
+def release_trays(graph, trays, service, cable_size, load):
+    """Removes a committed cable from its trays (inverse of commit_trays)."""
+    commit_trays(graph, trays, service, cable_size, load, -1.0)
+
+
+def shortest_path_cost(graph, start, goal, admissible, cost):
+    """
+    A* with explicit per-edge costs (cost[e] >= edge length, so the Euclidean
+    heuristic stays admissible). Only edges with admissible[e] are used; tray
+    capacity is ignored.
+    Returns: (nodes, edges, total_cost) or None.
+    """
+    v = graph.views()
+    indptr = v["indptr"]; indices = v["indices"]; half_edge = v["half_edge"]
+    xs = v["x"]; ys = v["y"]
+    gx = xs[goal]; gy = ys[goal]
+    hypot = math.hypot
+
+    g_score = {start: 0.0}
+    came_from = {}
+    closed = set()
+    open_set = [(hypot(xs[start] - gx, ys[start] - gy), start)]
+
+    while open_set:
+        _, current = heapq.heappop(open_set)
+        if current == goal:
+            total = g_score[current]
+            nodes = [current]; edges = []
+            while current in came_from:
+                current, e = came_from[current]
+                nodes.append(current); edges.append(e)
+            return nodes[::-1], edges[::-1], total
+        if current in closed: continue
+        closed.add(current)
+
+        g_cur = g_score[current]
+        for i in range(indptr[current], indptr[current + 1]):
+            nb = indices[i]
+            if nb in closed: continue
+            e = half_edge[i]
+            if not admissible[e]: continue
+            tentative = g_cur + cost[e]
+            if tentative >= g_score.get(nb, math.inf): continue
+            g_score[nb] = tentative
+            came_from[nb] = (current, e)
+            heapq.heappush(open_set, (tentative + hypot(xs[nb] - gx, ys[nb] - gy), nb))
+
+    return None
+
+
+def shortest_path_set_cost(graph, start, goal, admissible, set_price):
+    """
+    A* where, on top of the edge lengths, each tray set (edge_seg) charges
+    set_price[set] (>= 0) once per run of consecutive edges in that set, as a
+    column of the flow LP uses the set's capacity rows once. States are
+    (node, set of the arriving edge); a state is dropped when its node was already
+    reached for at least its set's price less, since arriving in that set saves at
+    most that price. Only edges with admissible[e] are used.
+    Returns: (nodes, edges, total_cost) or None.
+    """
+    v = graph.views()
+    indptr = v["indptr"]; indices = v["indices"]; half_edge = v["half_edge"]
+    edge_len = v["edge_len"]; edge_seg = v["edge_seg"]
+    xs = v["x"]; ys = v["y"]
+    gx = xs[goal]; gy = ys[goal]
+    hypot = math.hypot
+
+    start_state = (start, -1)
+    g_score = {start_state: 0.0}
+    came_from = {}
+    closed = set()
+    settled = {} # node -> g of its first expanded state (the lowest, the heuristic is consistent)
+    open_set = [(hypot(xs[start] - gx, ys[start] - gy), start_state)]
+
+    while open_set:
+        _, state = heapq.heappop(open_set)
+        current, cur_set = state
+        if current == goal:
+            total = g_score[state]
+            nodes = [current]; edges = []
+            while state in came_from:
+                state, e = came_from[state]
+                nodes.append(state[0]); edges.append(e)
+            return nodes[::-1], edges[::-1], total
+        if state in closed: continue
+        closed.add(state)
+        g_cur = g_score[state]
+        g_best = settled.get(current)
+        if g_best is None:
+            settled[current] = g_cur
+        elif g_cur >= g_best + (set_price[cur_set] if cur_set >= 0 else 0.0):
+            continue
+
+        for i in range(indptr[current], indptr[current + 1]):
+            e = half_edge[i]
+            if not admissible[e]: continue
+            sid = edge_seg[e]
+            nb = indices[i]
+            nxt = (nb, sid)
+            if nxt in closed: continue
+            tentative = g_cur + edge_len[e] + (0.0 if sid == cur_set else set_price[sid])
+            g_best = settled.get(nb)
+            if g_best is not None and tentative >= g_best + set_price[sid]: continue
+            if tentative >= g_score.get(nxt, math.inf): continue
+            g_score[nxt] = tentative
+            came_from[nxt] = (state, e)
+            heapq.heappush(open_set, (tentative + hypot(xs[nb] - gx, ys[nb] - gy), nxt))
+
+    return None
+
+
+def dijkstra_tree(graph, source, admissible, cost=None):
+    """
+    Full shortest-path tree from source over admissible edges (capacity ignored).
+    cost defaults to the edge lengths.
+    Returns: (dist, pred_edge) lists indexed by node id (inf / -1 where unreachable).
+    """
+    v = graph.views()
+    indptr = v["indptr"]; indices = v["indices"]; half_edge = v["half_edge"]
+    if cost is None: cost = v["edge_len"]
+    n = graph.n_nodes
+
+    dist = [math.inf] * n
+    pred_edge = [-1] * n
+    done = [False] * n
+    dist[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        d, current = heapq.heappop(heap)
+        if done[current]: continue
+        done[current] = True
+        for i in range(indptr[current], indptr[current + 1]):
+            e = half_edge[i]
+            if not admissible[e]: continue
+            nb = indices[i]
+            nd = d + cost[e]
+            if nd < dist[nb]:
+                dist[nb] = nd
+                pred_edge[nb] = e
+                heapq.heappush(heap, (nd, nb))
+    return dist, pred_edge
+
+
+def tree_path(graph, pred_edge, source, target):
+    """Walks a shortest-path tree back from target. Returns: (nodes, edges) or None."""
+    if target != source and pred_edge[target] < 0: return None
+    u, w = graph.edge_endpoints_lists()
+    nodes = [target]; edges = []
+    current = target
+    while current != source:
+        e = pred_edge[current]
+        current = u[e] if w[e] == current else w[e]
+        nodes.append(current); edges.append(e)
+    return nodes[::-1], edges[::-1]
@@ -0,0 +1,94 @@
+import time
+import numpy as np
+
+from src.core.costs import CostModel
+from src.core.search import astar_cost, select_trays, commit_trays, release_trays
+from src.core.engine import RouteResult
+
+
+def route_metrics(graph, routes, bend_angle=20.0):
+    """
+    Length, bends and tray lane switches of many routes at once.
+    routes: list of RouteResult. Returns: (lengths, bends, switches) arrays.
+    """
+    n = len(routes)
+    if not n: return np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    n_nodes = np.fromiter((len(r.nodes) for r in routes), dtype=np.int64, count=n)
+    n_edges = n_nodes - 1
+    nodes = np.concatenate([np.asarray(r.nodes, dtype=np.int64) for r in routes])
+    edges = np.concatenate([np.asarray(r.edges, dtype=np.int64) for r in routes])
+    trays = np.concatenate([np.asarray(r.trays, dtype=np.int64) for r in routes])
+    route_of_edge = np.repeat(np.arange(n), n_edges)
+
+    lengths = np.bincount(route_of_edge, weights=graph.edge_len[edges], minlength=n)
+
+    # Step headings; steps are the gaps between consecutive nodes of the same route
+    node_start = np.concatenate([[0], np.cumsum(n_nodes)[:-1]])
+    step = np.ones(len(nodes) - 1, dtype=bool) if len(nodes) > 1 else np.zeros(0, dtype=bool)
+    step[node_start[1:] - 1] = False
+    dx = np.diff(graph.x[nodes])[step]; dy = np.diff(graph.y[nodes])[step]
+    heading = np.arctan2(dy, dx)
+    turn = np.abs(np.diff(heading)) % (2 * np.pi)
+    turn = np.minimum(turn, 2 * np.pi - turn)
+    same_route = route_of_edge[1:] == route_of_edge[:-1]
+    bend = same_route & (turn > np.radians(bend_angle))
+    bends = np.bincount(route_of_edge[1:][bend], minlength=n)
+
+    lanes = np.where(trays >= 0, graph.tray_lane[np.maximum(trays, 0)] if len(graph.tray_lane) else -1, -1)
+    switch = same_route & (lanes[1:] >= 0) & (lanes[:-1] >= 0) & (lanes[1:] != lanes[:-1])
+    switches = np.bincount(route_of_edge[1:][switch], minlength=n)
+    return lengths, bends, switches
+
+
+def smooth_routes(graph, tasks, results, load, tolerance=0.05, bend_angle=20.0, log=None, model=None):
+    """
+    Post-pass over routed cables: fewer bends and tray lane switches, with the length
+    growing by at most `tolerance` (fraction). Metrics of the whole batch are computed
+    vectorized; only cables with staircases (2+ bends) or lane switches are searched
+    again with the routing cost model (plain length if None), adding a bend penalty
+    of tolerance * length / bends so that any cheaper path is within the length
+    tolerance. results and load are updated in place.
+    Returns: stats dict.
+    """
+    t0 = time.perf_counter()
+    log = log or (lambda msg: None)
+    load_view = memoryview(load)
+    routed = [t for t in tasks if results.get(t.index) is not None]
+    lengths, bends, switches = route_metrics(graph, [results[t.index] for t in routed], bend_angle)
+    candidates = np.nonzero((bends >= 2) | (switches > 0))[0]
+    bends_before = int(bends.sum()); switches_before = int(switches.sum()); length_before = float(lengths.sum())
+    if model is None: model = CostModel.from_graph(graph)
+    model = model.with_weights({"bend_angle": bend_angle})
+    base_bend = model.weights["bend"]
+
+    improved = 0
+    for k in candidates[np.argsort(-bends[candidates], kind='stable')].tolist():
+        task = routed[k]; old = results[task.index]
+        release_trays(graph, old.trays, task.service, task.size, load_view)
+        best = None
+        if not task.via and bends[k] >= 2:
+            model.weights["bend"] = base_bend + model.weights["length"] * tolerance * lengths[k] / bends[k]
+            found = astar_cost(graph, task.source, task.target, task.service, task.size, load_view, model, task.avoid)
+            if found is not None:
+                trays = select_trays(graph, found[1], task.service, task.size, load_view)
+                if trays is not None: best = RouteResult(found[0], found[1], trays)
+        if best is None and switches[k]:
+            trays = select_trays(graph, old.edges, task.service, task.size, load_view)
+            if trays is not None: best = RouteResult(old.nodes, old.edges, trays)
+        if best is not None:
+            l, b, s = route_metrics(graph, [best], bend_angle)
+            if l[0] <= lengths[k] * (1.0 + tolerance) + 1e-6 and (b[0], s[0]) < (bends[k], switches[k]):
+                commit_trays(graph, best.trays, task.service, task.size, load_view)
+                results[task.index] = best
+                lengths[k], bends[k], switches[k] = l[0], b[0], s[0]
+                improved += 1
+                continue
+        commit_trays(graph, old.trays, task.service, task.size, load_view)
+
+    stats = {"candidates": len(candidates), "improved": improved,
+             "bends": (bends_before, int(bends.sum())), "switches": (switches_before, int(switches.sum())),
+             "length": (length_before, float(lengths.sum())), "time": time.perf_counter() - t0}
+    log(f"M: Smoothing: {improved}/{len(candidates)} cables improved, bends {bends_before} -> {stats['bends'][1]}, "
+        f"tray switches {switches_before} -> {stats['switches'][1]}, length {length_before:.1f} -> {stats['length'][1]:.1f}, "
+        f"{stats['time']:.2f}s")
+    return stats
@@ -1,7 +1,10 @@
+import math
+import numpy as np
 from PyQt6.QtWidgets import QGraphicsRectItem, QGraphicsItem, QGraphicsTextItem, QGraphicsLineItem, QGraphicsEllipseItem
-from PyQt6.QtGui import QBrush, QColor, QPen, QPainterPath, QPainterPathStroker
-from PyQt6.QtCore import QLineF, QPointF, Qt
+from PyQt6.QtGui import QBrush, QColor, QPen, QPainter, QPainterPath, QPainterPathStroker
+from PyQt6.QtCore import QLineF, QPointF, QRectF, Qt
 from src.config import STYLESHEET
+from src.graphics.tiles import TileCache
 
 class AnalysisPointItem(QGraphicsEllipseItem):
     def __init__(self, x, y, radius=6.0, parent=None):
@@ -91,9 +94,41 @@ class SwitchboardItem(QGraphicsRectItem):
         return QPointF(closest_x, closest_y)
 
 class ClickableLineItem(QGraphicsLineItem):
+    HIT_WIDTH = 10 # scene units, click area around the segment
+
     def __init__(self, *args, tray_instance=None, **kwargs):
+        self._shape = None
         super().__init__(*args, **kwargs)
         self.set_tray_instance(tray_instance)
+
+    def setLine(self, *args):
+        self.prepareGeometryChange()
+        self._shape = None
+        super().setLine(*args)
+        if self.scene() is not None and hasattr(self.scene(), 'invalidate_picker'):
+            self.scene().invalidate_picker()
+
+    def setPen(self, pen):
+        self.prepareGeometryChange()
+        self._shape = None
+        super().setPen(pen)
+
+    def shape(self):
+        # Stroked once and kept until the line or pen changes
+        if self._shape is None:
+            path = QPainterPath()
+            line = self.line()
+            path.moveTo(line.p1()); path.lineTo(line.p2())
+            stroker = QPainterPathStroker()
+            stroker.setWidth(max(self.HIT_WIDTH, self.pen().widthF()))
+            self._shape = stroker.createStroke(path)
+        return self._shape
+
+    def boundingRect(self):
+        # Line box grown by half the hit width, without stroking the shape
+        line = self.line()
+        pad = max(self.HIT_WIDTH, self.pen().widthF()) / 2
+        return QRectF(line.p1(), line.p2()).normalized().adjusted(-pad, -pad, pad, pad)
         
     def set_tray_instance(self, tray_instance):
         self.tray_instance = tray_instance
@@ -131,9 +166,435 @@ class ClickableLineItem(QGraphicsLineItem):
         pen = QPen(color, width)
         self.setPen(pen)
 
+
+
+class HeatmapItem(QGraphicsItem):
+    """
+    Heatmap of a routing run as a single item: segment end points are kept in
+    arrays and each layer (pen widths plus a visibility mask over the segments)
+    is painted with one drawLines call per width bucket. Buckets are built the
+    first time a layer is shown and kept, so switching layers only repaints.
+    The tooltip of a segment is built only when the mouse hovers it, through
+    tooltip(i) with i the position of the segment in the arrays; hits are found
+    with a uniform grid index.
+    """
+    WIDTH_STEP = 0.5 # pen widths are rounded to buckets of this size
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setZValue(5)
+        self.setAcceptHoverEvents(True)
+        self.setAcceptedMouseButtons(Qt.MouseButton.NoButton)
+        self.color = QColor("blue")
+        self.color.setAlpha(180)
+        self.set_segments(np.zeros((0, 4)))
+
+    def set_segments(self, ends, tooltip=None):
+        """ends: (n, 4) x1, y1, x2, y2. tooltip: callable(i) -> str. Drops all layers."""
+        self.prepareGeometryChange()
+        self.ends = np.asarray(ends, dtype=np.float64).reshape(-1, 4)
+        self.tooltip = tooltip
+        self._lines = [QLineF(*row) for row in self.ends.tolist()]
+        self._layers = {}
+        self.layer = None
+        self.widths = np.zeros(len(self.ends))
+        self.mask = np.zeros(len(self.ends), dtype=bool)
+        self._pad = 0.0
+        self._hover = -1
+        self.setToolTip("")
+        if len(self.ends):
+            x = self.ends[:, 0::2]; y = self.ends[:, 1::2]
+            x0, y0, x1, y1 = float(x.min()), float(y.min()), float(x.max()), float(y.max())
+            self._rect = QRectF(x0, y0, x1 - x0, y1 - y0)
+        else:
+            self._rect = QRectF()
+        self._build_index()
+        self.update()
+
+    def set_layer(self, key, widths, mask=None):
+        """Registers a layer: (n,) pen widths and an optional (n,) bool mask of the drawn segments."""
+        mask = np.ones(len(self.ends), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        self._layers[key] = [np.asarray(widths, dtype=np.float64), mask, None]
+
+    def show_layer(self, key):
+        if key not in self._layers: return
+        layer = self._layers[key]
+        if layer[2] is None:
+            layer[2] = self._bucket(layer[0], layer[1])
+        self.prepareGeometryChange()
+        self.layer = key
+        self.widths, self.mask = layer[0], layer[1]
+        self._pad = float(self.widths.max()) if len(self.widths) else 0.0
+        self._hover = -1
+        self.setToolTip("")
+        self.update()
+
+    def _bucket(self, widths, mask):
+        """[(width, [QLineF, ...]), ...] for the masked segments."""
+        idx = np.flatnonzero(mask)
+        bucket = np.round(widths[idx] / self.WIDTH_STEP).astype(np.int64)
+        order = np.argsort(bucket, kind='stable')
+        cuts = np.flatnonzero(np.diff(bucket[order])) + 1
+        lines = self._lines
+        return [(bucket[run[0]] * self.WIDTH_STEP, [lines[i] for i in idx[run].tolist()])
+                for run in np.split(order, cuts) if len(run)]
+
+    def _build_index(self):
+        """Grid of cells of about one median segment; each cell lists the segments whose box touches it."""
+        e = self.ends
+        self._cells = {}
+        if not len(e):
+            self._cell = 1.0
+            return
+        lengths = np.hypot(e[:, 2] - e[:, 0], e[:, 3] - e[:, 1])
+        self._cell = max(float(np.median(lengths)), 1e-6)
+        lo = np.floor(np.minimum(e[:, :2], e[:, 2:]) / self._cell).astype(np.int64)
+        hi = np.floor(np.maximum(e[:, :2], e[:, 2:]) / self._cell).astype(np.int64)
+        for i, (ax, ay, bx, by) in enumerate(np.hstack([lo, hi]).tolist()):
+            for cx in range(ax, bx + 1):
+                for cy in range(ay, by + 1):
+                    self._cells.setdefault((cx, cy), []).append(i)
+
+    def segment_at(self, x, y):
+        """Index of the segment drawn under (x, y) in the shown layer, or -1."""
+        if not self._cells or self.layer is None: return -1
+        cx = math.floor(x / self._cell); cy = math.floor(y / self._cell)
+        cand = [i for dx in (-1, 0, 1) for dy in (-1, 0, 1) for i in self._cells.get((cx + dx, cy + dy), ())]
+        if not cand: return -1
+        cand = np.unique(cand)
+        cand = cand[self.mask[cand]]
+        if not len(cand): return -1
+        e = self.ends[cand]
+        dx = e[:, 2] - e[:, 0]; dy = e[:, 3] - e[:, 1]
+        ll = dx * dx + dy * dy
+        t = np.clip(((x - e[:, 0]) * dx + (y - e[:, 1]) * dy) / np.where(ll > 0, ll, 1.0), 0.0, 1.0)
+        dist = np.hypot(e[:, 0] + t * dx - x, e[:, 1] + t * dy - y) - self.widths[cand] / 2
+        k = int(np.argmin(dist))
+        return int(cand[k]) if dist[k] <= 1.0 else -1
+
+    def boundingRect(self):
+        if self._rect.isNull(): return self._rect
+        return self._rect.adjusted(-self._pad, -self._pad, self._pad, self._pad)
+
+    def contains(self, point):
+        return self.segment_at(point.x(), point.y()) >= 0
+
+    def paint(self, painter, option, widget=None):
+        if self.layer is None: return
+        for width, lines in self._layers[self.layer][2]:
+            pen = QPen(self.color, width)
+            pen.setCapStyle(Qt.PenCapStyle.RoundCap)
+            painter.setPen(pen)
+            painter.drawLines(lines)
+
+    def hoverMoveEvent(self, event):
+        i = self.segment_at(event.pos().x(), event.pos().y())
+        if i != self._hover:
+            self._hover = i
+            self.setToolTip(self.tooltip(i) if i >= 0 and self.tooltip else "")
+        super().hoverMoveEvent(event)
+
+    def hoverLeaveEvent(self, event):
+        self._hover = -1
+        self.setToolTip("")
+        super().hoverLeaveEvent(event)
+
+
+class RouteHighlightItem(QGraphicsItem):
+    """
+    Highlight of the selected routes as one item. Routes sharing a segment are
+    drawn side by side: on every segment each route gets a lane, LANE_SPACING
+    apart across the segment, in selection order; consecutive segments of a route
+    are joined where its lane changes. Lines are grouped by color and painted with
+    one drawLines call per color.
+    """
+    LANE_SPACING = 6.0
+    COLORS = ("red", "blue", "green", "darkorange", "magenta", "darkcyan", "saddlebrown", "purple")
+
+    def __init__(self, segs, owner, parent=None):
+        super().__init__(parent)
+        self.setZValue(9999) # Absolute top
+        self.setAcceptedMouseButtons(Qt.MouseButton.NoButton)
+        n_routes = int(owner.max()) + 1 if len(owner) else 0
+        # A single route keeps the plain thick red highlight
+        self.width = 8.0 if n_routes <= 1 else self.LANE_SPACING * 0.7
+        lines = self.bundle(np.asarray(segs, dtype=np.float64).reshape(-1, 4), np.asarray(owner, dtype=np.int64))
+        self._buckets = []
+        for c, color in enumerate(self.COLORS):
+            mine = lines[lines[:, 4] % len(self.COLORS) == c]
+            if len(mine):
+                pen = QPen(QColor(color), self.width)
+                pen.setCapStyle(Qt.PenCapStyle.SquareCap) # round caps are many times slower to fill
+                self._buckets.append((pen, [QLineF(*row) for row in mine[:, :4].tolist()]))
+        if len(lines):
+            pad = self.width
+            x0 = float(lines[:, [0, 2]].min()); x1 = float(lines[:, [0, 2]].max())
+            y0 = float(lines[:, [1, 3]].min()); y1 = float(lines[:, [1, 3]].max())
+            self._rect = QRectF(x0 - pad, y0 - pad, x1 - x0 + 2 * pad, y1 - y0 + 2 * pad)
+        else:
+            self._rect = QRectF()
+
+    @classmethod
+    def bundle(cls, segs, owner):
+        """(k, 5) offset lines x1, y1, x2, y2, route: the lanes of segs plus the joins between them."""
+        if not len(segs): return np.zeros((0, 5))
+        a = segs[:, :2]; b = segs[:, 2:]
+        # Same undirected segment -> same group, lanes ranked by route
+        swap = (a[:, 0] > b[:, 0]) | ((a[:, 0] == b[:, 0]) & (a[:, 1] > b[:, 1]))
+        p = np.where(swap[:, None], b, a); q = np.where(swap[:, None], a, b)
+        _, group = np.unique(np.round(np.hstack([p, q]), 3), axis=0, return_inverse=True)
+        group = group.reshape(-1)
+        order = np.lexsort((owner, group))
+        count = np.bincount(group)
+        first = np.cumsum(count) - count
+        rank = np.empty(len(segs), dtype=np.int64)
+        rank[order] = np.arange(len(segs)) - first[group[order]]
+        d = q - p
+        length = np.hypot(d[:, 0], d[:, 1])
+        normal = np.column_stack([d[:, 1], -d[:, 0]]) / np.where(length > 0, length, 1.0)[:, None]
+        shift = normal * ((rank - (count[group] - 1) / 2.0) * cls.LANE_SPACING)[:, None]
+        lanes = np.hstack([a + shift, b + shift, owner[:, None]])
+        # Joins between consecutive segments of the same route
+        same = owner[1:] == owner[:-1]
+        joins = np.hstack([lanes[:-1, 2:4], lanes[1:, 0:2], owner[1:, None]])[same]
+        joins = joins[np.hypot(joins[:, 2] - joins[:, 0], joins[:, 3] - joins[:, 1]) > 1e-9]
+        return np.vstack([lanes, joins])
+
+    def boundingRect(self):
+        return self._rect
+
     def shape(self):
-        path = super().shape()
-        stroker = QPainterPathStroker()
-        stroker.setWidth(10) # 10 units wide hit area
-        return stroker.createStroke(path)
+        return QPainterPath()
+
+    def paint(self, painter, option, widget=None):
+        for pen, lines in self._buckets:
+            painter.setPen(pen)
+            painter.drawLines(lines)
+
+
+class NodeOverlayItem(QGraphicsItem):
+    """
+    Nodes overlay as one point cloud: each distinct segment end point (same
+    rounding as the routing graph keys) is drawn once with drawPoints. Points are
+    kept sorted by x so only the exposed ones are drawn, and the overlay is not
+    drawn while the typical segment is shorter than MIN_PIXELS on screen.
+    """
+    RADIUS = 2.0
+    MIN_PIXELS = 12
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setZValue(100)
+        self.setAcceptedMouseButtons(Qt.MouseButton.NoButton)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+        self.pen_outer = QPen(QColor("orange"), self.RADIUS * 2 + 1)
+        self.pen_outer.setCapStyle(Qt.PenCapStyle.RoundCap)
+        self.pen_inner = QPen(QColor("yellow"), self.RADIUS * 2 - 1)
+        self.pen_inner.setCapStyle(Qt.PenCapStyle.RoundCap)
+        self.set_points(np.zeros((0, 2)))
+
+    def set_points(self, points, spacing=0.0):
+        """points: (n, 2) node coordinates, duplicates allowed. spacing: typical segment length."""
+        self.prepareGeometryChange()
+        pts = np.unique(np.round(np.asarray(points, dtype=np.float64).reshape(-1, 2), 1), axis=0) # sorted by x
+        self.points = pts
+        self.spacing = float(spacing)
+        if len(pts):
+            x0, y0 = pts.min(axis=0).tolist(); x1, y1 = pts.max(axis=0).tolist()
+            r = self.RADIUS + 1
+            self._rect = QRectF(x0 - r, y0 - r, x1 - x0 + 2 * r, y1 - y0 + 2 * r)
+        else:
+            self._rect = QRectF()
+        self.update()
+
+    def visible_points(self, rect):
+        """(k, 2) points inside rect."""
+        pts = self.points
+        a, b = np.searchsorted(pts[:, 0], [rect.left() - self.RADIUS, rect.right() + self.RADIUS])
+        pts = pts[a:b]
+        return pts[(pts[:, 1] >= rect.top() - self.RADIUS) & (pts[:, 1] <= rect.bottom() + self.RADIUS)]
+
+    def boundingRect(self):
+        return self._rect
+
+    def shape(self):
+        return QPainterPath()
+
+    def paint(self, painter, option, widget=None):
+        if not len(self.points): return
+        lod = option.levelOfDetailFromTransform(painter.worldTransform())
+        if self.spacing * lod < self.MIN_PIXELS: return
+        points = [QPointF(x, y) for x, y in self.visible_points(option.exposedRect).tolist()]
+        if not points: return
+        painter.setPen(self.pen_outer)
+        painter.drawPoints(points)
+        painter.setPen(self.pen_inner)
+        painter.drawPoints(points)
+
+
+class _BackgroundGeometry:
+    """
+    Immutable snapshot of the background drawing: line and circle arrays (read
+    only), their QLineF list, the culling index and the pen. A new snapshot is
+    built on every change, so tile workers keep drawing the one they were given.
+    """
+    GRID = 128          # culling cells per side of the drawing extent
+    LOD_PIXELS = 0.75   # minimum drawn length in device pixels
+
+    def __init__(self, lines, circles, pen):
+        self.lines = np.array(lines, dtype=np.float64).reshape(-1, 4)
+        self.circles = np.array(circles, dtype=np.float64).reshape(-1, 3)
+        self.pen = QPen(pen)
+        self.qlines = [QLineF(*row) for row in self.lines.tolist()]
+        self.lengths = np.hypot(self.lines[:, 2] - self.lines[:, 0], self.lines[:, 3] - self.lines[:, 1])
+
+        lo = np.vstack([np.minimum(self.lines[:, :2], self.lines[:, 2:]), self.circles[:, :2] - self.circles[:, 2:]])
+        hi = np.vstack([np.maximum(self.lines[:, :2], self.lines[:, 2:]), self.circles[:, :2] + self.circles[:, 2:]])
+        if len(lo):
+            (x0, y0), (x1, y1) = lo.min(axis=0).tolist(), hi.max(axis=0).tolist()
+            self.rect = QRectF(x0, y0, x1 - x0, y1 - y0).adjusted(-1, -1, 1, 1)
+        else:
+            self.rect = QRectF()
+        self._build_index()
+        for a in (self.lines, self.circles, self.lengths, self._long, self._order, self._ptr):
+            a.setflags(write=False)
+
+    def _build_index(self):
+        """Short lines are binned by midpoint in a CSR grid; lines longer than a cell are culled by box."""
+        r = self.rect
+        self._cell = max(r.width(), r.height(), 1e-6) / self.GRID
+        self._nx = int(r.width() / self._cell) + 1; self._ny = int(r.height() / self._cell) + 1
+        l = self.lines
+        span = np.maximum(np.abs(l[:, 2] - l[:, 0]), np.abs(l[:, 3] - l[:, 1]))
+        short = span <= self._cell
+        self._long = np.flatnonzero(~short)
+        idx = np.flatnonzero(short)
+        cx = np.clip(((l[idx, 0] + l[idx, 2]) / 2 - r.left()) // self._cell, 0, self._nx - 1).astype(np.int64)
+        cy = np.clip(((l[idx, 1] + l[idx, 3]) / 2 - r.top()) // self._cell, 0, self._ny - 1).astype(np.int64)
+        cell = cy * self._nx + cx
+        order = np.argsort(cell, kind='stable')
+        self._order = idx[order]
+        self._ptr = np.zeros(self._nx * self._ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell, minlength=self._nx * self._ny), out=self._ptr[1:])
+
+    def visible_lines(self, rect, lod=1.0):
+        """Indexes of the lines touching rect and at least LOD_PIXELS long at scale lod."""
+        r = self.rect
+        if r.isNull() or not len(self.lines): return np.zeros(0, dtype=np.int64)
+        c = self._cell
+        ix0 = max(int((rect.left() - r.left()) // c) - 1, 0); ix1 = min(int((rect.right() - r.left()) // c) + 1, self._nx - 1)
+        iy0 = max(int((rect.top() - r.top()) // c) - 1, 0); iy1 = min(int((rect.bottom() - r.top()) // c) + 1, self._ny - 1)
+        parts = []
+        if ix0 <= ix1:
+            for iy in range(iy0, iy1 + 1):
+                a = self._ptr[iy * self._nx + ix0]; b = self._ptr[iy * self._nx + ix1 + 1]
+                if b > a: parts.append(self._order[a:b])
+        if len(self._long):
+            l = self.lines[self._long]
+            hit = (np.maximum(l[:, 0], l[:, 2]) >= rect.left()) & (np.minimum(l[:, 0], l[:, 2]) <= rect.right()) & \
+                  (np.maximum(l[:, 1], l[:, 3]) >= rect.top()) & (np.minimum(l[:, 1], l[:, 3]) <= rect.bottom())
+            parts.append(self._long[hit])
+        idx = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+        return idx[self.lengths[idx] * lod >= self.LOD_PIXELS]
+
+    def paint(self, painter, rect, lod):
+        painter.setPen(self.pen)
+        idx = self.visible_lines(rect, lod)
+        if len(idx):
+            q = self.qlines
+            painter.drawLines([q[i] for i in idx.tolist()])
+        if len(self.circles):
+            c = self.circles
+            hit = (c[:, 0] + c[:, 2] >= rect.left()) & (c[:, 0] - c[:, 2] <= rect.right()) & \
+                  (c[:, 1] + c[:, 2] >= rect.top()) & (c[:, 1] - c[:, 2] <= rect.bottom()) & \
+                  (c[:, 2] * 2 * lod >= self.LOD_PIXELS)
+            for x, y, r in c[hit].tolist():
+                painter.drawEllipse(QPointF(x, y), r, r)
+
+    def render_tile(self, key):
+        """Tile image for the TileCache (runs on a worker thread)."""
+        image = TileCache.new_image()
+        painter = TileCache.tile_painter(image, key)
+        self.paint(painter, TileCache.tile_rect(key), 2.0 ** key[0])
+        painter.end()
+        return image
+
+
+class BackgroundGeometryItem(QGraphicsItem):
+    """
+    Static DXF geometry (lines and circles that are not tray candidates) held in
+    NumPy arrays and drawn in bulk. Only the lines in the exposed rect are drawn,
+    found through a grid of cells; lines shorter than LOD_PIXELS on screen are
+    skipped. With a tile cache budget the drawing is rendered into pixmap tiles
+    per zoom level on background threads (see TileCache) and painted from them;
+    tiles not ready yet are drawn as vectors. The geometry is an immutable
+    _BackgroundGeometry replaced as a whole on changes, and each tile job gets
+    the snapshot it was requested for. The item takes no mouse input and is
+    never selected.
+    """
+
+    def __init__(self, lines=None, circles=None, pen=None, cache_mb=64, parent=None):
+        super().__init__(parent)
+        self.cache = TileCache(_BackgroundGeometry.render_tile, self._tile_ready, cache_mb)
+        self.setZValue(-1)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+        self.setAcceptedMouseButtons(Qt.MouseButton.NoButton)
+        if pen is None:
+            pen = QPen(QColor("#333"), 1.5)
+            pen.setCosmetic(True)
+        self.geometry = _BackgroundGeometry(np.zeros((0, 4)), np.zeros((0, 3)), pen)
+        self.set_geometry(np.zeros((0, 4)) if lines is None else lines, np.zeros((0, 3)) if circles is None else circles)
+
+    @property
+    def lines(self):
+        return self.geometry.lines
+
+    @property
+    def circles(self):
+        return self.geometry.circles
+
+    @property
+    def pen(self):
+        return self.geometry.pen
+
+    def set_geometry(self, lines, circles):
+        """lines: (n, 4) x1, y1, x2, y2. circles: (m, 3) cx, cy, r."""
+        self.prepareGeometryChange()
+        self.geometry = _BackgroundGeometry(lines, circles, self.geometry.pen)
+        self.cache.clear()
+        self.update()
+
+    def remove_lines(self, mask):
+        """Drops the lines in mask (e.g. promoted to interactive items). Returns their (k, 4) coordinates."""
+        mask = np.asarray(mask, dtype=bool)
+        removed = self.lines[mask]
+        if len(removed): self.set_geometry(self.lines[~mask], self.circles)
+        return removed
+
+    def boundingRect(self):
+        return self.geometry.rect
+
+    def shape(self):
+        return QPainterPath() # never hit
+
+    def paint(self, painter, option, widget=None):
+        lod = option.levelOfDetailFromTransform(painter.worldTransform())
+        rect = option.exposedRect
+        geometry = self.geometry
+        if not self.cache.enabled:
+            geometry.paint(painter, rect, lod)
+            return
+        area = rect.intersected(geometry.rect)
+        if area.isEmpty(): return
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        for key in self.cache.keys_for(area, self.cache.level(lod)):
+            pixmap = self.cache.get(key)
+            if pixmap is not None:
+                painter.drawPixmap(self.cache.tile_rect(key), pixmap, QRectF(pixmap.rect()))
+            else:
+                self.cache.request(key, geometry)
+                geometry.paint(painter, self.cache.tile_rect(key).intersected(rect), lod)
 
+    def _tile_ready(self, key):
+        try: self.update(TileCache.tile_rect(key))
+        except RuntimeError: pass # item already removed by scene.clear()
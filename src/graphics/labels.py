@@ -0,0 +1,231 @@
+import html
+import math
+import numpy as np
+from PyQt6.QtWidgets import QGraphicsItem
+from PyQt6.QtGui import QColor, QFont, QFontMetricsF, QPainterPath, QPen, QStaticText
+from PyQt6.QtCore import QLineF, QPointF, QRectF, Qt
+
+
+class _RectGrid:
+    """Uniform grid of placed rectangles: key -> rect, each listed in every cell it touches."""
+
+    def __init__(self, cell):
+        self.cell = cell
+        self.cells = {}
+        self.rects = {}
+
+    def _cells(self, rect):
+        c = self.cell
+        for cx in range(math.floor(rect.left() / c), math.floor(rect.right() / c) + 1):
+            for cy in range(math.floor(rect.top() / c), math.floor(rect.bottom() / c) + 1):
+                yield cx, cy
+
+    def insert(self, key, rect):
+        self.rects[key] = rect
+        for cell in self._cells(rect):
+            self.cells.setdefault(cell, []).append(key)
+
+    def remove(self, key):
+        rect = self.rects.pop(key, None)
+        if rect is None: return
+        for cell in self._cells(rect):
+            keys = self.cells.get(cell)
+            if keys and key in keys: keys.remove(key)
+
+    def collides(self, rect):
+        for cell in self._cells(rect):
+            for key in self.cells.get(cell, ()):
+                if self.rects[key].intersects(rect): return True
+        return False
+
+
+class SegmentLabelLayer(QGraphicsItem):
+    """
+    Segment labels drawn by one item. A label is only a text and a segment until
+    it is first exposed at a readable zoom; then its layout is cached as a
+    QStaticText, and dropped again only when its text changes. Labels are found
+    through arrays of the boxes covering all their candidate positions (estimated
+    sizes), rebuilt after labels are added or moved. Nothing is drawn while a text line is shorter than MIN_PIXELS on screen.
+
+    Labels are placed when they first become visible, against the labels placed so
+    far (a grid of their rectangles): beside the segment midpoint on either side,
+    then shifted along the segment, then farther out with a leader line. A label
+    that fits nowhere is not drawn. Placements are kept, so panning only places
+    the newly exposed labels; editing or hiding a label frees its place and lets
+    the suppressed labels try again.
+    """
+    OFFSET = 15.0       # minimum label center distance from the segment
+    GAP = 3.0           # clearance between a label and its segment
+    LEADER_STEP = 30.0  # extra distance of each leader line candidate
+    SHIFTS = (0.0, -0.5, 0.5) # along the segment, fraction of its half length
+    MAX_SHIFT = 60.0    # cap of the shift, keeps the query margin bounded on long segments
+    MIN_PIXELS = 6
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setZValue(150)
+        self.setAcceptedMouseButtons(Qt.MouseButton.NoButton)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+        self.font = QFont("Arial", 8)
+        self.color = QColor("blue")
+        self.leader_pen = QPen(self.color, 0.5)
+        metrics = QFontMetricsF(self.font)
+        self.line_height = metrics.height()
+        self.char_width = metrics.averageCharWidth()
+        self.clear()
+
+    def clear(self):
+        self.prepareGeometryChange()
+        self.labels = {}  # key -> [text, segment (mx, my, ux, uy, half length), visible]
+        self._static = {} # key -> (QStaticText, QSizeF)
+        self._placed = {} # key -> (QRectF, leader QLineF or None), or None if suppressed
+        self._suppressed = set()
+        self._grid = _RectGrid(4 * self.line_height)
+        self._dirty = True
+        self._rect = QRectF()
+        self.update()
+
+    def set_label(self, key, line, text, visible=True):
+        """Sets the text of the label of a segment (QLineF)."""
+        x1, y1, x2, y2 = line.x1(), line.y1(), line.x2(), line.y2()
+        length = math.hypot(x2 - x1, y2 - y1)
+        ux, uy = ((x2 - x1) / length, (y2 - y1) / length) if length else (1.0, 0.0)
+        segment = ((x1 + x2) / 2, (y1 + y2) / 2, ux, uy, length / 2)
+        old = self.labels.get(key)
+        if old is None or old[0] != text:
+            self._static.pop(key, None)
+        self.labels[key] = [text, segment, visible]
+        if old is None or old[1] != segment or old[0] != text:
+            self._unplace(key)
+            self._invalidate_index()
+        elif old[2] != visible:
+            self.set_label_visible(key, visible, force=True)
+
+    def set_label_visible(self, key, visible, force=False):
+        label = self.labels.get(key)
+        if label is None or (label[2] == visible and not force): return
+        label[2] = visible
+        if not visible: self._unplace(key)
+        self.update()
+
+    def _unplace(self, key):
+        """Frees the place of a label; suppressed labels get another try."""
+        if self._placed.pop(key, None) is not None:
+            self._grid.remove(key)
+            for k in self._suppressed: self._placed.pop(k, None)
+            self._suppressed.clear()
+        self._suppressed.discard(key)
+
+    @staticmethod
+    def _anchor(segment, side, distance):
+        mx, my, ux, uy, _ = segment
+        # Unit normal (uy, -ux): same side as the 90° CCW turn of QLineF.angle()
+        return mx + side * distance * uy, my - side * distance * ux
+
+    def _size(self, text):
+        """Estimated label size from its line count and longest line, without laying it out."""
+        rows = text.split("\n")
+        return max(len(r) for r in rows) * self.char_width * 1.2 + 4, len(rows) * self.line_height + 4
+
+    def _invalidate_index(self):
+        # One geometry change and repaint per batch of edits, the index is rebuilt on the next paint
+        if not self._dirty:
+            self.prepareGeometryChange()
+            self._dirty = True
+            self.update()
+
+    def _build_index(self):
+        self._keys = list(self.labels)
+        n = len(self._keys)
+        labels = [self.labels[k] for k in self._keys]
+        seg = np.array([s for _, s, _ in labels], dtype=np.float64).reshape(n, 5)
+        half = np.array([self._size(t) for t, _, _ in labels], dtype=np.float64).reshape(n, 2) / 2
+        ux = np.abs(seg[:, 2]); uy = np.abs(seg[:, 3])
+        # Reach of the candidates (see candidates) from the segment midpoint, plus the label
+        along = np.minimum(self.MAX_SHIFT, seg[:, 4] * max(self.SHIFTS))
+        across = np.maximum(self.OFFSET, uy * half[:, 0] + ux * half[:, 1] + self.GAP) + 2 * self.LEADER_STEP
+        reach_x = ux * along + uy * across + half[:, 0]
+        reach_y = uy * along + ux * across + half[:, 1]
+        boxes = np.column_stack([seg[:, 0] - reach_x, seg[:, 1] - reach_y, seg[:, 0] + reach_x, seg[:, 1] + reach_y])
+        self._boxes = boxes
+        if len(boxes):
+            x0, y0 = boxes[:, :2].min(axis=0).tolist(); x1, y1 = boxes[:, 2:].max(axis=0).tolist()
+            self._rect = QRectF(x0, y0, x1 - x0, y1 - y0)
+        else:
+            self._rect = QRectF()
+        self._dirty = False
+
+    def visible_labels(self, rect):
+        """Keys of the shown, non-empty labels that can be placed across rect."""
+        if self._dirty: self._build_index()
+        b = self._boxes
+        hit = np.flatnonzero((b[:, 2] >= rect.left()) & (b[:, 0] <= rect.right()) &
+                             (b[:, 3] >= rect.top()) & (b[:, 1] <= rect.bottom()))
+        keys = [self._keys[i] for i in hit.tolist()]
+        return [k for k in keys if self.labels[k][2] and self.labels[k][0].strip()]
+
+    def static_text(self, key):
+        """Cached (QStaticText, size) of a label, laid out on first use."""
+        cached = self._static.get(key)
+        if cached is None:
+            text = QStaticText(html.escape(self.labels[key][0]).replace("\n", "<br>"))
+            text.setTextFormat(Qt.TextFormat.RichText)
+            text.prepare(font=self.font)
+            cached = self._static[key] = (text, text.size())
+        return cached
+
+    def candidates(self, segment, w, h):
+        """(center, leader start or None) positions to try, nearest first."""
+        mx, my, ux, uy, hl = segment
+        # Distance keeping the label box clear of the segment line
+        clear = max(self.OFFSET, abs(uy) * w / 2 + abs(ux) * h / 2 + self.GAP)
+        for shift in self.SHIFTS:
+            along = max(-self.MAX_SHIFT, min(self.MAX_SHIFT, shift * hl))
+            seg = (mx + along * ux, my + along * uy, ux, uy, hl)
+            for side in (1, -1):
+                yield self._anchor(seg, side, clear), None
+        for step in (1, 2):
+            for side in (1, -1):
+                yield self._anchor(segment, side, clear + step * self.LEADER_STEP), (mx, my)
+
+    def place(self, key):
+        """Placement of a visible label, computed once against the labels placed before it."""
+        if key in self._placed: return self._placed[key]
+        _, size = self.static_text(key)
+        w, h = size.width(), size.height()
+        placement = None
+        for (cx, cy), leader in self.candidates(self.labels[key][1], w, h):
+            rect = QRectF(cx - w / 2, cy - h / 2, w, h)
+            if not self._grid.collides(rect):
+                if leader is not None:
+                    end = QPointF(min(max(leader[0], rect.left()), rect.right()), min(max(leader[1], rect.top()), rect.bottom()))
+                    leader = QLineF(QPointF(*leader), end)
+                placement = (rect, leader)
+                self._grid.insert(key, rect)
+                break
+        self._placed[key] = placement
+        if placement is None: self._suppressed.add(key)
+        return placement
+
+    def boundingRect(self):
+        if self._dirty: self._build_index()
+        return self._rect
+
+    def shape(self):
+        return QPainterPath()
+
+    def paint(self, painter, option, widget=None):
+        lod = option.levelOfDetailFromTransform(painter.worldTransform())
+        if self.line_height * lod < self.MIN_PIXELS: return
+        exposed = option.exposedRect
+        keys = self.visible_labels(exposed)
+        painter.setFont(self.font)
+        for key in keys:
+            placement = self.place(key)
+            if placement is None or not placement[0].intersects(exposed): continue
+            rect, leader = placement
+            if leader is not None:
+                painter.setPen(self.leader_pen)
+                painter.drawLine(leader)
+            painter.setPen(self.color)
+            painter.drawStaticText(rect.topLeft(), self.static_text(key)[0])
@@ -0,0 +1,108 @@
+import math
+import numpy as np
+
+
+class SegmentPicker:
+    """
+    Spatial index over the segment items of a scene (ClickableLineItem) for click
+    and rubber-band picking without per-item shape tests. Segments are stored as
+    arrays and registered in every cell of a uniform grid that their box touches
+    (CSR: cell -> segments); segments touching more than MAX_SPAN cells are
+    kept apart and tested on every query.
+    """
+    MAX_CELLS = 512 # per side
+    MAX_SPAN = 64   # cells per segment
+
+    def __init__(self, items):
+        self.items = list(items)
+        n = len(self.items)
+        e = np.zeros((n, 4))
+        for i, item in enumerate(self.items):
+            l = item.line(); p = item.pos()
+            e[i] = (l.x1() + p.x(), l.y1() + p.y(), l.x2() + p.x(), l.y2() + p.y())
+        self.ends = e
+        self.lo = np.minimum(e[:, :2], e[:, 2:]); self.hi = np.maximum(e[:, :2], e[:, 2:])
+        self._build_grid()
+
+    def _build_grid(self):
+        n = len(self.items)
+        if not n:
+            self.origin = (0.0, 0.0); self.cell = 1.0; self.nx = self.ny = 1
+            self.ptr = np.zeros(2, dtype=np.int64); self.cell_items = np.zeros(0, dtype=np.int64)
+            self.long = np.zeros(0, dtype=np.int64)
+            return
+        x0, y0 = self.lo.min(axis=0).tolist(); x1, y1 = self.hi.max(axis=0).tolist()
+        lengths = np.hypot(*(self.hi - self.lo).T)
+        extent = max(x1 - x0, y1 - y0, 1e-6)
+        self.cell = max(float(np.median(lengths)), extent / self.MAX_CELLS, 1e-6)
+        self.origin = (x0, y0)
+        self.nx = int((x1 - x0) / self.cell) + 1; self.ny = int((y1 - y0) / self.cell) + 1
+        ax, ay = self._cell_of(self.lo[:, 0], self.lo[:, 1])
+        bx, by = self._cell_of(self.hi[:, 0], self.hi[:, 1])
+        wx = bx - ax + 1; wy = by - ay + 1
+        counts = wx * wy
+        self.long = np.flatnonzero(counts > self.MAX_SPAN)
+        counts[self.long] = 0
+        seg = np.repeat(np.arange(n), counts)
+        k = np.arange(len(seg)) - np.repeat(np.cumsum(counts) - counts, counts) # rank inside the segment's block
+        cx = ax[seg] + k % wx[seg]; cy = ay[seg] + k // wx[seg]
+        cell = cy * self.nx + cx
+        order = np.argsort(cell, kind='stable')
+        self.cell_items = seg[order]
+        self.ptr = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell, minlength=self.nx * self.ny), out=self.ptr[1:])
+
+    def _cell_of(self, x, y):
+        cx = np.clip(((np.asarray(x) - self.origin[0]) // self.cell).astype(np.int64), 0, self.nx - 1)
+        cy = np.clip(((np.asarray(y) - self.origin[1]) // self.cell).astype(np.int64), 0, self.ny - 1)
+        return cx, cy
+
+    def _candidates(self, x0, y0, x1, y1):
+        """Segments registered in the cells overlapping the box."""
+        (ax, bx), (ay, by) = self._cell_of([x0, x1], [y0, y1])
+        parts = []
+        for cy in range(int(ay), int(by) + 1):
+            a = self.ptr[cy * self.nx + ax]; b = self.ptr[cy * self.nx + bx + 1]
+            if b > a: parts.append(self.cell_items[a:b])
+        if len(self.long): parts.append(self.long)
+        if not parts: return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(parts))
+
+    def segment_at(self, x, y, tol):
+        """Item of the segment nearest to (x, y) within tol, or None."""
+        if not self.items: return None
+        cand = self._candidates(x - tol, y - tol, x + tol, y + tol)
+        if not len(cand): return None
+        e = self.ends[cand]
+        dx = e[:, 2] - e[:, 0]; dy = e[:, 3] - e[:, 1]
+        ll = dx * dx + dy * dy
+        t = np.clip(((x - e[:, 0]) * dx + (y - e[:, 1]) * dy) / np.where(ll > 0, ll, 1.0), 0.0, 1.0)
+        dist = np.hypot(e[:, 0] + t * dx - x, e[:, 1] + t * dy - y)
+        k = int(np.argmin(dist))
+        return self.items[int(cand[k])] if dist[k] <= tol else None
+
+    def segments_in_rect(self, rect, tol=0.0):
+        """Items whose segment crosses rect grown by tol (Liang-Barsky clip, vectorized)."""
+        if not self.items: return []
+        x0, y0, x1, y1 = rect.left() - tol, rect.top() - tol, rect.right() + tol, rect.bottom() + tol
+        cand = self._candidates(x0, y0, x1, y1)
+        if not len(cand): return []
+        lo = self.lo[cand]; hi = self.hi[cand]
+        cand = cand[(hi[:, 0] >= x0) & (lo[:, 0] <= x1) & (hi[:, 1] >= y0) & (lo[:, 1] <= y1)]
+        e = self.ends[cand]
+        dx = e[:, 2] - e[:, 0]; dy = e[:, 3] - e[:, 1]
+        t0 = np.zeros(len(cand)); t1 = np.ones(len(cand)); ok = np.ones(len(cand), dtype=bool)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for p, q in ((-dx, e[:, 0] - x0), (dx, x1 - e[:, 0]), (-dy, e[:, 1] - y0), (dy, y1 - e[:, 1])):
+                r = q / p
+                ok &= ~((p == 0) & (q < 0))
+                t0 = np.where(p < 0, np.maximum(t0, r), t0)
+                t1 = np.where(p > 0, np.minimum(t1, r), t1)
+        ok &= t0 <= t1
+        return [self.items[i] for i in cand[ok].tolist()]
+
+    @staticmethod
+    def tolerance(view, pixels=5):
+        """Scene distance of `pixels` screen pixels in view."""
+        scale = abs(view.transform().m11()) or 1.0
+        return pixels / scale if math.isfinite(scale) else pixels
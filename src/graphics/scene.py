@@ -1,8 +1,13 @@
+import math
 from PyQt6.QtWidgets import QGraphicsScene
-from PyQt6.QtCore import Qt, QPointF
+from PyQt6.QtCore import Qt, QPointF, QLineF, QRectF
 from PyQt6.QtGui import QColor, QBrush, QPen
+from src.graphics.items import ClickableLineItem
+from src.graphics.picking import SegmentPicker
 
 class CADGraphicsScene(QGraphicsScene):
+    MIN_GRID_PIXELS = 8 # minimum on-screen grid step
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.grid_size = 50
@@ -11,11 +16,71 @@ class CADGraphicsScene(QGraphicsScene):
         self.grid_color_dark = QColor(200, 200, 200)
         self.setBackgroundBrush(QBrush(QColor("#fafafa")))
         self.setSceneRect(-2000, -2000, 4000, 4000)
+        self.pen_light = QPen(self.grid_color_light, 1)
+        self.pen_light.setCosmetic(True)
+        self.pen_dark = QPen(self.grid_color_dark, 1.5)
+        self.pen_dark.setCosmetic(True)
+        self._grid_cache = None # (spacing, extent, light lines, dark lines)
+        self._picker = None
+
+    def addItem(self, item):
+        super().addItem(item)
+        if isinstance(item, ClickableLineItem): self._picker = None
+
+    def removeItem(self, item):
+        if isinstance(item, ClickableLineItem): self._picker = None
+        super().removeItem(item)
+
+    def clear(self):
+        self._picker = None
+        super().clear()
+
+    def invalidate_picker(self):
+        self._picker = None
+
+    def segment_picker(self):
+        """Spatial index of the segment items, rebuilt after segments are added, removed or moved."""
+        if self._picker is None:
+            self._picker = SegmentPicker(i for i in self.items() if isinstance(i, ClickableLineItem))
+        return self._picker
 
     def set_grid_visible(self, visible):
         self.grid_visible = visible
         self.update()
 
+    def grid_spacing(self, scale):
+        """
+        Grid step for a view scale: grid_size times a power of 5, at least MIN_GRID_PIXELS
+        on screen. None for a degenerate scale (zero-size view or singular transform).
+        """
+        if not (scale > 0 and math.isfinite(scale)): return None
+        ratio = self.MIN_GRID_PIXELS / (self.grid_size * scale)
+        if ratio <= 1: return self.grid_size
+        k = math.ceil(math.log(ratio, 5))
+        if self.grid_size * 5 ** (k - 1) * scale >= self.MIN_GRID_PIXELS: k -= 1 # log rounding
+        return self.grid_size * 5 ** k
+
+    def grid_lines(self, rect, spacing):
+        """
+        (light, dark) QLineF lists covering rect, every 5th line dark. Cached for the
+        spacing and an extent with a margin around rect, so panning reuses them.
+        """
+        cache = self._grid_cache
+        if cache and cache[0] == spacing and cache[1].contains(rect):
+            return cache[2], cache[3]
+        big = spacing * 5
+        margin_x = max(rect.width(), big); margin_y = max(rect.height(), big)
+        x0 = math.floor((rect.left() - margin_x) / big) * 5; x1 = math.ceil((rect.right() + margin_x) / big) * 5
+        y0 = math.floor((rect.top() - margin_y) / big) * 5; y1 = math.ceil((rect.bottom() + margin_y) / big) * 5
+        extent = QRectF(x0 * spacing, y0 * spacing, (x1 - x0) * spacing, (y1 - y0) * spacing)
+        light = []; dark = []
+        for i in range(x0, x1 + 1):
+            (dark if i % 5 == 0 else light).append(QLineF(i * spacing, extent.top(), i * spacing, extent.bottom()))
+        for j in range(y0, y1 + 1):
+            (dark if j % 5 == 0 else light).append(QLineF(extent.left(), j * spacing, extent.right(), j * spacing))
+        self._grid_cache = (spacing, extent, light, dark)
+        return light, dark
+
     def drawBackground(self, painter, rect):
         # Fill background
         painter.fillRect(rect, self.backgroundBrush())
@@ -23,36 +88,14 @@ class CADGraphicsScene(QGraphicsScene):
         if not self.grid_visible:
             return
 
-        # Draw Grid
-        left = int(rect.left()) - (int(rect.left()) % self.grid_size)
-        top = int(rect.top()) - (int(rect.top()) % self.grid_size)
-        
-        # Grid lines
-        lines_light = []
-        lines_dark = []
-        
-        x = left
-        while x < rect.right():
-            if x % (self.grid_size * 5) == 0:
-                lines_dark.append(QPointF(x, rect.top()))
-                lines_dark.append(QPointF(x, rect.bottom()))
-            else:
-                lines_light.append(QPointF(x, rect.top()))
-                lines_light.append(QPointF(x, rect.bottom()))
-            x += self.grid_size
-            
-        y = top
-        while y < rect.bottom():
-            if y % (self.grid_size * 5) == 0:
-                lines_dark.append(QPointF(rect.left(), y))
-                lines_dark.append(QPointF(rect.right(), y))
-            else:
-                lines_light.append(QPointF(rect.left(), y))
-                lines_light.append(QPointF(rect.right(), y))
-            y += self.grid_size
-
-        painter.setPen(QPen(self.grid_color_light, 1))
+        # Adaptive spacing keeps the number of grid lines bounded at any zoom
+        t = painter.worldTransform()
+        spacing = self.grid_spacing(math.hypot(t.m11(), t.m12()))
+        if spacing is None: return
+        lines_light, lines_dark = self.grid_lines(rect, spacing)
+
+        painter.setPen(self.pen_light)
         painter.drawLines(lines_light)
         
-        painter.setPen(QPen(self.grid_color_dark, 1.5))
+        painter.setPen(self.pen_dark)
         painter.drawLines(lines_dark)
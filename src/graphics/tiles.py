@@ -0,0 +1,129 @@
+import math
+from collections import OrderedDict
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, QRectF, pyqtSignal
+from PyQt6.QtGui import QImage, QPixmap, QPainter
+from PyQt6.QtCore import Qt
+
+
+class _TileSignals(QObject):
+    done = pyqtSignal(object, QImage) # (generation, key), image
+
+
+class _TileJob(QRunnable):
+    def __init__(self, render, source, key, generation, signals):
+        super().__init__()
+        self.render = render; self.source = source; self.key = key; self.generation = generation; self.signals = signals
+
+    def run(self):
+        try:
+            image = self.render(self.source, self.key)
+        except Exception as e:
+            print(f"M: Tile render failed: {e}")
+            image = QImage()
+        try:
+            self.signals.done.emit((self.generation, self.key), image)
+        except RuntimeError:
+            pass # cache deleted while the tile was rendering (e.g. on exit)
+
+
+class TileCache:
+    """
+    Pixmap tiles of static geometry per zoom level, LRU-evicted within a memory
+    budget. A tile key is (z, tx, ty): zoom level z draws at scale 2**z, and the
+    tile covers TILE / 2**z scene units from (tx, ty) * that size.
+    Missing tiles are rendered by render(source, key) -> QImage on a thread pool,
+    where source is the immutable content passed to request (workers never touch
+    the live item); the image is turned into a pixmap in the GUI thread and
+    on_ready(key) is called.
+    """
+    TILE = 256 # pixels per side
+
+    def __init__(self, render, on_ready, budget_mb=64):
+        self.render = render
+        self.on_ready = on_ready
+        self.tiles = OrderedDict()
+        self.bytes = 0
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.pending = set()
+        self.generation = 0
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max(1, QThreadPool.globalInstance().maxThreadCount() - 1))
+        self.signals = _TileSignals()
+        self.signals.done.connect(self._done)
+
+    @classmethod
+    def level(cls, lod):
+        """Zoom level whose scale is nearest to lod."""
+        return max(-30, min(30, round(math.log2(max(lod, 1e-9)))))
+
+    @classmethod
+    def tile_rect(cls, key):
+        z, tx, ty = key
+        size = cls.TILE / 2.0 ** z
+        return QRectF(tx * size, ty * size, size, size)
+
+    @classmethod
+    def keys_for(cls, rect, z):
+        size = cls.TILE / 2.0 ** z
+        x0 = math.floor(rect.left() / size); x1 = math.floor(rect.right() / size)
+        y0 = math.floor(rect.top() / size); y1 = math.floor(rect.bottom() / size)
+        return [(z, tx, ty) for ty in range(y0, y1 + 1) for tx in range(x0, x1 + 1)]
+
+    @property
+    def enabled(self):
+        return self.budget > 0
+
+    def set_budget(self, budget_mb):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self._evict()
+
+    def get(self, key):
+        pixmap = self.tiles.get(key)
+        if pixmap is not None: self.tiles.move_to_end(key)
+        return pixmap
+
+    def request(self, key, source):
+        """Queues the render of a tile of source, the content of the current generation."""
+        if key in self.pending or key in self.tiles: return
+        self.pending.add(key)
+        self.pool.start(_TileJob(self.render, source, key, self.generation, self.signals))
+
+    def clear(self):
+        """Drops all tiles; renders still running for the old content are ignored."""
+        self.generation += 1
+        self.tiles.clear()
+        self.pending.clear()
+        self.bytes = 0
+
+    def _done(self, tag, image):
+        generation, key = tag
+        if generation != self.generation: return
+        self.pending.discard(key)
+        if image.isNull() or not self.enabled: return
+        pixmap = QPixmap.fromImage(image)
+        self.tiles[key] = pixmap
+        self.bytes += pixmap.width() * pixmap.height() * 4
+        self._evict()
+        if key in self.tiles: self.on_ready(key)
+
+    def _evict(self):
+        while self.tiles and self.bytes > self.budget:
+            key, pixmap = self.tiles.popitem(last=False)
+            self.bytes -= pixmap.width() * pixmap.height() * 4
+
+    @classmethod
+    def new_image(cls):
+        image = QImage(cls.TILE, cls.TILE, QImage.Format.Format_ARGB32_Premultiplied)
+        image.fill(Qt.GlobalColor.transparent)
+        return image
+
+    @classmethod
+    def tile_painter(cls, image, key):
+        """QPainter on image mapping the tile's scene rect to the image pixels."""
+        z, tx, ty = key
+        scale = 2.0 ** z
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.scale(scale, scale)
+        painter.translate(-tx * cls.TILE / scale, -ty * cls.TILE / scale)
+        return painter
@@ -0,0 +1,39 @@
+from PyQt6.QtWidgets import QDialog, QVBoxLayout, QFormLayout, QDoubleSpinBox, QDialogButtonBox, QLabel
+
+class CostWeightsDialog(QDialog):
+    FIELDS = [
+        ("length", "Lunghezza (x):", 0.0, 100.0, 2),
+        ("bend", "Penalità curva (unità di disegno):", 0.0, 1e6, 1),
+        ("fill", "Penalità riempimento (x lunghezza a passerella piena):", 0.0, 100.0, 2),
+        ("preference", "Penalità passerella non dedicata (x lunghezza):", 0.0, 100.0, 2),
+        ("bend_angle", "Angolo minimo di curva (°):", 0.0, 180.0, 1),
+    ]
+
+    def __init__(self, weights, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Pesi dei Costi di Routing")
+        self.resize(450, 220)
+
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel("Con i pesi di default il percorso è il più corto."))
+
+        form_layout = QFormLayout()
+        self.spins = {}
+        for key, label, lo, hi, decimals in self.FIELDS:
+            spin = QDoubleSpinBox()
+            spin.setRange(lo, hi)
+            spin.setDecimals(decimals)
+            spin.setValue(float(weights.get(key, 0.0)))
+            form_layout.addRow(label, spin)
+            self.spins[key] = spin
+        layout.addLayout(form_layout)
+
+        btns = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        btns.accepted.connect(self.accept)
+        btns.rejected.connect(self.reject)
+        layout.addWidget(btns)
+
+        self.setLayout(layout)
+
+    def get_weights(self):
+        return {key: spin.value() for key, spin in self.spins.items()}
@@ -0,0 +1,37 @@
+import re
+from PyQt6.QtWidgets import QDialog, QVBoxLayout, QListWidget, QListWidgetItem, QDialogButtonBox, QLabel
+from PyQt6.QtCore import Qt
+
+class DxfLayersDialog(QDialog):
+    # Layer names pre-selected as tray layers
+    TRAY_PATTERN = re.compile(r"tray|passerell|canal|ladder|cable|cavi", re.IGNORECASE)
+
+    def __init__(self, layer_counts, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Livelli Passerelle DXF")
+        self.resize(400, 400)
+
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel("Le linee dei livelli selezionati diventano segmenti di passerella (selezionabili e usati dal routing).\n"
+                                "Le altre vengono disegnate come sfondo statico."))
+
+        preset = {name for name in layer_counts if self.TRAY_PATTERN.search(name)} or set(layer_counts)
+        self.list_layers = QListWidget()
+        for name, count in sorted(layer_counts.items()):
+            item = QListWidgetItem(f"{name} ({count} linee)")
+            item.setData(Qt.ItemDataRole.UserRole, name)
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(Qt.CheckState.Checked if name in preset else Qt.CheckState.Unchecked)
+            self.list_layers.addItem(item)
+        layout.addWidget(self.list_layers)
+
+        btns = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        btns.accepted.connect(self.accept)
+        btns.rejected.connect(self.reject)
+        layout.addWidget(btns)
+
+        self.setLayout(layout)
+
+    def get_layers(self):
+        return {self.list_layers.item(i).data(Qt.ItemDataRole.UserRole) for i in range(self.list_layers.count())
+                if self.list_layers.item(i).checkState() == Qt.CheckState.Checked}
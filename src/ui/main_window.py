@@ -9,6 +9,7 @@ import io
 import os
 import tempfile
 import ast
+import numpy as np
 from PyQt6.QtWidgets import (
     QMainWindow, QGraphicsView, QGraphicsScene, QDockWidget, QListWidget, 
     QTableWidget, QTableWidgetItem, QToolBar, QStatusBar, QWidget, QVBoxLayout, 
@@ -16,19 +17,37 @@ from PyQt6.QtWidgets import (
     QFileDialog, QMessageBox, QGraphicsPathItem, QGraphicsItem, QPushButton, 
     QGraphicsRectItem, QGraphicsLineItem, QComboBox, QDialog, QDialogButtonBox, 
     QTextEdit, QFormLayout, QGraphicsTextItem, QStyle, QHeaderView, QLineEdit, 
-    QWidgetAction, QGroupBox, QAbstractItemView
+    QWidgetAction, QGroupBox, QAbstractItemView, QInputDialog, QApplication, QProgressDialog, QRubberBand
 )
-from PyQt6.QtCore import Qt, QSize, QRectF, QPointF, QLineF, pyqtSignal
-from PyQt6.QtGui import (QAction, QIcon, QColor, QPen, QBrush, QPainter, 
+from PyQt6.QtCore import Qt, QSize, QRect, QRectF, QPointF, QLineF, pyqtSignal
+from PyQt6.QtGui import (QAction, QActionGroup, QIcon, QColor, QPen, QBrush, QPainter, 
                          QPainterPath, QLinearGradient, QGradient, QPixmap, QPolygonF, QFont)
 
 from src.config import STYLESHEET, resource_path
 from src.graphics.scene import CADGraphicsScene
-from src.graphics.items import SwitchboardItem, ClickableLineItem, AnalysisPointItem
+from src.graphics.items import SwitchboardItem, ClickableLineItem, AnalysisPointItem, HeatmapItem, BackgroundGeometryItem, NodeOverlayItem, RouteHighlightItem
+from src.graphics.picking import SegmentPicker
+from src.graphics.labels import SegmentLabelLayer
 import src.core.routing as routing
+from src.core.graph import CompactGraph
+from src.core.engine import RouteTask, route_serial
+from src.core.parallel import ParallelRouter, MultiStartRouter
+from src.core.connectivity import ServiceComponents
+from src.core.flow import FlowRouter, solver_available
+from src.core.redundancy import route_redundant
+from src.core.anytime import AnytimeRouter
+from src.core.ordering import STRATEGIES, order_tasks
+from src.core.costs import CostModel
+from src.core.constraints import resolve_via, resolve_avoid
+from src.core.smoothing import smooth_routes
+from src.core.routes import RouteStore
+from src.core.incidence import CableIncidence
+from src.core.heatmap import HeatmapLayers, service_capacities, DEFAULT_TRAY_NAME
 from src.core.trays.models import TrayCatalog, TrayInstance
 from src.ui.widgets.table_widget import ReorderableTableWidget
 from src.ui.dialogs.new_project_dialog import NewProjectDialog
+from src.ui.dialogs.cost_weights_dialog import CostWeightsDialog
+from src.ui.dialogs.dxf_layers_dialog import DxfLayersDialog
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -52,17 +71,26 @@ class MainWindow(QMainWindow):
         self.placing_switchboard_item_list_ref = None
         
         # Routing state
-        self.route_items = []
-        self.segment_usage = {}
+        self.cable_incidence = None # CableIncidence of the last routing run
         self.all_connections = []
+        self.route_store = None # RouteStore of the last routing run
         self.segment_trays = {} # key -> list of TrayInstance (New Multi-Tray Structure)
         self.segment_details = {} 
-        self.segment_labels = {} # key -> QGraphicsTextItem
+        self.label_layer = None # SegmentLabelLayer
         self.segment_label_visibility = {} # key -> bool (individual visibility preference)
         self.segment_label_config = {} # key -> set of property names to show in label
         self.selected_segment_key = None
         self.mixed_service_definitions = {} # key -> list of strings (included services)
-        self.heatmap_group = None
+        self.heatmap_item = None
+        self.heatmap_layers = None # HeatmapLayers of the last routing run
+        self.heatmap_layer = "all"
+        self.background_item = None # static DXF geometry
+        self.dxf_tray_layers = None # DXF layers imported as tray segments, None = all
+        self.background_cache_mb = 64 # tile cache of the static DXF background, 0 = off
+        self.routing_options = self.default_routing_options()
+        self.compact_graph = None
+        self.service_components = None
+        self.components_overlay = None
 
     def create_actions(self):
         self.act_new = QAction("Nuovo Progetto...", self)
@@ -156,6 +184,54 @@ class MainWindow(QMainWindow):
         self.act_import_dxf.setIcon(self.load_icon("import_dxf"))
         self.act_import_dxf.triggered.connect(self.import_dxf)
 
+        self.act_parallel_routing = QAction("Routing Parallelo (multi-core)", self)
+        self.act_parallel_routing.setCheckable(True)
+        self.act_parallel_routing.setChecked(True)
+        self.act_parallel_routing.toggled.connect(lambda c: self.routing_options.update({"parallel": c}))
+
+        self.act_optimistic_routing = QAction("Commit Ottimistico (speculativo)", self)
+        self.act_optimistic_routing.setCheckable(True)
+        self.act_optimistic_routing.setChecked(False)
+        self.act_optimistic_routing.toggled.connect(lambda c: self.routing_options.update({"mode": "optimistic" if c else "ordered"}))
+
+        self.act_global_flow = QAction("Ottimizzazione Globale (flusso min-cost)", self)
+        self.act_global_flow.setCheckable(True)
+        self.act_global_flow.setChecked(False)
+        self.act_global_flow.setEnabled(solver_available())
+        if not solver_available():
+            self.act_global_flow.setToolTip("Richiede SciPy")
+        self.act_global_flow.toggled.connect(lambda c: self.routing_options.update({"global_flow": c}))
+
+        self.act_node_disjoint = QAction("Ridondanza: percorsi disgiunti anche nei nodi", self)
+        self.act_node_disjoint.setCheckable(True)
+        self.act_node_disjoint.setChecked(False)
+        self.act_node_disjoint.toggled.connect(lambda c: self.routing_options.update({"node_disjoint": c}))
+
+        self.ordering_group = QActionGroup(self)
+        self.ordering_actions = {}
+        for key, label in STRATEGIES.items():
+            act = QAction(label, self)
+            act.setCheckable(True)
+            act.setChecked(key == "list")
+            act.toggled.connect(lambda c, k=key: c and self.routing_options.update({"ordering": k}))
+            self.ordering_group.addAction(act)
+            self.ordering_actions[key] = act
+
+        self.act_cost_weights = QAction("Pesi dei Costi...", self)
+        self.act_cost_weights.triggered.connect(self.edit_cost_weights)
+
+        self.act_smoothing = QAction("Smussatura Percorsi...", self)
+        self.act_smoothing.triggered.connect(self.set_smoothing)
+
+        self.act_background_cache = QAction("Cache Sfondo DXF...", self)
+        self.act_background_cache.triggered.connect(self.set_background_cache)
+
+        self.act_time_budget = QAction("Limite di Tempo...", self)
+        self.act_time_budget.triggered.connect(self.set_time_budget)
+
+        self.act_show_components = QAction("Diagnostica Connettività...", self)
+        self.act_show_components.triggered.connect(self.show_components_overlay)
+
     def load_icon(self, name):
         path = resource_path(os.path.join("assets", "icons", f"{name}.svg"))
         if os.path.exists(path):
@@ -270,7 +346,7 @@ class MainWindow(QMainWindow):
         self.layout_connections.addWidget(self.table_connections)
         
         self.btn_calc_routes = QPushButton("Calcola Percorsi")
-        self.btn_calc_routes.clicked.connect(self.calculate_routes)
+        self.btn_calc_routes.clicked.connect(lambda: self.calculate_routes())
         self.layout_connections.addWidget(self.btn_calc_routes)
         
 
@@ -348,6 +424,24 @@ class MainWindow(QMainWindow):
         view_menu.addAction(self.act_toggle_labels)
         view_menu.addAction(self.act_toggle_dimensions)
         view_menu.addAction(self.act_toggle_routes)
+        self.heatmap_layer_menu = view_menu.addMenu("Livello Mappa Termica")
+        self.heatmap_layer_menu.setEnabled(False)
+        self.heatmap_layer_group = QActionGroup(self)
+        view_menu.addAction(self.act_background_cache)
+
+        routing_menu = menubar.addMenu("Routing")
+        routing_menu.addAction(self.act_parallel_routing)
+        routing_menu.addAction(self.act_optimistic_routing)
+        routing_menu.addAction(self.act_global_flow)
+        routing_menu.addAction(self.act_node_disjoint)
+        routing_menu.addAction(self.act_time_budget)
+        routing_menu.addAction(self.act_cost_weights)
+        routing_menu.addAction(self.act_smoothing)
+        ordering_menu = routing_menu.addMenu("Ordine dei Cavi")
+        for act in self.ordering_actions.values():
+            ordering_menu.addAction(act)
+        routing_menu.addSeparator()
+        routing_menu.addAction(self.act_show_components)
 
     def create_toolbar(self):
         toolbar = QToolBar("Main Toolbar")
@@ -361,11 +455,12 @@ class MainWindow(QMainWindow):
 
     def create_central_widget(self):
         self.scene = CADGraphicsScene()
-        self.nodes_group = self.scene.createItemGroup([])
-        self.nodes_group.setZValue(100)
-        self.nodes_group.setVisible(False)
-        self.heatmap_group = self.scene.createItemGroup([])
-        self.heatmap_group.setZValue(5)
+        self.node_overlay = NodeOverlayItem()
+        self.node_overlay.setVisible(False)
+        self.scene.addItem(self.node_overlay)
+        self.heatmap_item = HeatmapItem()
+        self.scene.addItem(self.heatmap_item)
+        self.add_label_layer()
         # Dimensions Layer (container)
         self.dimensions_group = QGraphicsRectItem()
         self.dimensions_group.setPen(QPen(Qt.PenStyle.NoPen))
@@ -381,6 +476,8 @@ class MainWindow(QMainWindow):
         self.view.setResizeAnchor(QGraphicsView.ViewportAnchor.AnchorUnderMouse)
         
         self.setCentralWidget(self.view)
+        self.pick_band = QRubberBand(QRubberBand.Shape.Rectangle, self.view.viewport())
+        self.pick_origin = None # band start while dragging
         
         self.scene.selectionChanged.connect(self.on_selection_changed)
         
@@ -437,6 +534,9 @@ class MainWindow(QMainWindow):
                     self.table_cables.clearSelection()
                     self.list_errors.clearSelection()
                     self.reset_highlight()
+
+                    if self.view.dragMode() == QGraphicsView.DragMode.RubberBandDrag and self.pick_press(event):
+                        return True
             
             if event.type() == event.Type.MouseButtonRelease:
                  # Middle Click -> Pan (End)
@@ -444,6 +544,10 @@ class MainWindow(QMainWindow):
                      self._panning_middle = False
                      self.view.setCursor(Qt.CursorShape.ArrowCursor) # Or restore previous
                      return True
+
+                 if event.button() == Qt.MouseButton.LeftButton and self.pick_origin is not None:
+                     self.pick_release(event)
+                     return True
                      
 
 
@@ -462,6 +566,9 @@ class MainWindow(QMainWindow):
                     scrollbar_v.setValue(scrollbar_v.value() - delta.y())
                     return True
 
+                if self.pick_origin is not None:
+                    self.pick_band.setGeometry(QRect(self.pick_origin, event.pos()).normalized())
+
                 # Standard tracking
                 pos = self.view.mapToScene(event.pos())
                 self.lbl_coords.setText(f"X: {pos.x():.2f}  Y: {pos.y():.2f}")
@@ -477,6 +584,50 @@ class MainWindow(QMainWindow):
 
         return super().eventFilter(source, event)
 
+    def pick_press(self, event):
+        """
+        Left click in select mode: segments are picked through the scene's spatial
+        index instead of per-item shape tests; an empty click starts a selection band.
+        Other selectable items (switchboards, labels, points) keep the default handling.
+        Returns True if the event was handled.
+        """
+        for item in self.view.items(event.pos()):
+            if item.flags() & QGraphicsItem.GraphicsItemFlag.ItemIsSelectable and not isinstance(item, ClickableLineItem):
+                return False
+        pos = self.view.mapToScene(event.pos())
+        tol = max(ClickableLineItem.HIT_WIDTH / 2, SegmentPicker.tolerance(self.view, 3))
+        hit = self.scene.segment_picker().segment_at(pos.x(), pos.y(), tol)
+        toggle = bool(event.modifiers() & Qt.KeyboardModifier.ControlModifier)
+        if hit is not None:
+            self.select_segments([hit], add=toggle, toggle=toggle)
+            return True
+        self.pick_origin = event.pos()
+        self.pick_band.setGeometry(QRect(self.pick_origin, self.pick_origin))
+        self.pick_band.show()
+        return True
+
+    def pick_release(self, event):
+        rect = QRect(self.pick_origin, event.pos()).normalized()
+        self.pick_origin = None
+        self.pick_band.hide()
+        add = bool(event.modifiers() & Qt.KeyboardModifier.ControlModifier)
+        if rect.width() < 3 and rect.height() < 3:
+            items = [] # plain click on empty space
+        else:
+            items = self.scene.segment_picker().segments_in_rect(self.view.mapToScene(rect).boundingRect())
+        self.select_segments(items, add=add)
+
+    def select_segments(self, items, add=False, toggle=False):
+        """Selects items with one selectionChanged update instead of one per item."""
+        self.scene.blockSignals(True)
+        try:
+            if not add: self.scene.clearSelection()
+            for item in items:
+                item.setSelected(not item.isSelected() if toggle else True)
+        finally:
+            self.scene.blockSignals(False)
+        self.on_selection_changed()
+
     def keyPressEvent(self, event):
         if event.key() == Qt.Key.Key_Escape:
             if hasattr(self, 'placing_switchboard_name') and self.placing_switchboard_name:
@@ -565,7 +716,9 @@ class MainWindow(QMainWindow):
         self.list_errors.setItem(row, 4, QTableWidgetItem(str(message)))
         self.list_errors.scrollToBottom()
 
-    def load_dxf(self, filename):
+    def load_dxf(self, filename, tray_layers=None, ask_layers=False):
+        # tray_layers: DXF layers whose LINEs become interactive tray segments, None = all.
+        # Everything else is drawn by one static BackgroundGeometryItem.
         try:
             doc = ezdxf.readfile(filename)
             self.dxf_doc = doc # Store for saving
@@ -573,13 +726,14 @@ class MainWindow(QMainWindow):
             self.scene.clear()
             
             # Recreate groups after clear
-            self.nodes_group = self.scene.createItemGroup([])
-            self.nodes_group.setZValue(100)
-            self.nodes_group.setVisible(self.act_toggle_nodes.isChecked())
+            self.node_overlay = NodeOverlayItem()
+            self.node_overlay.setVisible(self.act_toggle_nodes.isChecked())
+            self.scene.addItem(self.node_overlay)
             
-            # Initialize heatmap group safely
-            self.heatmap_group = self.scene.createItemGroup([])
-            self.heatmap_group.setZValue(5)
+            # Initialize heatmap layer safely
+            self.heatmap_item = HeatmapItem()
+            self.scene.addItem(self.heatmap_item)
+            self.add_label_layer()
             
             pen_default = QPen(QColor("#333"), 1.5)
             pen_default.setCosmetic(True)
@@ -600,7 +754,9 @@ class MainWindow(QMainWindow):
 
             processed = 0
             count = 0
-            from PyQt6.QtWidgets import QApplication
+            lines = []; line_layers = [] # LINE entities
+            other_lines = [] # polyline segments
+            circles = []
             
             for entity in msp:
                 if progress and progress.wasCanceled():
@@ -611,42 +767,74 @@ class MainWindow(QMainWindow):
                     progress.setValue(processed)
                     QApplication.processEvents()
                 
-                item = None
                 try:
                     if entity.dxftype() == 'LINE':
                         start = entity.dxf.start; end = entity.dxf.end
-                        item = ClickableLineItem(start.x, -start.y, end.x, -end.y)
-                        item.setPen(pen_default)
-                        self.scene.addItem(item)
+                        lines.append((start.x, -start.y, end.x, -end.y))
+                        line_layers.append(entity.dxf.layer)
+                        count += 1
                     elif entity.dxftype() == 'CIRCLE':
                         center = entity.dxf.center; radius = entity.dxf.radius
-                        item = self.scene.addEllipse(center.x - radius, -(center.y+radius), radius*2, radius*2, pen_default)
+                        circles.append((center.x, -center.y, radius))
+                        count += 1
                     elif entity.dxftype() == 'LWPOLYLINE':
-                        points = entity.get_points(format='xy')
+                        points = [(p[0], -p[1]) for p in entity.get_points(format='xy')]
                         if points:
-                            path = QPainterPath()
-                            path.moveTo(points[0][0], -points[0][1])
-                            for p in points[1:]: path.lineTo(p[0], -p[1])
-                            if entity.closed: path.closeSubpath()
-                            item = self.scene.addPath(path, pen_default)
-                            for p in points: self.add_node(p[0], -p[1])
-                    if item:
-                        if entity.dxftype() == 'LINE':
-                             self.add_node(entity.dxf.start.x, -entity.dxf.start.y)
-                             self.add_node(entity.dxf.end.x, -entity.dxf.end.y)
-                        item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable)
-                        count += 1
+                            if entity.closed: points.append(points[0])
+                            other_lines.extend((a[0], a[1], b[0], b[1]) for a, b in zip(points, points[1:]))
+                            count += 1
                 except Exception as ex: self.log_error(f"Error {entity.dxftype()}: {ex}")
+            if progress: progress.close()
+
+            if ask_layers and tray_layers is None:
+                layer_counts = {}
+                for name in line_layers: layer_counts[name] = layer_counts.get(name, 0) + 1
+                if len(layer_counts) > 1:
+                    dlg = DxfLayersDialog(layer_counts, self)
+                    if dlg.exec(): tray_layers = dlg.get_layers()
+            self.dxf_tray_layers = None if tray_layers is None else sorted(tray_layers)
+
+            lines = np.array(lines, dtype=np.float64).reshape(-1, 4)
+            if tray_layers is None:
+                candidate = np.ones(len(lines), dtype=bool)
+            else:
+                candidate = np.array([name in tray_layers for name in line_layers], dtype=bool)
+            for x1, y1, x2, y2 in lines[candidate].tolist():
+                self.add_line_item(x1, y1, x2, y2, pen_default)
+            self.background_item = BackgroundGeometryItem(np.vstack([lines[~candidate], np.array(other_lines).reshape(-1, 4)]),
+                                                          np.array(circles).reshape(-1, 3), pen_default, self.background_cache_mb)
+            self.scene.addItem(self.background_item)
+            self.refresh_nodes()
             self.zoom_fit()
-            QMessageBox.information(self, "Importazione", f"Importati {count} oggetti.")
+            QMessageBox.information(self, "Importazione", f"Importati {count} oggetti ({int(candidate.sum())} segmenti di passerella).")
         except Exception as e:
             QMessageBox.critical(self, "Errore", f"Impossibile aprire il file:\n{str(e)}")
 
-    def add_node(self, x, y):
-        radius = 2.0 
-        node = self.scene.addEllipse(x-radius, y-radius, radius*2, radius*2, QPen(QColor("orange"), 1), QBrush(QColor("yellow")))
-        node.setZValue(100)
-        self.nodes_group.addToGroup(node)
+    def add_line_item(self, x1, y1, x2, y2, pen):
+        item = ClickableLineItem(x1, y1, x2, y2)
+        item.setPen(pen)
+        item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable)
+        self.scene.addItem(item)
+        return item
+
+    def promote_background_lines(self, keys):
+        """Turns the background lines with these segment keys into interactive tray segments."""
+        if self.background_item is None or not keys: return 0
+        bg = self.background_item.lines
+        mask = np.array([tuple(sorted((routing.get_node_key(x1, y1), routing.get_node_key(x2, y2)))) in keys
+                         for x1, y1, x2, y2 in bg.tolist()], dtype=bool)
+        pen = QPen(self.background_item.pen)
+        for x1, y1, x2, y2 in self.background_item.remove_lines(mask).tolist():
+            self.add_line_item(x1, y1, x2, y2, pen)
+        self.refresh_nodes()
+        return int(mask.sum())
+
+    def refresh_nodes(self):
+        """Rebuilds the nodes overlay from the segment end points (only while it is shown)."""
+        if self.node_overlay is None or not self.act_toggle_nodes.isChecked(): return
+        ends = self.scene.segment_picker().ends
+        spacing = float(np.median(np.hypot(ends[:, 2] - ends[:, 0], ends[:, 3] - ends[:, 1]))) if len(ends) else 0.0
+        self.node_overlay.set_points(np.vstack([ends[:, :2], ends[:, 2:]]), spacing)
 
 
 
@@ -724,23 +912,11 @@ class MainWindow(QMainWindow):
                      # current_props["Sezione"] = f"{len(trays)} element(i)" # REMOVED as per user request
                      for idx, t in enumerate(trays):
                          current_props[f"Passerella {idx+1}"] = f"{t.name} ({t.service})"
+                         eff_cap = t.capacity * (t.max_fill_percent / 100.0)
+                         if t.current_load and eff_cap > 0:
+                             current_props[f"Passerella {idx+1}"] += f" - {t.current_load / eff_cap * 100:.0f}%"
                      
-                     service_sums = {}
-                     for t in trays:
-                         if hasattr(t, 'included_services') and t.included_services:
-                             for item in t.included_services:
-                                 if isinstance(item, dict):
-                                     s_name = item.get('name')
-                                     s_pct = item.get('percent', 0)
-                                     val = t.capacity * (s_pct / 100.0)
-                                     service_sums[s_name] = service_sums.get(s_name, 0) + val
-                                 elif isinstance(item, str):
-                                     service_sums[item] = service_sums.get(item, 0) + t.capacity
-                         else:
-                             s_name = t.service
-                             service_sums[s_name] = service_sums.get(s_name, 0) + t.capacity
-                             
-                     for s_name, val in service_sums.items():
+                     for s_name, val in service_capacities(trays).items():
                          if val > 0:
                              current_props[f"Cap. {s_name}"] = f"{val:.0f} mm²"
 
@@ -757,12 +933,13 @@ class MainWindow(QMainWindow):
                 if note: current_props["Note"] = note
                 
             # Cables
-            if hasattr(self, 'segment_usage'):
-                 cables = self.segment_usage.get(key, [])
+            if self.cable_incidence is not None:
+                 cables = self.cable_incidence.cables_on_key(key).tolist()
                  if cables:
                      current_props["Totale Cavi"] = f"{len(cables)}"
                      # Add to detailed cable list
-                     for i, c in enumerate(cables):
+                     for i, conn_idx in enumerate(cables):
+                        c = self.all_connections[conn_idx]
                         c_id = c.get('ID', f"Cavo {i+1}")
                         route = f"{c.get('FROM')}->{c.get('TO')}"
                         c_type = c.get('Cable Type', c.get('TYPE', ''))
@@ -911,48 +1088,38 @@ class MainWindow(QMainWindow):
             final_text = "\n".join(lines)
             
             self.update_segment_label(key, item.line(), final_text)
-            
-            lbl = self.segment_labels.get(key)
-            if lbl:
-                 indiv = self.segment_label_visibility.get(key, True)
-                 glob = self.act_toggle_labels.isChecked()
-                 if not final_text.strip():
-                     lbl.setVisible(False)
-                 else:
-                     lbl.setVisible(indiv and glob)
     
     def toggle_dimensions(self):
         # Global Toggle: Enable "Lunghezza" property for ALL segments
         target_state = self.act_toggle_dimensions.isChecked()
         
-        # 1. Iterate all lines in scene
-        for item in self.scene.items():
-            if isinstance(item, ClickableLineItem) or (isinstance(item, QGraphicsLineItem) and hasattr(item, 'line')):
-                l = item.line()
-                p1 = routing.get_node_key(l.x1(), l.y1())
-                p2 = routing.get_node_key(l.x2(), l.y2())
-                key = tuple(sorted((p1, p2)))
-                
-                # Ensure Config Exists
-                if key not in self.segment_label_config:
-                    self.segment_label_config[key] = {"Trays", "Note"}
-                
-                # Update Config
-                if target_state:
-                    self.segment_label_config[key].add("Lunghezza")
-                else:
-                    self.segment_label_config[key].discard("Lunghezza")
-                
-                # Trigger Label Refresh
-                # We need to construct the text. calling update_segment_label with empty text might hide it?
-                # No, update_segment_label takes text. We need to Re-evaluate text.
-                # Use a helper or just re-run the logic?
-                # Actually on_label_prop_toggled logic rebuilds text.
-                # But that function relies on TABLE PROPS for order.
-                # If we are doing this globally, we might not have a table for every item.
-                # We need a headless way to rebuild label text.
-                
-                self.rebuild_label_for_segment(key, item)
+        # 1. Iterate all segments (labels only store their text, layout happens when shown)
+        for item in self.scene.segment_picker().items:
+            l = item.line()
+            p1 = routing.get_node_key(l.x1(), l.y1())
+            p2 = routing.get_node_key(l.x2(), l.y2())
+            key = tuple(sorted((p1, p2)))
+            
+            # Ensure Config Exists
+            if key not in self.segment_label_config:
+                self.segment_label_config[key] = {"Trays", "Note"}
+            
+            # Update Config
+            if target_state:
+                self.segment_label_config[key].add("Lunghezza")
+            else:
+                self.segment_label_config[key].discard("Lunghezza")
+            
+            # Trigger Label Refresh
+            # We need to construct the text. calling update_segment_label with empty text might hide it?
+            # No, update_segment_label takes text. We need to Re-evaluate text.
+            # Use a helper or just re-run the logic?
+            # Actually on_label_prop_toggled logic rebuilds text.
+            # But that function relies on TABLE PROPS for order.
+            # If we are doing this globally, we might not have a table for every item.
+            # We need a headless way to rebuild label text.
+            
+            self.rebuild_label_for_segment(key, item)
 
         # 2. Update Properties Table (if open)
         # Scan rows for "Lunghezza" and update chk
@@ -1001,9 +1168,9 @@ class MainWindow(QMainWindow):
              # For now, let's just handle Length primarily as requested.
         
         # 3. Cable Count
-        if "Totale Cavi" in cfg and hasattr(self, 'segment_usage'):
-             cables = self.segment_usage.get(key, [])
-             if cables: lines.append(f"Cavi: {len(cables)}")
+        if "Totale Cavi" in cfg and self.cable_incidence is not None:
+             n_cables = len(self.cable_incidence.cables_on_key(key))
+             if n_cables: lines.append(f"Cavi: {n_cables}")
              
         # 4. Notes
         if "Note" in cfg and hasattr(self, 'segment_details'):
@@ -1014,10 +1181,43 @@ class MainWindow(QMainWindow):
         self.update_segment_label(key, l, final_text)
 
     def toggle_routes(self, checked):
-        if hasattr(self, 'heatmap_group') and self.heatmap_group:
-            self.heatmap_group.setVisible(checked)
+        if self.heatmap_item is not None:
+            self.heatmap_item.setVisible(checked)
 
-    def calculate_routes(self):
+    def connection_key(self, conn, index):
+        """Stable key of a connection for recorded orderings: its ID, or its list position."""
+        cid = str(conn.get('ID') or '').strip()
+        return cid if cid else f"#{index}"
+
+    def edit_cost_weights(self):
+        dlg = CostWeightsDialog(self.routing_options.get("cost_weights", CostModel.WEIGHTS), self)
+        if dlg.exec():
+            self.routing_options["cost_weights"] = dlg.get_weights()
+
+    def set_smoothing(self):
+        value, ok = QInputDialog.getDouble(self, "Smussatura Percorsi",
+                                           "Aumento massimo di lunghezza per ridurre curve e cambi di passerella (%, 0 = disattivata):",
+                                           float(self.routing_options.get("smoothing", 0.0)), 0.0, 100.0, 1)
+        if ok: self.routing_options["smoothing"] = value
+
+    def set_background_cache(self):
+        mb, ok = QInputDialog.getInt(self, "Cache Sfondo DXF", "Memoria per le tessere dello sfondo (MB, 0 = disattivata):",
+                                     self.background_cache_mb, 0, 4096)
+        if not ok: return
+        self.background_cache_mb = mb
+        if self.background_item is not None: self.background_item.cache.set_budget(mb)
+        self.scene.update()
+
+    def set_time_budget(self):
+        value, ok = QInputDialog.getInt(self, "Limite di Tempo", "Secondi per il routing (0 = nessun limite):",
+                                        int(self.routing_options.get("time_budget", 0)), 0, 86400)
+        if ok: self.routing_options["time_budget"] = value
+
+    def calculate_routes(self, time_budget=None):
+        """
+        Routes all connections. With a time budget (seconds, default from the project
+        routing options) the anytime router is used and the best result is kept.
+        """
         self.log_file = None # Initialize to None
         try:
             # Open Log File
@@ -1039,7 +1239,7 @@ class MainWindow(QMainWindow):
             log(f"M: Starting calculate_routes...")
             try:
                 items = [i for i in self.scene.items() if (isinstance(i, QGraphicsLineItem) or hasattr(i, 'line'))]
-                graph = routing.build_routing_graph(items)
+                graph = routing.build_routing_graph(items, self.segment_trays)
                 if not graph: 
                     log("M: Graph is empty.")
                     QMessageBox.warning(self, "Errore", "Impossibile costruire il grafo di routing.")
@@ -1053,10 +1253,9 @@ class MainWindow(QMainWindow):
             # 2. Cleanup Old Routes
             # No need to remove items from scene as we don't add them anymore.
             # Just clear data.
-            if hasattr(self, 'all_connections'):
-                for conn in self.all_connections:
-                    if '_route_path' in conn: del conn['_route_path']
-
+            self.route_store = None
+            self.cable_incidence = None
+            self.reset_highlight()
 
             # 3. Add Virtual Nodes (Switchboards)
             try:
@@ -1071,7 +1270,7 @@ class MainWindow(QMainWindow):
                         points_to_map.append(p)
                 
                 log(f"M: Found {len(sw_positions_map)} switchboards.")
-                node_mapping = routing.add_virtual_nodes(graph, points_to_map, lines)
+                node_mapping = routing.add_virtual_nodes(graph, points_to_map, lines, self.segment_trays)
                 log("M: Virtual nodes added.")
                 
                 # DEBUG: Print status of first 5 segments in graph to see their assigned service
@@ -1094,15 +1293,14 @@ class MainWindow(QMainWindow):
                 log("M: No connections loaded.")
                 return
             
-            self.segment_usage = {}
             pen_route = QPen(QColor(0, 200, 0, 180), 4)
             pen_route = QPen(QColor(0, 200, 0, 180), 4)
             count = 0 # Initialize count variable
             failed_connections = []
             
-            # 4. Route Connections
-            # 4. Route Connections
+            # 4. Resolve Connections into routing tasks
             log(f"M: Routing {len(self.all_connections)} connections...")
+            pending = [] # (conn_idx, s_pos, e_pos, s_node, e_node, cable_type, cable_formation, cable_size)
             for conn_idx, conn in enumerate(self.all_connections):
                 try:
                     s_name = conn.get('FROM'); e_name = conn.get('TO')
@@ -1139,37 +1337,17 @@ class MainWindow(QMainWindow):
                         
                         if s_node and e_node:
                             # Debug first few connections to verify data and AVAILABLE KEYS
-                            if count < 3:
+                            if len(pending) < 3:
                                 log(f"M: Connection {s_name}->{e_name}")
                                 log(f"M:   Resolved Type: '{cable_type}'")
-                                if count == 0:
+                                if not pending:
                                     log(f"M:   Available Keys: {list(conn.keys())}")
 
                             try: d = float(conn.get('Diameter (mm)', 0))
                             except: d = 0
                             cable_size = math.pi * ((d/2)**2)
                             
-                            path = routing.astar(graph, s_node, e_node, cable_type, cable_size)
-                            if path:
-                                display_path = [s_pos] + path + [e_pos]
-                                route_path = self.create_route_path(display_path)
-                                conn['_route_path'] = route_path
-                                count += 1
-                                for i in range(len(path)-1):
-                                    k = tuple(sorted((path[i], path[i+1])))
-                                    if k not in self.segment_usage: self.segment_usage[k] = []
-                                    self.segment_usage[k].append(conn)
-                            else:
-                                failure_reason = "Segregation/Capacity/Connectivity"
-                                # log specific failure for debug?
-                                if count < 3: log(f"M:   FAILED: {failure_reason}")
-                                failed_connections.append({
-                                    'from': s_name, 
-                                    'to': e_name, 
-                                    'type': cable_type, 
-                                    'formation': cable_formation,
-                                    'error': failure_reason
-                                })
+                            pending.append((conn_idx, s_pos, e_pos, s_node, e_node, cable_type, cable_formation, cable_size))
                         else:
                              failed_connections.append({
                                 'from': s_name,
@@ -1190,17 +1368,148 @@ class MainWindow(QMainWindow):
                 except Exception as e:
                     log(f"M: Error checking connection {conn_idx}: {e}")
                     continue
+
+            # 5. Route on the compact graph (tray loads are committed cable by cable)
+            cgraph = CompactGraph.from_graph(graph, [p[5] for p in pending])
+            log(f"M: Compact graph: {cgraph.n_nodes} nodes, {cgraph.n_edges} edges, {cgraph.n_trays} trays.")
+            # Optional "Via" (waypoints) and "Avoid" (forbidden trays/points) columns
+            named_nodes = {name: cgraph.node_index[node_mapping[pos]] for name, pos in sw_positions_map.items()
+                           if node_mapping.get(pos) in cgraph.node_index}
+            avoid_cache = {}
+            rejected = {}
+            tasks = []
+            for p in pending:
+                conn = self.all_connections[p[0]]
+                via, unknown = resolve_via(cgraph, conn.get('Via') or conn.get('Passaggio'), named_nodes)
+                avoid_text = str(conn.get('Avoid') or conn.get('Evita') or '').strip()
+                if avoid_text not in avoid_cache: avoid_cache[avoid_text] = resolve_avoid(cgraph, avoid_text, named_nodes)
+                avoid, unknown_avoid = avoid_cache[avoid_text]
+                if unknown or unknown_avoid:
+                    rejected[p[0]] = f"Unknown Via/Avoid reference: {', '.join(unknown + unknown_avoid)}"
+                    continue
+                tasks.append(RouteTask(p[0], cgraph.node_index[p[3]], cgraph.node_index[p[4]], cgraph.service_id(p[5]), p[7], via, avoid))
+
+            # Connectivity pre-check: connections whose switchboards sit on separate
+            # networks for their service are rejected without searching
+            components = ServiceComponents(cgraph)
+            self.compact_graph = cgraph
+            self.service_components = components
+            routable = []
+            for task in tasks:
+                if components.connected(task.service, task.source, task.target):
+                    routable.append(task)
+                else:
+                    conn = self.all_connections[task.index]
+                    rejected[task.index] = f"No {cgraph.services[task.service]} path between {conn.get('FROM')} and {conn.get('TO')}"
+            log(f"M: Components per service: {dict(zip(cgraph.services, components.counts))}. {len(rejected)} connections rejected by pre-check.")
+
+            load = cgraph.new_load()
+
+            # Redundancy groups first: members share a group id in the CSV and get a disjoint path pair
+            groups = {}
+            for task in routable:
+                g_name = str(self.all_connections[task.index].get('Redundancy Group') or
+                             self.all_connections[task.index].get('Gruppo Ridondanza') or '').strip()
+                if g_name: groups.setdefault(g_name, []).append(task)
+            groups = {k: v for k, v in groups.items() if len(v) > 1}
+            redundant_results = {}
+            if groups:
+                grouped = {t.index for members in groups.values() for t in members}
+                routable = [t for t in routable if t.index not in grouped]
+                redundant_results, redundant_errors = route_redundant(
+                    cgraph, list(groups.items()), load, self.routing_options.get("node_disjoint", False))
+                rejected.update(redundant_errors)
+                log(f"M: Redundancy: {len(groups)} groups, {len(redundant_results)} cables on disjoint pairs, {len(redundant_errors)} failed.")
+
+            workers = self.routing_options.get("workers", 0) if self.routing_options.get("parallel", True) else 1
+            # Processing order: earlier cables get the short trunks once trays fill up
+            strategy = self.routing_options.get("ordering", "list")
+            priorities = {}; recorded = []
+            if strategy == "priority":
+                for task in routable:
+                    conn = self.all_connections[task.index]
+                    try: priorities[task.index] = float(conn.get('Priority') or conn.get('Priorità'))
+                    except (TypeError, ValueError): pass
+            elif strategy == "recorded":
+                positions = {}
+                for i, conn in enumerate(self.all_connections):
+                    positions.setdefault(self.connection_key(conn, i), i)
+                recorded = [positions[k] for k in self.routing_options.get("winning_order", []) if k in positions]
+            routable = order_tasks(cgraph, routable, strategy, priorities, recorded)
+
+            if time_budget is None: time_budget = self.routing_options.get("time_budget", 0)
+            model = CostModel.from_graph(cgraph, self.routing_options.get("cost_weights"))
+            if time_budget:
+                def publish(stage, m):
+                    self.lbl_status.setText(f"Routing ({stage}): lunghezza {m['length']:.1f}, segmenti in sovraccarico {m['overflow']}")
+                    QApplication.processEvents()
+                router = AnytimeRouter(budget=float(time_budget), log=log, publish=publish)
+            elif self.routing_options.get("global_flow", False):
+                router = FlowRouter(log=log)
+            else:
+                router_model = None if model.is_plain() else model
+                if strategy == "random":
+                    router = MultiStartRouter(starts=self.routing_options.get("starts", 8), workers=workers, log=log, model=router_model)
+                else:
+                    router = ParallelRouter(workers=workers, mode=self.routing_options.get("mode", "ordered"), log=log, model=router_model)
+            constrained_results = {}
+            if isinstance(router, (AnytimeRouter, FlowRouter)):
+                # These modes plan on plain shortest paths: Via/Avoid cables are routed first, in order
+                constrained = [t for t in routable if t.constrained()]
+                if constrained:
+                    routable = [t for t in routable if not t.constrained()]
+                    constrained_results = route_serial(cgraph, constrained, load)
+            results = router.route(cgraph, routable, load)
+            results.update(redundant_results)
+            results.update(constrained_results)
+            smoothing = self.routing_options.get("smoothing", 0.0)
+            self.last_smoothing_stats = None
+            if smoothing:
+                # Redundancy pairs keep their disjoint paths
+                smooth_tasks = [t for t in tasks if t.index not in redundant_results]
+                self.last_smoothing_stats = smooth_routes(cgraph, smooth_tasks, results, load, smoothing / 100.0,
+                                                          model.weights["bend_angle"], log, model)
+            if strategy == "random":
+                self.routing_options["winning_order"] = [self.connection_key(self.all_connections[i], i) for i in router.best_order]
+                log(f"M: Winning ordering '{router.stats.get('best')}' recorded in the project.")
+            cgraph.store_load(load)
+
+            routed_entries = []
+            routed_edges = []
+            cable_area = np.zeros(len(self.all_connections))
+            cable_service = np.zeros(len(self.all_connections), dtype=np.int64)
+            service_ids = {} # cable service name -> id, in order of appearance
+            for conn_idx, s_pos, e_pos, s_node, e_node, cable_type, cable_formation, cable_size in pending:
+                conn = self.all_connections[conn_idx]
+                res = results.get(conn_idx)
+                if res:
+                    routed_entries.append((conn_idx, s_pos, e_pos, res.nodes))
+                    routed_edges.append((conn_idx, res.edges))
+                    cable_area[conn_idx] = cable_size
+                    cable_service[conn_idx] = service_ids.setdefault(cable_type, len(service_ids))
+                    count += 1
+                else:
+                    failure_reason = rejected.get(conn_idx, "Capacity: no path with enough tray space")
+                    if conn_idx not in rejected and (conn.get('Via') or conn.get('Avoid') or conn.get('Passaggio') or conn.get('Evita')):
+                        failure_reason += " (Via/Avoid constraints)"
+                    failed_connections.append({
+                        'from': conn.get('FROM'), 
+                        'to': conn.get('TO'), 
+                        'type': cable_type, 
+                        'formation': cable_formation,
+                        'error': failure_reason
+                    })
                     
+            self.route_store = RouteStore.build(cgraph, routed_entries)
+            self.cable_incidence = CableIncidence.build(cgraph.edge_keys, cable_area, routed_edges, cable_service, list(service_ids))
             log(f"M: Routing complete. Found {count} paths.")
             
             # Debug Stats
             pair_counts = {}
-            # Debug Stats
-            pair_counts = {}
-            for conn in self.all_connections:
-                if '_route_path' in conn and conn['_route_path'] is not None:
-                    pair = tuple(sorted((conn.get('FROM'), conn.get('TO'))))
-                    pair_counts[pair] = pair_counts.get(pair, 0) + 1
+            for conn_idx in self.route_store.conn.tolist():
+                conn = self.all_connections[conn_idx]
+                pair = tuple(sorted((conn.get('FROM'), conn.get('TO'))))
+                pair_counts[pair] = pair_counts.get(pair, 0) + 1
             
             log("--- Routing Stats (Success) ---")
             for pair, c in pair_counts.items():
@@ -1209,14 +1518,13 @@ class MainWindow(QMainWindow):
             
             # --- Populate Routed Cables Table ---
             self.table_routed_cables.setRowCount(0)
-            self.routed_connections_map = [] # Store reference to conn for each row
+            self.routed_connections_map = [] # Connection index for each row
             
-            for conn in self.all_connections:
-                if '_route_path' in conn and conn['_route_path'] is not None:
-                    path = conn['_route_path']
-                    length = path.length()
+            for conn_idx, conn in enumerate(self.all_connections):
+                if conn_idx in self.route_store:
+                    length = self.route_store.length(conn_idx)
                     
-                    self.routed_connections_map.append(conn)
+                    self.routed_connections_map.append(conn_idx)
                     
                     row = self.table_routed_cables.rowCount()
                     self.table_routed_cables.insertRow(row)
@@ -1240,7 +1548,25 @@ class MainWindow(QMainWindow):
             # 5. Heatmap
             self.update_heatmap()
             
-            QMessageBox.information(self, "Routing", f"Calcolati {count} percorsi.\nVerifica mappa termica (Blu/Arancio/Rosso) per riempimento.")
+            st = self.last_routing_stats = dict(router.stats)
+            stats_text = ""
+            if st.get("mode") == "anytime":
+                stats_text = (f"\nLimite di tempo {st.get('budget'):.0f}s: {len(st.get('stages', []))} fasi, "
+                              f"lunghezza totale {st.get('length'):.1f}, segmenti in sovraccarico {st.get('overflow')}")
+            elif st.get("mode") == "multistart":
+                stats_text = (f"\nMulti-start: {st.get('starts')} ordinamenti, migliore '{st.get('best')}' "
+                              f"({st.get('routed')} cavi, lunghezza {st.get('length'):.1f})")
+            elif st.get("mode") == "flow":
+                stats_text = (f"\nOttimizzazione globale: {st.get('commodities')} gruppi, {st.get('columns')} percorsi candidati, "
+                              f"{st.get('iterations')} iterazioni LP, {st.get('lp_routed')} cavi su percorsi LP, "
+                              f"{st.get('fallback')} in fallback greedy ({st.get('fallback_routed')} instradati)")
+            elif st.get("mode") in ("ordered", "optimistic"):
+                stats_text = (f"\nParallelo ({st.get('mode')}): {st.get('workers')} processi, {st.get('rounds')} round, "
+                              f"conflitti {router.conflict_rate()*100:.1f}%, speedup x{router.speedup():.2f}")
+            if self.last_smoothing_stats:
+                sm = self.last_smoothing_stats
+                stats_text += f"\nSmussatura: {sm['improved']} cavi migliorati, curve {sm['bends'][0]} → {sm['bends'][1]}"
+            QMessageBox.information(self, "Routing", f"Calcolati {count} percorsi.{stats_text}\nVerifica mappa termica (Blu/Arancio/Rosso) per riempimento.")
             
         except Exception as e:
             log(f"M: CRITICAL ERROR IN ROUTING: {e}")
@@ -1248,87 +1574,28 @@ class MainWindow(QMainWindow):
             QMessageBox.critical(self, "Errore", f"Errore critico nel routing: {e}")
 
     def update_heatmap(self):
+        # Recomputes the heatmap layers after a routing run; switching layers reuses them
         print("M: Updating Heatmap...", flush=True)
         try:
-            default_tray_name = "Default (100x50)"
-            default_capacity = 5000.0 
-
-            # Create group
-            print("M: Handling heatmap group...", flush=True)
-            if self.heatmap_group is not None:
-                try:
-                    self.scene.removeItem(self.heatmap_group)
-                except Exception as e:
-                    print(f"M: Cleanup ignored: {e}", flush=True)
-                self.heatmap_group = None
-            
-            self.heatmap_group = self.scene.createItemGroup([])
-            self.heatmap_group.setZValue(5) 
-            self.heatmap_group.setVisible(self.act_toggle_routes.isChecked())
-            print("M: Heatmap group created.", flush=True)
-
-            print(f"M: Processing {len(self.segment_usage)} segments for heatmap...", flush=True)
-            for segment, cables in self.segment_usage.items():
-                try:
-                    p1, p2 = segment
-                    
-                    total_area = 0.0
-                    for c in cables:
-                        try: d = float(c.get('Diameter (mm)', '0').strip() or 0)
-                        except: d = 0
-                        total_area += math.pi * ((d/2)**2)
-                        
-                    capacity = default_capacity
-                    tray_name = default_tray_name
-                    
-                    if hasattr(self, 'segment_trays') and segment in self.segment_trays:
-                        trays = self.segment_trays[segment]
-                        if trays:
-                            capacity = sum(t.capacity for t in trays)
-                            tray_name = " + ".join([t.name for t in trays])
-                            if len(trays) > 1: tray_name = f"Multi ({len(trays)})"
-                    elif hasattr(self, 'segment_capacities') and segment in self.segment_capacities:
-                        val = self.segment_capacities[segment]
-                        if isinstance(val, tuple): capacity, tray_name = val
-                        else: capacity = val
-                    
-                    if not capacity or capacity <= 0: capacity = 1.0
-                    ratio = total_area / capacity
-                    
-                    # --- Simplified Heatmap Visualization (Blue only) ---
-                    
-                    # 1. Color = Blue
-                    main_color = QColor("blue")
-                    main_color.setAlpha(180) # Slight transparency
-
-                    # 2. Variable Thickness - Reduced
-                    # New range: 2 to 6 pixels
-                    base_width = 2.0 + (min(ratio, 1.0) * 4.0)
-                    
-                    # 3. Glow Effect (Removed for cleaner look as requested "contenuto")
-                    # If desired, keep it very subtle or remove. Let's remove to reduce thickness.
-                    
-
-                    
-                    # 4. Main Line
-                    pen_main = QPen(main_color, base_width)
-                    pen_main.setCapStyle(Qt.PenCapStyle.RoundCap)
-                    
-                    line_main = QGraphicsLineItem(p1[0], p1[1], p2[0], p2[1])
-                    line_main.setPen(pen_main)
-                    
-                    # Tooltip only on main line
-                    info_tooltip = (f"Passerella: {tray_name}\n"
-                                  f"Riempimento: {ratio*100:.1f}%\n"
-                                  f"Cavi Presenti: {len(cables)}\n"
-                                  f"Area Occupata: {total_area:.1f} mm²\n"
-                                  f"Capacità Totale: {capacity:.1f} mm²")
-                    line_main.setToolTip(info_tooltip)
-                    
-                    self.heatmap_group.addToGroup(line_main)
-                    
-                except Exception as e:
-                    print(f"M: Error processing heatmap segment: {e}")
+            if self.heatmap_item is None:
+                self.heatmap_item = HeatmapItem()
+                self.scene.addItem(self.heatmap_item)
+            self.heatmap_item.setVisible(self.act_toggle_routes.isChecked())
+
+            if self.cable_incidence is None:
+                self.heatmap_layers = None
+                self.heatmap_item.set_segments(np.zeros((0, 4)))
+                self.rebuild_heatmap_layer_menu()
+                return
+            layers = self.heatmap_layers = HeatmapLayers(self.cable_incidence, self.segment_trays)
+            print(f"M: Processing {len(layers.used)} segments, {len(layers.layers)} layers for heatmap...", flush=True)
+            self.heatmap_item.set_segments(layers.ends(), self.heatmap_tooltip)
+            for key, (label, ratio, mask) in layers.layers.items():
+                # Width 2 to 6 units with the fill ratio
+                self.heatmap_item.set_layer(key, 2.0 + np.minimum(ratio, 1.0) * 4.0, mask)
+            if self.heatmap_layer not in layers.layers: self.heatmap_layer = "all"
+            self.heatmap_item.show_layer(self.heatmap_layer)
+            self.rebuild_heatmap_layer_menu()
                     
         except Exception as e:
             print(f"M: Error updating heatmap: {e}")
@@ -1338,15 +1605,103 @@ class MainWindow(QMainWindow):
             tb = traceback.format_exc()
             QMessageBox.critical(self, "Errore Inatteso", f"Si è verificato un errore durante il calcolo:\n{str(e)}\n\n{tb}")
             return
-        
-
 
-    def create_route_path(self, path_nodes):
-        path = QPainterPath()
-        if not path_nodes: return path
-        path.moveTo(path_nodes[0][0], path_nodes[0][1])
-        for p in path_nodes[1:]: path.lineTo(p[0], p[1])
-        return path
+    def rebuild_heatmap_layer_menu(self):
+        self.heatmap_layer_menu.clear()
+        for act in self.heatmap_layer_group.actions():
+            self.heatmap_layer_group.removeAction(act)
+        if self.heatmap_layers is None:
+            self.heatmap_layer_menu.setEnabled(False)
+            return
+        for key, (label, ratio, mask) in self.heatmap_layers.layers.items():
+            act = QAction(label, self)
+            act.setCheckable(True)
+            act.setChecked(key == self.heatmap_layer)
+            act.toggled.connect(lambda c, k=key: c and self.set_heatmap_layer(k))
+            self.heatmap_layer_group.addAction(act)
+            self.heatmap_layer_menu.addAction(act)
+        self.heatmap_layer_menu.setEnabled(True)
+
+    def set_heatmap_layer(self, key):
+        self.heatmap_layer = key
+        if self.heatmap_item is not None:
+            self.heatmap_item.show_layer(key)
+
+    def heatmap_tooltip(self, i):
+        layers = self.heatmap_layers
+        inc = layers.incidence; fill = layers.fill
+        seg = int(layers.used[i])
+        trays = layers.trays[i]
+        tray_name = DEFAULT_TRAY_NAME
+        if trays:
+            tray_name = " + ".join([t.name for t in trays])
+            if len(trays) > 1: tray_name = f"Multi ({len(trays)})"
+        info_tooltip = (f"Passerella: {tray_name}\n"
+                        f"Riempimento: {fill['ratio'][seg]*100:.1f}%\n"
+                        f"Cavi Presenti: {int(fill['count'][seg])}\n"
+                        f"Area Occupata: {fill['area'][seg]:.1f} mm²\n"
+                        f"Capacità Totale: {layers.capacity[seg]:.1f} mm²")
+        if self.heatmap_layer != "all":
+            label, ratio, mask = layers.layers[self.heatmap_layer]
+            info_tooltip += f"\n{label} - Riempimento: {ratio[i]*100:.1f}%"
+        for s_id in np.nonzero(fill["service_count"][:, seg])[0].tolist():
+            info_tooltip += (f"\n  {inc.services[s_id]}: {fill['service_count'][s_id, seg]} cavi, "
+                             f"{fill['service_area'][s_id, seg]:.1f} mm²")
+        # Per-tray fill from the bin assignment of the last routing run
+        for t in trays:
+            eff_cap = t.capacity * (t.max_fill_percent / 100.0)
+            if eff_cap > 0:
+                info_tooltip += f"\n  {t.name} ({t.service}): {t.current_load:.0f} mm² - {t.current_load / eff_cap * 100:.1f}%"
+        return info_tooltip
+
+    def clear_components_overlay(self):
+        if self.components_overlay is not None:
+            try:
+                if self.components_overlay.scene() == self.scene:
+                    self.scene.removeItem(self.components_overlay)
+            except RuntimeError:
+                pass # Already deleted by scene.clear()
+            self.components_overlay = None
+
+    def show_components_overlay(self):
+        # Draws the connected components of one service (from the last routing run)
+        if self.service_components is None or not self.compact_graph.services:
+            QMessageBox.information(self, "Diagnostica", "Esegui prima il calcolo dei percorsi.")
+            return
+        
+        cgraph = self.compact_graph
+        hide_text = "(Nascondi)"
+        name, ok = QInputDialog.getItem(self, "Diagnostica Connettività", "Servizio:", cgraph.services + [hide_text], 0, False)
+        if not ok: return
+        self.clear_components_overlay()
+        if name not in cgraph.services: return
+        
+        s_id = cgraph.services.index(name)
+        labels = self.service_components.edge_components(s_id)
+        u, v = cgraph.edge_endpoints()
+        xs, ys = cgraph.x, cgraph.y
+        
+        paths = {}
+        for e in np.nonzero(labels >= 0)[0].tolist():
+            lab = int(labels[e])
+            if lab not in paths: paths[lab] = QPainterPath()
+            path = paths[lab]
+            path.moveTo(xs[u[e]], ys[u[e]])
+            path.lineTo(xs[v[e]], ys[v[e]])
+            
+        self.components_overlay = self.scene.createItemGroup([])
+        self.components_overlay.setZValue(7)
+        for i, (lab, path) in enumerate(sorted(paths.items())):
+            color = QColor.fromHsv((i * 137) % 360, 220, 220, 200)
+            pen = QPen(color, 4)
+            pen.setCosmetic(True)
+            item = QGraphicsPathItem(path)
+            item.setPen(pen)
+            n_nodes = int(np.count_nonzero(self.service_components.labels[s_id] == lab))
+            item.setToolTip(f"{name} - Componente {i+1}/{len(paths)}\nNodi: {n_nodes}")
+            self.components_overlay.addToGroup(item)
+        
+        self.lbl_status.setText(f"{name}: {len(paths)} componenti connesse")
 
     def report_routing_errors(self, errors):
         # errors is a list of dicts now
@@ -1383,45 +1738,35 @@ class MainWindow(QMainWindow):
                 self.scene.removeItem(self.highlight_overlay)
             self.highlight_overlay = None
 
-    def highlight_connection(self, conn):
-        cid = conn.get('ID', '?')
-        self.lbl_status.setText(f"Selezionato: {cid}")
-        
-        # 1. Clear existing highlight overlay if any
+    def highlight_connection(self, conn_idx):
+        self.highlight_connections([conn_idx])
+
+    def highlight_connections(self, conn_indices):
+        # All selected routes in one overlay item, overlapping cables bundled side by side
         self.reset_highlight()
-            
-        # 2. Add new highlight overlay
-        if '_route_path' in conn:
-            path = conn['_route_path']
-            
-            if path.isEmpty():
-                print("DEBUG: Path is empty!")
-                return
+        if len(conn_indices) == 1:
+            cid = self.all_connections[conn_indices[0]].get('ID', '?')
+            self.lbl_status.setText(f"Selezionato: {cid}")
+        else:
+            self.lbl_status.setText(f"Selezionati: {len(conn_indices)} cavi")
 
-            self.highlight_overlay = QGraphicsPathItem(path)
-            
-            # Check bounding rect
-            br = path.boundingRect()
-            
-            # STYLE: Red, Width 8
-            pen = QPen(QColor("red"), 8) 
-            pen.setCapStyle(Qt.PenCapStyle.RoundCap)
-            pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
-            self.highlight_overlay.setPen(pen)
-                
-            self.highlight_overlay.setZValue(9999) # Absolute top
-            self.highlight_overlay.setOpacity(1.0)
-            
-            self.scene.addItem(self.highlight_overlay)
-            
-            # Pan view
-            center = br.center()
-            self.view.ensureVisible(br, 50, 50) 
-            self.view.centerOn(center)
-            
-            self.scene.update()
+        if self.route_store is None:
+            segs, owner, routed = np.zeros((0, 4)), np.zeros(0, dtype=np.int64), []
         else:
-            self.lbl_status.setText(f"Selezionato: {cid} (Non instradato)")
+            segs, owner, routed = self.route_store.segments(conn_indices)
+        if not routed:
+            self.lbl_status.setText(self.lbl_status.text() + " (Non instradato)")
+            return
+        if len(routed) < len(conn_indices):
+            self.lbl_status.setText(self.lbl_status.text() + f" ({len(conn_indices) - len(routed)} non instradati)")
+
+        self.highlight_overlay = RouteHighlightItem(segs, owner)
+        self.scene.addItem(self.highlight_overlay)
+
+        # Pan view
+        br = self.highlight_overlay.boundingRect()
+        self.view.ensureVisible(br, 50, 50)
+        self.view.centerOn(br.center())
 
     def on_connection_selected(self):
         try:
@@ -1430,11 +1775,10 @@ class MainWindow(QMainWindow):
                 self.reset_highlight()
                 return
             
-            row = rows[0].row()
-            if row < 0 or row >= len(self.all_connections): return
+            conns = sorted(r.row() for r in rows if 0 <= r.row() < len(self.all_connections))
+            if not conns: return
             
-            conn = self.all_connections[row]
-            self.highlight_connection(conn)
+            self.highlight_connections(conns)
 
         except Exception as e:
             traceback.print_exc()
@@ -1449,11 +1793,11 @@ class MainWindow(QMainWindow):
                 self.reset_highlight()
                 return
             
-            row = rows[0].row()
-            if row < 0 or row >= len(self.routed_connections_map): return
+            conns = [self.routed_connections_map[r] for r in sorted(r.row() for r in rows)
+                     if 0 <= r < len(self.routed_connections_map)]
+            if not conns: return
             
-            conn = self.routed_connections_map[row]
-            self.highlight_connection(conn)
+            self.highlight_connections(conns)
             
         except Exception as e:
             traceback.print_exc()
@@ -1464,7 +1808,7 @@ class MainWindow(QMainWindow):
 
     def import_dxf(self):
         path, _ = QFileDialog.getOpenFileName(self, "Importa DXF", "", "DXF (*.dxf)")
-        if path: self.load_dxf(path)
+        if path: self.load_dxf(path, ask_layers=True)
 
     def new_project(self):
         # 1. Open Dialog
@@ -1478,30 +1822,56 @@ class MainWindow(QMainWindow):
 
     def cleanup_groups(self):
         # Safely remove groups if they exist
-        if hasattr(self, 'nodes_group') and self.nodes_group:
-            if self.nodes_group.scene() == self.scene: self.scene.removeItem(self.nodes_group)
-            self.nodes_group = None
+        if self.node_overlay is not None:
+            if self.node_overlay.scene() == self.scene: self.scene.removeItem(self.node_overlay)
+            self.node_overlay = None
             
-        if hasattr(self, 'heatmap_group') and self.heatmap_group:
-            if self.heatmap_group.scene() == self.scene: self.scene.removeItem(self.heatmap_group)
-            self.heatmap_group = None
+        if self.heatmap_item is not None:
+            if self.heatmap_item.scene() == self.scene: self.scene.removeItem(self.heatmap_item)
+            self.heatmap_item = None
+
+        if self.label_layer is not None:
+            if self.label_layer.scene() == self.scene: self.scene.removeItem(self.label_layer)
+            self.label_layer = None
+
+    @staticmethod
+    def default_routing_options():
+        # workers 0 = all cores, time_budget 0 = no limit, smoothing = length tolerance %, 0 = off
+        return {"parallel": True, "workers": 0, "mode": "ordered", "global_flow": False, "node_disjoint": False, "time_budget": 0,
+                "ordering": "list", "starts": 8, "winning_order": [],
+                "cost_weights": dict(CostModel.WEIGHTS), "smoothing": 0.0}
+
+    def sync_routing_actions(self):
+        """Sets the check state of the routing menu actions from routing_options."""
+        opts = self.routing_options
+        self.act_parallel_routing.setChecked(opts.get("parallel", True))
+        self.act_optimistic_routing.setChecked(opts.get("mode") == "optimistic")
+        self.act_global_flow.setChecked(opts.get("global_flow", False))
+        self.act_node_disjoint.setChecked(opts.get("node_disjoint", False))
+        self.ordering_actions.get(opts.get("ordering"), self.ordering_actions["list"]).setChecked(True)
 
     def reset_application_state(self):
         self.cleanup_groups()
         self.scene.clear()
         
         self.dxf_doc = None
+        self.background_item = None
+        self.dxf_tray_layers = None
         
         # Data Structures
         self.segment_trays = {}
         self.segment_details = {}
         # self.segment_capacities = {} # Deprecated
-        self.segment_usage = {}
-        self.segment_labels = {}
+        self.cable_incidence = None
+        self.route_store = None
+        self.highlight_overlay = None # removed by scene.clear()
+        self.heatmap_layers = None
+        self.rebuild_heatmap_layer_menu()
         self.segment_label_config = {}
         self.segment_label_visibility = {}
-        self.route_items = []
         self.all_connections = []
+        self.routing_options = self.default_routing_options()
+        self.sync_routing_actions()
         
         # Temp items
         self.placing_switchboard_name = None
@@ -1521,6 +1891,8 @@ class MainWindow(QMainWindow):
 
     def process_loaded_connections(self):
         # Processes self.all_connections to populate UI
+        self.route_store = None # routes refer to connection indexes of the previous list
+        self.cable_incidence = None
         if not self.all_connections: return
         
         self.list_switchboards.clear()
@@ -1556,7 +1928,7 @@ class MainWindow(QMainWindow):
             
             # 3. Load DXF
             if dxf_path and os.path.exists(dxf_path):
-                self.load_dxf(dxf_path)
+                self.load_dxf(dxf_path, ask_layers=True)
             
             # 4. Load CSV
             if csv_path and os.path.exists(csv_path):
@@ -1583,19 +1955,20 @@ class MainWindow(QMainWindow):
     def activate_select(self): self.view.setDragMode(QGraphicsView.DragMode.RubberBandDrag)
     
     def toggle_grid(self, c): self.scene.set_grid_visible(c)
-    def toggle_nodes(self, c): self.nodes_group.setVisible(c)
+    def toggle_nodes(self, c):
+        if self.node_overlay is None: return
+        self.refresh_nodes()
+        self.node_overlay.setVisible(c)
     
     def toggle_labels(self, c):
-        # Global toggle
-        for key, lbl in self.segment_labels.items():
-            indiv = self.segment_label_visibility.get(key, True)
-            lbl.setVisible(c and indiv)
+        # Global toggle, individual visibility is kept by the layer
+        if self.label_layer is not None:
+            self.label_layer.setVisible(c)
 
     def set_individual_label_visibility(self, visible, key):
         self.segment_label_visibility[key] = visible
-        if key in self.segment_labels:
-            global_visible = self.act_toggle_labels.isChecked()
-            self.segment_labels[key].setVisible(global_visible and visible)
+        if self.label_layer is not None:
+            self.label_layer.set_label_visible(key, visible)
     
     def place_switchboard_from_list(self, item):
         self.placing_switchboard_name = item.text()
@@ -1681,8 +2054,11 @@ class MainWindow(QMainWindow):
                     "settings": {
                         "grid_visible": self.act_toggle_grid.isChecked(),
                         "nodes_visible": self.act_toggle_nodes.isChecked(),
-                        "labels_visible": self.act_toggle_labels.isChecked()
-                    }
+                        "labels_visible": self.act_toggle_labels.isChecked(),
+                        "dxf_tray_layers": self.dxf_tray_layers,
+                        "background_cache_mb": self.background_cache_mb
+                    },
+                    "routing": self.routing_options
                 }
                 
                 # Switchboards
@@ -1735,19 +2111,23 @@ class MainWindow(QMainWindow):
         
         try:
             with zipfile.ZipFile(path, 'r') as zf:
+                state = json.loads(zf.read("project.json")) if "project.json" in zf.namelist() else None
                 # 1. Load DXF
                 if "drawing.dxf" in zf.namelist():
+                    tray_layers = (state or {}).get("settings", {}).get("dxf_tray_layers")
+                    self.background_cache_mb = (state or {}).get("settings", {}).get("background_cache_mb", self.background_cache_mb)
                     with tempfile.NamedTemporaryFile(delete=False, suffix=".dxf") as tmp:
                         tmp.write(zf.read("drawing.dxf"))
                         tmp.close()
-                        self.load_dxf(tmp.name)
+                        self.load_dxf(tmp.name, None if tray_layers is None else set(tray_layers))
                         os.unlink(tmp.name)
                 else:
                      # If no DXF, ensure groups exist (reset_application_state cleared them)
-                     self.nodes_group = self.scene.createItemGroup([])
-                     self.nodes_group.setZValue(100)
-                     self.heatmap_group = self.scene.createItemGroup([])
-                     self.heatmap_group.setZValue(5)
+                     self.node_overlay = NodeOverlayItem()
+                     self.scene.addItem(self.node_overlay)
+                     self.heatmap_item = HeatmapItem()
+                     self.scene.addItem(self.heatmap_item)
+                     self.add_label_layer()
                 
                 # 2. Load Connections
                 if "connections.csv" in zf.namelist():
@@ -1758,9 +2138,7 @@ class MainWindow(QMainWindow):
                     self.process_loaded_connections()
                     
                 # 3. Load State
-                if "project.json" in zf.namelist():
-                    state = json.loads(zf.read("project.json"))
-                    
+                if state is not None:
                     # Settings
                     s = state.get("settings", {})
                     self.act_toggle_grid.setChecked(s.get("grid_visible", True))
@@ -1769,6 +2147,10 @@ class MainWindow(QMainWindow):
                     self.toggle_grid(self.act_toggle_grid.isChecked())
                     self.toggle_nodes(self.act_toggle_nodes.isChecked())
                     
+                    # Routing Options
+                    self.routing_options.update(state.get("routing", {}))
+                    self.sync_routing_actions()
+                    
                     # Mixed Definitions
                     self.mixed_service_definitions = state.get("mixed_definitions", {})
                     
@@ -1789,6 +2171,9 @@ class MainWindow(QMainWindow):
                                 
                     # Segments
                     segments = state.get("segments", {})
+                    # Segments with trays drawn on a background layer become interactive
+                    promoted = self.promote_background_lines({self._str_to_segment_key(k) for k, d in segments.items() if d.get("trays")})
+                    if promoted: print(f"M: {promoted} background lines promoted to tray segments.")
                     
                     # Optimization: Build map of scene lines
                     lines_map = {} 
@@ -1847,8 +2232,8 @@ class MainWindow(QMainWindow):
 
     def populate_connections_list(self):
         self.table_connections.setRowCount(len(self.all_connections))
-        columns = ["ID", "From", "To", "Type", "Formation", "Circuit", "Diameter"]
-        keys = ["ID", "FROM", "TO", "Cable Type", "Cable Formation", "Circuit Type", "Diameter (mm)"]
+        columns = ["ID", "From", "To", "Type", "Formation", "Circuit", "Diameter", "Redundancy"]
+        keys = ["ID", "FROM", "TO", "Cable Type", "Cable Formation", "Circuit Type", "Diameter (mm)", "Redundancy Group"]
         
         self.table_connections.setColumnCount(len(columns))
         self.table_connections.setHorizontalHeaderLabels(columns)
@@ -1872,13 +2257,11 @@ class MainWindow(QMainWindow):
         detailed_boq = [] # For optional detailed sheet, but for now simple agg
         
         processed_count = 0
-        for conn in self.all_connections:
-            if '_route_path' in conn:
-                path = conn['_route_path']
-                length_px = path.length()
-                # Use raw units
-                length = length_px 
-                
+        store = self.route_store
+        if store is not None:
+            # Lengths are precomputed in raw drawing units
+            for conn_idx, length in zip(store.conn.tolist(), store.lengths.tolist()):
+                conn = self.all_connections[conn_idx]
                 k = (conn.get('Cable Type', 'Unknown'), conn.get('Cable Formation', 'Unknown'))
                 boq[k] = boq.get(k, 0.0) + length
                 processed_count += 1
@@ -1893,62 +2276,23 @@ class MainWindow(QMainWindow):
                 with open(path, 'w', newline='', encoding='utf-8') as f:
                     writer = csv.writer(f)
                     writer.writerow(["Cable Type", "Formation", "Total Length (units)"])
+                    for (cable_type, formation), length in sorted(boq.items()):
+                        writer.writerow([cable_type, formation, f"{length:.2f}"])
                 QMessageBox.information(self, "Export", f"Computo esportato con successo.\n{processed_count} cavi inclusi.")
             except Exception as e:
                 QMessageBox.critical(self, "Errore", f"Errore durante l'export: {e}")
 
 
+    def add_label_layer(self):
+        self.label_layer = SegmentLabelLayer()
+        self.label_layer.setVisible(self.act_toggle_labels.isChecked())
+        self.scene.addItem(self.label_layer)
+
     def update_segment_label(self, key, line, text):
-        # Remove old if exists
-        if key in self.segment_labels:
-            item = self.segment_labels[key]
-            if item.scene() == self.scene:
-                self.scene.removeItem(item)
-            del self.segment_labels[key]
-            
-        # Create new
-        lbl = QGraphicsTextItem(text)
-        lbl.setDefaultTextColor(QColor("blue"))
-        font = QFont("Arial", 8)
-        lbl.setFont(font)
-        
-        # Make movable
-        lbl.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable)
-        lbl.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable)
-        
-        # Position at center with Offset
-        center = line.pointAt(0.5)
-        rect = lbl.boundingRect()
-        
-        # Calculate perpendicular offset
-        angle = line.angle() * math.pi / 180.0
-        # QLineF angle is 0..360.
-        # Normal vector (90 deg rotation)
-        # angle implies direction. Perpendicular is +90 deg
-        offset_angle = angle + math.pi / 2
-        
-        offset_dist = 15.0
-        off_x = offset_dist * math.cos(offset_angle)
-        off_y = -offset_dist * math.sin(offset_angle) # Y is inverted in Qt Scene normally? 
-        # Actually QLineF angle() is mathematical (CCW from X axis)? 
-        # Qt Y grows downwards. QLineF.angle() returns 0 for vector (1,0).
-        # For vector (1, -1) (up-right), angle is 315 or 45?
-        # Let's rely on standard trig.
-        
-        # Adjust for Y-down coordinate system if needed, but let's try standard math first.
-        # If I want "above" the line visually...
-        
-        lbl.setPos(center.x() + off_x - rect.width()/2, center.y() + off_y - rect.height()/2)
-        lbl.setZValue(150) # On top of everything
-        
-        # Visibility (Global AND Individual)
+        # Only stores the text: the layer lays it out when it first becomes visible
+        if self.label_layer is None:
+            self.add_label_layer()
         if key not in self.segment_label_visibility:
              self.segment_label_visibility[key] = True # Default True
-             
-        global_vis = self.act_toggle_labels.isChecked()
-        indiv_vis = self.segment_label_visibility[key]
-        lbl.setVisible(global_vis and indiv_vis)
-        
-        self.scene.addItem(lbl)
-        self.segment_labels[key] = lbl
+        self.label_layer.set_label(key, line, text, self.segment_label_visibility[key])
 